@@ -8,13 +8,31 @@ from tqdm import trange
 from datetime import datetime
 import json
 from collections import defaultdict
+from stats import CohortSummary, MomentStats
+from sketch import new_index, load_index, save_index, update_index, query_index
+from consensus import consensus_file, find_consensus
+from normalization import standardize, rescale, drift, json_name, read_standardized, new_versions, load_versions, \
+    save_versions, add_version, load_means, set_sample_version, prune_versions
+from pangenomex.depth import bam_depth, baseline_depth, load_baseline, save_baseline
+from pangenomex.bubbles import sample_bubbles, cohort_bubbles, load_bub_results, save_bub_results
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-config', type=str, help="Path to the '.config' file ", required=True)
+parser.add_argument('-i', type=str, help="Path to the 'new_df.csv' file ", required=True)
 parser.add_argument('-rj', type=str, help="Path to the 'rj_means_and_n.json' file ", required=True)
+parser.add_argument('-stats', type=str, default='rj_stats.npz',
+                    help="Path to the mergeable depth statistics written next to 'rj_means_and_n.json'")
 parser.add_argument('-bub', type=str, help="Path to the 'bub_results.npz' file ", required=True)
 parser.add_argument('-edge', type=str, help="Path to the 'df_edge.csv' file ", required=True)
-args = parser.parse_args()
+parser.add_argument('-sketch', type=str, default='data/sketch_index.npz',
+                    help="k-mer sketch index of the existing samples' .fas files, built on first use")
+parser.add_argument('-seq_dir', type=str, default=None,
+                    help="Directory of the seq_ext.py sequence files (seq_ext.py -o; default: next to each BAM)")
+parser.add_argument('-restandardize', action='store_true', default=False,
+                    help="Re-standardize and re-bubble stored samples whose values drift past -tol under the new means")
+parser.add_argument('-tol', type=float, default=0.05, help="Largest tolerated change of a standardized value")
+parser.add_argument('-jobs', type=int, default=1, help="Worker processes for -restandardize")
+parser.add_argument('-batch', type=int, default=16, help="Samples per -restandardize batch")
 
 
 def get_std_dep(df, chr_len_list, read_len, log_filename):
@@ -25,7 +43,7 @@ def get_std_dep(df, chr_len_list, read_len, log_filename):
         print(f'process {filename} ..................')
         if os.path.isfile(filename):
             try:
-                sample_depth = calcu_bam_dep(chr_len_list, filename, read_len)
+                sample_depth = bam_depth(filename, chr_len_list, read_len)
                 sample_depths.append(sample_depth)
             except Exception as e:
                 current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -40,41 +58,51 @@ def get_std_dep(df, chr_len_list, read_len, log_filename):
 
 def incrementally_update_standardized_depth(new_sample_depths, chr_len_list,
                                             rj_means_and_n_filename="rj_means_and_n.json",
-                                            save_filename="updated_rj_means_and_n.json"):
+                                            save_filename="updated_rj_means_and_n.json",
+                                            stats_filename="rj_stats.npz",
+                                            save_stats_filename="updated_rj_stats.npz", epsilon=1e-6):
     with open(rj_means_and_n_filename, "r") as f:
         rj_means_dict = json.load(f)
 
-    new_standardized_depths_list = defaultdict(dict)
+    # Summary of the existing cohort; older runs only stored the means (which include epsilon)
+    if os.path.isfile(stats_filename):
+        existing = CohortSummary.load(stats_filename)
+    else:
+        existing = CohortSummary()
+        for chr_name in rj_means_dict:
+            existing.moments[chr_name] = MomentStats.from_mean(
+                np.array(rj_means_dict[chr_name]["Rj_means"]) - epsilon, rj_means_dict[chr_name]["n_samples"])
+
+    new_summary = CohortSummary()
+    for new_sample_depth in new_sample_depths:
+        new_summary.update(new_sample_depth)
+    merged = existing.merge(new_summary)
 
-    n_samples = sum([1 for sample in new_sample_depths])
+    new_standardized_depths_list = defaultdict(dict)
+    updated_means = {}
 
     for chr_name, chr_len in chr_len_list:
         if chr_name not in rj_means_dict:
             print(f"Warning: Chromosome {chr_name} not found in the saved Rj_means file.")
             continue
 
-        Rj_means = np.array(rj_means_dict[chr_name]["Rj_means"])
-        existing_n_samples = rj_means_dict[chr_name]["n_samples"]
-
-        all_samples_depth = np.array([new_sample_depth[chr_name] for new_sample_depth in new_sample_depths])
-
-        new_sample_depth_mean = np.mean(all_samples_depth, axis=0)
-        updated_Rj_means = (Rj_means * existing_n_samples + new_sample_depth_mean * n_samples) / (
-                    existing_n_samples + n_samples)
+        updated_Rj_means = merged.mean(chr_name) + epsilon
+        updated_n_samples = merged.count(chr_name)
+        updated_means[chr_name] = updated_Rj_means
 
-        updated_n_samples = existing_n_samples + n_samples
-
-        for sample_idx, sample_depth in enumerate(all_samples_depth):
-            standardized_depth = (sample_depth / updated_Rj_means) / Rj_means
-            new_standardized_depths_list[sample_idx][chr_name] = np.round(standardized_depth, 2)
+        # Same standardization as data_processing.py, against the updated means
+        for sample_idx, new_sample_depth in enumerate(new_sample_depths):
+            new_standardized_depths_list[sample_idx][chr_name] = standardize(new_sample_depth[chr_name],
+                                                                             updated_Rj_means, epsilon)
 
         rj_means_dict[chr_name]["Rj_means"] = updated_Rj_means.tolist()
         rj_means_dict[chr_name]["n_samples"] = updated_n_samples
 
     with open(save_filename, "w") as f:
         json.dump(rj_means_dict, f, indent=4)
+    merged.save(save_stats_filename)
 
-    return new_standardized_depths_list
+    return new_standardized_depths_list, updated_means
 
 
 def save2json(standardized_depths, filename):
@@ -88,71 +116,81 @@ def save2json(standardized_depths, filename):
         json.dump(standardized_depths_serializable, jsonfile)
 
 
-def calculate_homology(seq1, seq2):
-    from Bio import pairwise2
-    alignments = pairwise2.align.globalxx(seq1, seq2)
-    best_alignment = alignments[0]
-    aligned_seq1 = best_alignment[0]
-    aligned_seq2 = best_alignment[1]
-
-    matching_bases = sum(1 for a, b in zip(aligned_seq1, aligned_seq2) if a == b)
-    total_length = len(aligned_seq1.replace("-", ""))  # 排除gap
-    homology_percentage = (matching_bases / total_length) * 100
-    return homology_percentage
-
-
-def gen_bub(differ, a, b):
-    segments = []
-    start = None
-    for i in range(len(differ)):
-        if differ[i] > 0 or differ[i] < 0:
-            if start is None:
-                start = i
-        else:
-            if start is not None:
-                length = i - start
-                if length >= 5000:
-                    segments.append((start, length))
-                start = None
-    result = []
-    for start, length in segments:
-        a_segment = a[start:start + length]
-        b_segment = b[start:start + length]
-        logr = np.round(np.log2(np.mean(a_segment) / np.mean(b_segment)), 2)
-        result.append([start, length, logr])
-
-    return result
-
-
-def gen_bub_res(df,  chr_len_list, baseline_data, json_dir):
-    bub_results = []
-
-    for i in trange(df.shape[0]):
-        mapping = f"sample_{i}"
-        sample = df.loc[df['mapping'] == mapping]['file_name'].values[0]
-        filename_part_ = os.path.basename(sample).replace('.bam', '.json')
-        filename = os.path.join(json_dir, filename_part_)
-        print(f'process {filename} ..................')
+def replace_bubbles(bub_df, new_rows):
+    # New unlabeled bubbles of the samples in new_rows ({sample: rows}); their labeled CNVs
+    # (label 1) stay and still mask overlapping bubbles. Samples match by sample_key(), as the
+    # CNV list may name them differently from the sample lists.
+    keys = bub_df['filename'].map(sample_key)
+    replaced = keys.isin({sample_key(sample) for sample in new_rows})
+    new_df = pd.DataFrame([row for rows in new_rows.values() for row in rows], columns=bub_df.columns)
+    new_keys = new_df['filename'].map(sample_key)
+    for i, row in bub_df[replaced & (bub_df['label'] == 1)].iterrows():
+        new_df = new_df[~((new_keys[new_df.index] == keys[i]) & (new_df['chr_name'] == row['chr_name']) &
+                          (new_df['start'] < row['start'] + row['length']) &
+                          (new_df['start'] + new_df['length'] > row['start']))]
+    return pd.concat([bub_df[~(replaced & (bub_df['label'] == 0))], new_df], ignore_index=True)
+
+
+def update_baseline(baseline_save_path, baseline_samples, json_dir, chr_len_list, removed, added):
+    # The baseline is the mean standardized depth of the baseline samples: re-standardized ones
+    # move from their old values (removed) to their new ones (added) in baseline_stats.npz.
+    # Runs without it (older data_processing.py) re-read every baseline sample.
+    stats_file = os.path.join(baseline_save_path, 'baseline_stats.npz')
+    if os.path.isfile(stats_file):
+        summary = CohortSummary.load(stats_file).subtract(removed).merge(added)
+    else:
+        summary = CohortSummary()
+        for sample in baseline_samples:
+            filename = os.path.join(json_dir, json_name(sample))
+            if os.path.isfile(filename):
+                summary.update(load_from_json(filename))
+    baseline_data = baseline_depth(summary, chr_len_list)
+    save_baseline(baseline_data, baseline_save_path)
+    summary.save(stats_file)
+    return baseline_data
+
+
+def restandardize_batch(entries):
+    # Worker: move a batch of stored samples to the newest means if they drift past the tolerance.
+    # The raw depth cached by data_processing.py is used when present, otherwise the stored
+    # standardized values are rescaled by R_old / R_new. Old and new values of re-standardized
+    # baseline samples are summarized for the baseline update.
+    results = []
+    removed, added = CohortSummary(), CohortSummary()
+    means = shared.setdefault('means', {})
+    for name, entry in entries:
+        filename = os.path.join(shared['json_dir'], name)
+        if not os.path.isfile(filename):
+            continue
+        if entry['version'] not in means:
+            means[entry['version']] = load_means(shared['json_dir'], entry['version'])
+        old_means = means[entry['version']]
         standardized_depth = load_from_json(filename)
-        for chr_name, chr_len in chr_len_list:
-            s = standardized_depth[chr_name]
-            b = baseline_data[chr_name]
-            dif = s - b
-            result = gen_bub(dif, s, b)
-            for start, length, logr in result:
-                bub_results.append([sample, chr_name, start, length, logr, 0])
-
-    columns = ['filename', 'chr_name', 'start', 'length', 'logr', 'label']
-    bub_df = pd.DataFrame(bub_results, columns=columns)
-    return bub_df
+        depth_file = os.path.join(shared['dep_dir'], name.replace('.json', '.npz'))
+        raw_depth = load_npz_file(depth_file) if os.path.isfile(depth_file) else None
+        updated = {}
+        for chr_name, chr_len in shared['chr_len_list']:
+            if raw_depth is not None:
+                updated[chr_name] = standardize(raw_depth[chr_name], shared['new_means'][chr_name])
+            else:
+                updated[chr_name] = rescale(standardized_depth[chr_name], old_means[chr_name],
+                                            shared['new_means'][chr_name])
+        change = drift(standardized_depth, updated)
+        results.append((name, change))
+        if change <= shared['tol']:
+            continue
+        save2json(updated, filename)
+        if entry['file_name'] in shared['baseline_samples']:
+            removed.update(standardized_depth)
+            added.update(updated)
+    return results, removed, added
 
 
-def load_bub_results(npz_file):
-    data = np.load(npz_file, allow_pickle=True)
-    bub_array = data['bub_array']
-    columns = data['columns']
-    bub_results = pd.DataFrame(bub_array, columns=columns)
-    return bub_results
+def bubble_batch(samples):
+    # Worker: bubbles of a batch of samples against the (updated) baseline
+    return [(sample, sample_bubbles(sample, load_from_json(os.path.join(shared['json_dir'], json_name(sample))),
+                                    shared['chr_len_list'], shared['baseline_data']))
+            for sample in samples]
 
 
 def main():
@@ -173,13 +211,36 @@ def main():
     new_df = pd.read_csv(new_file_list, index_col=0)
 
     new_sample_depths = get_std_dep(new_df, chr_len_list, read_len, log_filename)
-    new_standardized_depths_list = incrementally_update_standardized_depth(new_sample_depths, chr_len_list, args.rj)
+    with open(args.rj, "r") as f:
+        previous_means = {chr_name: np.array(value["Rj_means"]) for chr_name, value in json.load(f).items()}
+    new_standardized_depths_list, updated_means = incrementally_update_standardized_depth(
+        new_sample_depths, chr_len_list, args.rj, stats_filename=args.stats)
 
     print('save to file ...')
     json_dir = 'data/nor/'
     if not os.path.exists(json_dir):
         os.makedirs(json_dir)
 
+    test_file_list = paths['test_file_list']
+    test_df = pd.read_csv(test_file_list, index_col=0)
+    train_file_list = paths['train_file_list']
+    train_df = pd.read_csv(train_file_list, index_col=0)
+    all_df = pd.concat([test_df['file_name'], train_df['file_name']], ignore_index=True)
+    all_df = all_df.to_frame(name='file_name')
+    all_df['mapping'] = ['sample_' + str(i) for i in range(len(all_df))]
+
+    # Normalization versions: which Rj_means each stored sample was standardized against.
+    # Without a registry (older runs) every stored sample is on the means in -rj.
+    versions = load_versions(json_dir)
+    if versions is None:
+        versions = new_versions()
+        version = add_version(json_dir, versions, previous_means)
+        baseline_df = pd.read_csv(paths['baseline_file_list'], index_col=0)
+        for sample in pd.concat([all_df['file_name'], baseline_df['file_name']]):
+            if os.path.isfile(os.path.join(json_dir, json_name(sample))):
+                set_sample_version(versions, sample, version)
+    new_version = add_version(json_dir, versions, updated_means)
+
     for i in trange(new_df.shape[0]):
         # Mapping
         mapping = f"sample_{i}"
@@ -191,59 +252,94 @@ def main():
 
         standardized_depths = new_standardized_depths_list[i]
         save2json(standardized_depths, new_filename)
+        set_sample_version(versions, sample, new_version)
 
 ##############################################################################################
     baseline_save_path = paths['baseline_save_path']
-    baseline_data = {}
-    for chr_name, chr_len in chr_len_list:
-        file_path = f'{baseline_save_path}/baseline_file_{chr_name}.npz'
-        loaded_data = load_npz_file(file_path)
-        baseline_data[chr_name] = loaded_data[chr_name]
-
-    new_bub_df = gen_bub_res(new_df, chr_len_list, baseline_data, json_dir)
+    baseline_data = load_baseline(baseline_save_path, chr_len_list)
     bub_results = load_bub_results(args.bub)
+    rebubble = []
+
+    if args.restandardize:
+        # Drift-aware: only stored samples whose values move past -tol are rewritten and re-bubbled
+        stale = [(name, entry) for name, entry in versions['samples'].items() if entry['version'] != new_version]
+        batches = [stale[i:i + args.batch] for i in range(0, len(stale), args.batch)]
+        print(f"Checking {len(stale)} stored samples for drift (tolerance {args.tol}) ..................")
+        baseline_samples = list(pd.read_csv(paths['baseline_file_list'], index_col=0)['file_name'])
+        restandardized = []
+        max_drift = 0.0
+        removed, added = CohortSummary(), CohortSummary()
+        for results, batch_removed, batch_added in run_batches(
+                restandardize_batch, batches, args.jobs, json_dir=json_dir, dep_dir='data/dep/',
+                chr_len_list=chr_len_list, new_means=updated_means, tol=args.tol,
+                baseline_samples=set(baseline_samples)):
+            removed, added = removed.merge(batch_removed), added.merge(batch_added)
+            for name, change in results:
+                max_drift = max(max_drift, change)
+                if change <= args.tol:
+                    continue
+                versions['samples'][name]['version'] = new_version
+                restandardized.append(versions['samples'][name]['file_name'])
+        print(f"Re-standardized {len(restandardized)} of {len(stale)} stored samples (largest drift {max_drift:.4f})")
+
+        # Bubbles compare a sample with the baseline, so both sides move to the new means: the
+        # baseline is rebuilt from its re-standardized samples, and if it moved past -tol every
+        # bubbled sample is re-bubbled, otherwise only the re-standardized ones
+        bubbled = {sample_key(sample): sample for sample in bub_results['filename']}
+        bubbled.update((sample_key(sample), sample) for sample in all_df['file_name'])
+        rebubble = [sample for sample in restandardized if sample_key(sample) in bubbled]
+        if added.moments:
+            previous_baseline = baseline_data
+            baseline_data = update_baseline(baseline_save_path, baseline_samples, json_dir, chr_len_list,
+                                            removed, added)
+            baseline_change = drift(previous_baseline, baseline_data)
+            print(f"Baseline updated, largest change {baseline_change:.4f}")
+            if baseline_change > args.tol:
+                rebubble = sorted(sample for sample in bubbled.values()
+                                  if os.path.isfile(os.path.join(json_dir, json_name(sample))))
+        batches = [rebubble[i:i + args.batch] for i in range(0, len(rebubble), args.batch)]
+        print(f"Re-bubbling {len(rebubble)} stored samples ..................")
+        new_rows = {}
+        for results in run_batches(bubble_batch, batches, args.jobs, json_dir=json_dir,
+                                   chr_len_list=chr_len_list, baseline_data=baseline_data):
+            new_rows.update(results)
+        bub_results = replace_bubbles(bub_results, new_rows)
+    prune_versions(json_dir, versions)
+    save_versions(json_dir, versions)
+
+    new_bub_df = cohort_bubbles(read_standardized(sample_files(new_df), json_dir), chr_len_list, baseline_data)
     updated_bub_df = pd.concat([bub_results, new_bub_df], ignore_index=True)
-    updated_bub_array = updated_bub_df.to_numpy()
-    np.savez('new_bub_results.npz', bub_array=updated_bub_array, columns=updated_bub_df.columns.values)
+    # The re-bubbled samples are recorded for tree2graph.py -update, which replaces their nodes
+    save_bub_results(updated_bub_df, 'new_bub_results.npz', replaced=rebubble)
 
 ##############################################################################################
-    df_edge = pd.read_csv(args.edge, index_col=0)
+    # object dtype: the diagonal holds 'NA' next to the 0/1 edges (pandas 2 refuses it in a float column)
+    df_edge = pd.read_csv(args.edge, index_col=0).astype(object)
     max_homology_dict = {}
-    test_file_list = paths['test_file_list']
-    test_df = pd.read_csv(test_file_list, index_col=0)
-    train_file_list = paths['train_file_list']
-    train_df = pd.read_csv(train_file_list, index_col=0)
-    all_df = pd.concat([test_df['file_name'], train_df['file_name']], ignore_index=True)
-    all_df = all_df.to_frame(name='file_name')
-    all_df['mapping'] = ['sample_' + str(i) for i in range(len(all_df))]
+
+    # Nearest existing sample by MinHash similarity of the .fas k-mer sketches. The index is
+    # persisted and only new or changed .fas files are sketched; the new samples stay in it
+    # as existing ones for the next incremental update. Samples are named '<sample>.fas' as in
+    # df_edge.csv, whether seq_ext wrote them as .fas or .2bit.
+    all_fas = [consensus_file(filename) for filename in all_df['file_name']]
+    new_fas = [consensus_file(filename) for filename in new_df['file_name']]
+    sequence_files = [find_consensus(filename, args.seq_dir)
+                      for filename in list(all_df['file_name']) + list(new_df['file_name'])]
+    index = load_index(args.sketch) if os.path.isfile(args.sketch) else new_index()
+    if update_index(index, sequence_files, [os.path.basename(filename) for filename in all_fas + new_fas]):
+        save_index(index, args.sketch)
+    existing = [os.path.basename(filename) for filename in all_fas]
+    position = {str(name): j for j, name in enumerate(index['names'])}
 
     for i in trange(new_df.shape[0]):
-        time.sleep(0.01)
         mapping = f"sample_{i}"
         new_filename = new_df.loc[new_df['mapping'] == mapping]['file_name'].values[0]
-        file_name_ = os.path.splitext(new_filename)[0] + '.fas'
-        seq1 = read_fasta_file(file_name_)
-        sequence1 = list(seq1.values())[0]
-
-        new_filename_basename = os.path.basename(file_name_)
-
-        max_homology = -1
-        max_all_filename = None
-
-        for j in trange(all_df.shape[0]):
-            mapping_all = f"sample_{j}"
-            all_filename = all_df.loc[all_df['mapping'] == mapping_all]['file_name'].values[0]
-            file_name_all = os.path.splitext(all_filename)[0] + '.fas'
-            seq2 = read_fasta_file(file_name_all)
-            sequence2 = list(seq2.values())[0]
-
-            homology = calculate_homology(sequence1, sequence2)
-
-            if homology > max_homology:
-                max_homology = homology
-                max_all_filename = os.path.basename(file_name_all)
+        new_filename_basename = os.path.basename(os.path.splitext(new_filename)[0] + '.fas')
 
-        max_homology_dict[new_filename_basename] = {'max_homology': max_homology, 'close_filename': max_all_filename}
+        sketch = index['hashes'][position[new_filename_basename]]
+        close_filename, similarity = query_index(index, sketch, candidates=existing)[0]
+        print(f"{new_filename_basename}: closest sample {close_filename}, similarity {similarity:.4f}")
+        max_homology_dict[new_filename_basename] = {'similarity': similarity, 'close_filename': close_filename}
 
     for new_sample, info in max_homology_dict.items():
         close_sample = info['close_filename']
@@ -266,6 +362,7 @@ def main():
 
 
 if __name__ == '__main__':
+    args = parser.parse_args()
     st = time.time()
     main()
     et = time.time()
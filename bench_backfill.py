@@ -0,0 +1,68 @@
+import time
+import argparse
+import numpy as np
+from consensus import PLACEHOLDER, backfill_reference
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-length', type=int, default=248956422, help="Bases of the synthetic chromosome (default: chr1 of hg38)")
+parser.add_argument('-uncovered', type=float, default=0.3, help="Fraction of positions no read covers")
+parser.add_argument('-runs', type=int, default=3, help="Timed runs of the vectorized back-fill")
+parser.add_argument('-legacy_length', type=int, default=200000,
+                    help="Bases for the former per-base loop (0: skip it); its rate is extrapolated")
+parser.add_argument('-seed', type=int, default=42)
+
+
+def synthetic_input(length, uncovered, rng):
+    reference = np.frombuffer(b'ACGT', dtype=np.uint8)[rng.integers(0, 4, size=length)]
+    filled = np.frombuffer(b'ACGT', dtype=np.uint8)[rng.integers(0, 4, size=length)]
+    filled[rng.random(length) < uncovered] = PLACEHOLDER
+    return reference, filled
+
+
+def legacy_backfill(reference, filled):
+    # The string loop seq_ext used before backfill_reference
+    replaced = ''
+    for i in range(len(filled)):
+        if filled[i] == 'R':
+            replaced += reference[i]
+        else:
+            replaced += filled[i]
+    return replaced
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    reference, filled = synthetic_input(args.length, args.uncovered, rng)
+    print(f"{args.length} bases, {np.count_nonzero(filled == PLACEHOLDER)} to back-fill")
+
+    times = []
+    for _ in range(args.runs):
+        buffer = filled.copy()
+        st = time.perf_counter()
+        backfill_reference(buffer, reference)
+        times.append(time.perf_counter() - st)
+    mask = filled == PLACEHOLDER
+    assert np.array_equal(buffer[mask], reference[mask]) and np.array_equal(buffer[~mask], filled[~mask])
+    best = min(times)
+    rate = args.length / best
+    print(f"vectorized: {best:.3f}s best of {args.runs}, {rate / 1e6:.1f} Mbases/s")
+
+    if args.legacy_length > 0:
+        n = min(args.legacy_length, args.length)
+        ref_str = reference[:n].tobytes().decode('ascii')
+        filled_str = filled[:n].tobytes().decode('ascii')
+        st = time.perf_counter()
+        replaced = legacy_backfill(ref_str, filled_str)
+        legacy_rate = n / (time.perf_counter() - st)
+        assert replaced.encode('ascii') == buffer[:n].tobytes()
+        print(f"per-base loop: {legacy_rate / 1e6:.2f} Mbases/s on {n} bases, "
+              f"~{args.length / legacy_rate:.0f}s for the full length; speedup x{rate / legacy_rate:.0f}")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    st = time.time()
+    main()
+    et = time.time()
+    rt = et - st
+    print(f"Finish! runtime: {rt}sec")
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import multiprocessing as mp
+from contextlib import contextmanager
+from datetime import datetime
+from graph_prep import max_rss_mb
+from synthetic_cohort import generate_cohort
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-samples', type=str, default='12,24',
+                    help="Comma-separated cohort sizes; below about 12 the graph is too small to train on")
+parser.add_argument('-length', type=str, default='200000,400000',
+                    help="Comma-separated genome lengths; chromosomes should be several times -cnv_len")
+parser.add_argument('-depth', type=str, default='20', help="Comma-separated read depths")
+parser.add_argument('-chroms', type=int, default=2, help="Chromosomes the genome is split into")
+parser.add_argument('-read_len', type=int, default=100, help="Read length")
+parser.add_argument('-cnvs', type=int, default=1, help="CNVs planted per train / test sample")
+parser.add_argument('-cnv_len', type=int, default=30000,
+                    help="Length of a planted CNV; ZIP-Caller's defaults only call CNVs of about 20 kb and more")
+parser.add_argument('-epochs', type=int, default=50, help="GCN training epochs")
+parser.add_argument('-arch', type=str, default='gcn', choices=['gcn', 'sgc'], help="GCN architecture, as in pgcnv.py")
+parser.add_argument('-trace', action='store_true', default=False,
+                    help="Also record the peak of Python/numpy allocations per stage (tracemalloc); "
+                         "this slows the Python loops down several times, so compare times only between runs alike")
+parser.add_argument('-work', type=str, default=None,
+                    help="Directory for the synthetic cohorts, kept afterwards (default: a temporary directory)")
+parser.add_argument('-o', type=str, default=None,
+                    help="Results (.json); default: bench_results/pipeline_<time>.json")
+parser.add_argument('-compare', type=str, default=None, help="Earlier results (.json) to compare the stage times with")
+parser.add_argument('-seed', type=int, default=42)
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+# How often the resident set size is sampled during a stage
+RSS_INTERVAL = 0.01
+
+
+def rss_mb():
+    # Current resident set size (Linux); None elsewhere, where only the high-water mark is reported
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@contextmanager
+def profile_stage(name, report, trace=False):
+    # Wall and CPU time, and the peak resident set size sampled by a thread while the stage runs.
+    # Each scale runs in its own process, so max_rss_mb (the process high-water mark) starts clean.
+    start_rss = rss_mb()
+    peak = [start_rss]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_INTERVAL):
+            peak[0] = max(peak[0], rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    if start_rss is not None:
+        sampler.start()
+    if trace:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+    st, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        # The sampler stops even if the stage fails
+        stage = {'stage': name, 'sec': time.perf_counter() - st, 'cpu_sec': time.process_time() - cpu}
+        done.set()
+        if start_rss is not None:
+            sampler.join()
+    if start_rss is not None:
+        peak[0] = max(peak[0], rss_mb())
+        stage.update(rss_start_mb=start_rss, rss_peak_mb=peak[0])
+    stage['max_rss_mb'] = max_rss_mb()
+    if trace:
+        stage['traced_peak_mb'] = (tracemalloc.get_traced_memory()[1] - base) / 2 ** 20
+    report.append(stage)
+    print(f"[{name}] {stage['sec']:.2f}s, max RSS {stage['max_rss_mb']:.1f} MB")
+
+
+def torch_warmup():
+    # torch imports much of itself on the first optimizer it builds (several seconds, once per
+    # process); done before the stages so the gcn stage measures training only
+    import torch
+    st = time.perf_counter()
+    torch.optim.Adam([torch.zeros(1, requires_grad=True)])
+    return time.perf_counter() - st
+
+
+def run_scale(cohort, epochs, arch, trace):
+    # One scale, in a fresh process: pangenomex.workflow.run with every stage profiled
+    from pangenomex.workflow import config_inputs, run
+    warmup_sec = torch_warmup()
+    report = []
+    result = run(**config_inputs(cohort['config'], cohort['clist'], cohort['nwk']),
+                 stage=lambda name: profile_stage(name, report, trace), arch=arch, epochs=epochs, verbose=False)
+    counts = {
+        'calls': len(result['calls']),
+        'bubbles': len(result['bubbles']),
+        'nodes': len(result['graph']['name']),
+        'edges': int(result['graph']['edge_index'].shape[1]),
+        'scored': len(result['results']),
+        'labeled_0': int((result['graph']['label'] == 0).sum()),
+        'labeled_1': int((result['graph']['label'] == 1).sum()),
+    }
+    # Without edges or without both classes the gcn stage times a degenerate problem
+    if counts['edges'] == 0 or counts['labeled_0'] == 0 or counts['labeled_1'] == 0:
+        raise RuntimeError(f"The cohort gives a degenerate graph ({counts['nodes']} nodes, {counts['edges']} edges, "
+                           f"{counts['labeled_0']} / {counts['labeled_1']} nodes labeled 0 / 1): "
+                           f"use more -samples or a longer -length")
+    return report, counts, warmup_sec
+
+
+def throughput(stage, scale, counts):
+    # Work done per second: reads for depth, sample bases for the per-sample stages, nodes for the graph
+    groups = scale['groups']
+    work = {
+        'depth': (scale['reads'], 'reads'),
+        'standardize': (sum(groups.values()) * scale['length'], 'bases'),
+        'zipcaller': (groups['test'] * scale['length'], 'bases'),
+        'bubbles': ((groups['train'] + groups['test']) * scale['length'], 'bases'),
+        'tree2graph': (counts['nodes'], 'nodes'),
+        'gcn': (counts['nodes'], 'nodes'),
+    }
+    amount, unit = work[stage['stage']]
+    return {'work': amount, 'unit': unit, 'per_sec': amount / stage['sec'] if stage['sec'] > 0 else None}
+
+
+def environment():
+    import numpy, pandas, pysam, torch
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'pysam': pysam.__version__,
+        'torch': torch.__version__,
+    }
+
+
+def scale_key(scale):
+    return (scale['samples'], scale['length'], scale['depth'], scale['chroms'])
+
+
+def print_scale(scale):
+    print(f"\n{scale['samples']} samples x {scale['length']} bases, depth {scale['depth']}: "
+          f"{scale['reads']} reads, generated in {scale['generate_sec']:.1f}s")
+    print(f"{'stage':<12}{'sec':>9}{'cpu_sec':>9}{'rss_peak_mb':>13}{'max_rss_mb':>12}  throughput")
+    for stage in scale['stages']:
+        rss = stage.get('rss_peak_mb')
+        rate = stage['throughput']['per_sec']
+        print(f"{stage['stage']:<12}{stage['sec']:>9.2f}{stage['cpu_sec']:>9.2f}"
+              f"{'-' if rss is None else f'{rss:.1f}':>13}{stage['max_rss_mb']:>12.1f}  "
+              f"{'-' if rate is None else f'{rate:,.0f}'} {stage['throughput']['unit']}/s")
+    print(f"{'total':<12}{scale['total_sec']:>9.2f}")
+
+
+def compare(results, previous_file):
+    # Stage times against an earlier run, scale by scale (only scales present in both)
+    with open(previous_file, 'r') as f:
+        previous = {scale_key(scale): scale for scale in json.load(f)['scales']}
+    print(f"\nCompared with '{previous_file}' (ratio > 1: slower now)")
+    for scale in results['scales']:
+        old = previous.get(scale_key(scale))
+        if old is None:
+            continue
+        old_sec = {stage['stage']: stage['sec'] for stage in old['stages']}
+        ratios = [f"{stage['stage']} x{stage['sec'] / old_sec[stage['stage']]:.2f}" for stage in scale['stages']
+                  if old_sec.get(stage['stage'])]
+        print(f"{scale['samples']} x {scale['length']}, depth {scale['depth']}: " + ', '.join(ratios))
+
+
+def parse_values(text, cast):
+    return [cast(v) for v in text.split(',') if v.strip()]
+
+
+def main():
+    current_datetime = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    output_file = args.o or os.path.join('bench_results', f'pipeline_{current_datetime}.json')
+    work_dir = args.work or tempfile.mkdtemp(prefix='pangenomex_bench_')
+    scales = [(samples, length, depth) for samples in parse_values(args.samples, int)
+              for length in parse_values(args.length, int) for depth in parse_values(args.depth, float)]
+    results = {'time': current_datetime, 'environment': environment(), 'args': vars(args), 'scales': []}
+
+    # Each scale in a spawned process: its memory figures are its own, and stages share nothing with earlier scales
+    context = mp.get_context('spawn')
+    try:
+        for samples, length, depth in scales:
+            print(f"Scale: {samples} samples, genome {length}, depth {depth} ..................")
+            st = time.perf_counter()
+            cohort = generate_cohort(os.path.join(work_dir, f'cohort_{samples}_{length}_{depth:g}'), samples, length,
+                                     args.chroms, depth, args.read_len, args.cnvs, args.cnv_len, args.seed)
+            generate_sec = time.perf_counter() - st
+            with context.Pool(1) as pool:
+                report, counts, warmup_sec = pool.apply(run_scale, (cohort, args.epochs, args.arch, args.trace))
+            scale = {'samples': sum(cohort['groups'].values()), 'groups': cohort['groups'], 'length': length,
+                     'chroms': args.chroms, 'depth': depth, 'reads': cohort['reads'], 'planted_cnvs': cohort['cnvs'],
+                     'generate_sec': generate_sec, 'torch_warmup_sec': warmup_sec, 'counts': counts}
+            for stage in report:
+                stage['throughput'] = throughput(stage, scale, counts)
+            scale['stages'] = report
+            scale['total_sec'] = sum(stage['sec'] for stage in report)
+            results['scales'].append(scale)
+            print_scale(scale)
+    finally:
+        if args.work is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"\nBenchmark saved to '{output_file}'")
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    st = time.time()
+    main()
+    et = time.time()
+    rt = et - st
+    print(f"Finish! runtime: {rt}sec")
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def sweep_join(starts_a, starts_b, window):
+    # starts_a / starts_b must be sorted. Returns every (i, j) with |a_i - b_j| < window.
+    # Each a_i owns the slice (a_i - window, a_i + window) of b; both bounds only move
+    # forward as a_i grows, so searchsorted gives the two pointers of the sweep at once.
+    starts_a = np.asarray(starts_a)
+    starts_b = np.asarray(starts_b)
+    lo = np.searchsorted(starts_b, starts_a - window, side='right')
+    hi = np.searchsorted(starts_b, starts_a + window, side='left')
+    counts = np.maximum(hi - lo, 0)
+    ia = np.repeat(np.arange(len(starts_a)), counts)
+    # offset of every emitted pair inside its own [lo, hi) run
+    run_start = np.repeat(np.cumsum(counts) - counts, counts)
+    ib = np.repeat(lo, counts) + np.arange(counts.sum()) - run_start
+    return ia, ib
+
+
+def logr_sign(logr):
+    logr = np.asarray(logr, dtype=np.float64)
+    return np.where(logr > 0, 1, np.where(logr < 0, -1, 0))
+
+
+def group_keys(chr_names, logr, match_chr=True):
+    sign = logr_sign(logr)
+    if match_chr:
+        chrs = np.asarray(chr_names).astype(str)
+    else:
+        chrs = np.full(len(sign), '', dtype=str)
+    return chrs, sign
+
+
+def join_bubbles(chr_a, start_a, logr_a, chr_b, start_b, logr_b, window=10000, match_chr=True):
+    # Pairs bubbles of two samples that share (chromosome, logR sign) and start within
+    # `window` of each other. Bubbles with logR == 0 (or NaN) never match, as before.
+    # Returns index arrays into the a and b inputs.
+    start_a = np.asarray(start_a, dtype=np.int64)
+    start_b = np.asarray(start_b, dtype=np.int64)
+    chrs_a, sign_a = group_keys(chr_a, logr_a, match_chr)
+    chrs_b, sign_b = group_keys(chr_b, logr_b, match_chr)
+
+    out_a = []
+    out_b = []
+    for chr_name in np.intersect1d(chrs_a, chrs_b):
+        for sign in (1, -1):
+            idx_a = np.where((chrs_a == chr_name) & (sign_a == sign))[0]
+            idx_b = np.where((chrs_b == chr_name) & (sign_b == sign))[0]
+            if len(idx_a) == 0 or len(idx_b) == 0:
+                continue
+            idx_a = idx_a[np.argsort(start_a[idx_a], kind='stable')]
+            idx_b = idx_b[np.argsort(start_b[idx_b], kind='stable')]
+            ia, ib = sweep_join(start_a[idx_a], start_b[idx_b], window)
+            out_a.append(idx_a[ia])
+            out_b.append(idx_b[ib])
+
+    if not out_a:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(out_a), np.concatenate(out_b)
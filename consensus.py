@@ -0,0 +1,106 @@
+import os
+import numpy as np
+import pysam
+
+# Positions no read covers; filled from the reference afterwards
+PLACEHOLDER = ord('R')
+BACKFILL_BLOCK = 1 << 20
+
+
+class BufferPool:
+    # Per-chromosome uint8 buffers (one byte per base), reused from sample to sample.
+    # acquire() always hands out buffers reset to the placeholder, so nothing carries
+    # over from the previous sample; release() returns them for the next one.
+    def __init__(self, lengths):
+        self.lengths = dict(lengths)
+        self.free = []
+
+    def acquire(self):
+        if self.free:
+            buffers = self.free.pop()
+        else:
+            buffers = {name: np.empty(length, dtype=np.uint8) for name, length in self.lengths.items()}
+        for buffer in buffers.values():
+            buffer.fill(PLACEHOLDER)
+        return buffers
+
+    def release(self, buffers):
+        self.free.append(buffers)
+
+
+def copy_read(view, read):
+    # The read's bases at its start position, as bytes; clipped at the chromosome end
+    seq = read.query_sequence
+    if seq is None:
+        return
+    start = read.reference_start
+    end = min(start + len(seq), len(view))
+    if end > start:
+        view[start:end] = seq[:end - start].encode('ascii')
+
+
+def fill_from_bam(buffers, bam_file):
+    # Streams all reads once, into one buffer per chromosome. Later reads overwrite earlier ones.
+    views = {name: memoryview(buffer) for name, buffer in buffers.items()}
+    with pysam.AlignmentFile(bam_file, "r") as bam:
+        for read in bam.fetch(until_eof=True):
+            if read.is_unmapped:
+                continue
+            view = views.get(read.reference_name)
+            if view is not None:
+                copy_read(view, read)
+    return buffers
+
+
+def stream_consensus(bam_file, reference, buffer, index_file=None):
+    # Chromosome by chromosome through the BAM index, so a single buffer as long as the
+    # longest chromosome serves the whole genome. Yields each chromosome's consensus
+    # (reference back-filled), valid until the next one is requested.
+    with pysam.AlignmentFile(bam_file, "r", index_filename=index_file) as bam:
+        for name, ref in reference.items():
+            view = buffer[:len(ref)]
+            view.fill(PLACEHOLDER)
+            if name in bam.references:
+                target = memoryview(view)
+                for read in bam.fetch(name):
+                    if not read.is_unmapped:
+                        copy_read(target, read)
+            yield backfill_reference(view, ref)
+
+
+def backfill_reference(filled, reference):
+    # Positions still holding the placeholder take the reference base; in place, returns `filled`.
+    # Both arguments are uint8 arrays (or bytes-like views) of the same length.
+    if not isinstance(filled, np.ndarray):
+        filled = np.frombuffer(filled, dtype=np.uint8)
+    if not isinstance(reference, np.ndarray):
+        reference = np.frombuffer(reference, dtype=np.uint8)
+    # In blocks, so the boolean mask stays small for chromosome-sized buffers
+    for begin in range(0, len(filled), BACKFILL_BLOCK):
+        block = filled[begin:begin + BACKFILL_BLOCK]
+        np.copyto(block, reference[begin:begin + BACKFILL_BLOCK], where=block == PLACEHOLDER)
+    return filled
+
+
+def consensus_file(bam_file, fmt='fas', out_dir=None):
+    # Where seq_ext writes a sample's consensus, as .fas or .2bit: next to the BAM, or in out_dir
+    name = os.path.splitext(bam_file)[0] + '.' + fmt
+    return os.path.join(out_dir, os.path.basename(name)) if out_dir else name
+
+
+def find_consensus(bam_file, out_dir=None):
+    # The sample's consensus file in whichever format it was written (the newer one if both)
+    found = [path for path in (consensus_file(bam_file, 'fas', out_dir), consensus_file(bam_file, '2bit', out_dir))
+             if os.path.isfile(path)]
+    return max(found, key=os.path.getmtime) if found else consensus_file(bam_file, out_dir=out_dir)
+
+
+def write_consensus(filename, name, chunks):
+    # One FASTA record: the chunks (bytes-like, e.g. uint8 arrays) concatenated on one line.
+    # Written under a temporary name, so a reader never sees a partial file.
+    with open(filename + '.tmp', 'wb') as file:
+        file.write(b'>' + name.encode() + b'\n')
+        for chunk in chunks:
+            file.write(memoryview(chunk))
+        file.write(b'\n')
+    os.replace(filename + '.tmp', filename)
@@ -1,67 +1,70 @@
-from collections import defaultdict
 import pandas as pd
 import time
-from tqdm import trange
 import os
 from datetime import datetime
 from utils import *
 import argparse
+from stats import CohortSummary, merge_all
+from normalization import new_versions, add_version, set_sample_version, save_versions
+from pangenomex.depth import bam_depth, cohort_means, standardize_sample, baseline_depth, save_baseline
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-config', type=str, help="Path to the '.config' file ", required=True)
-args = parser.parse_args()
+parser.add_argument('-jobs', type=int, default=1, help="Worker processes; sample batches are summarized in parallel")
+parser.add_argument('-batch', type=int, default=16, help="Samples per batch")
+parser.add_argument('-keep_depth', action='store_true', default=False,
+                    help="Keep every sample's raw depth in data/dep/ (float32, 4 bytes per position, about 12 GB "
+                         "for a human genome) for exact re-standardization by Incremental_update.py; otherwise "
+                         "each BAM is read twice and nothing is cached")
 
 
-def standardize_depth(sample_depths, chr_len_list, epsilon=1e-6, save_filename="rj_means_and_n.json"):
-    standardized_depths = defaultdict(dict)
-    rj_means_dict = {}
-    n_samples = len(sample_depths)
-
-    for chr_name, chr_len in chr_len_list:
-        # Collect depths for all samples at this chromosome
-        all_samples_depth = np.array([sample_depth[chr_name] for sample_depth in sample_depths])
+def depth_cache_file(sample):
+    return os.path.join(shared['dep_dir'], os.path.basename(sample).replace('.bam', '.npz'))
 
-        # Compute Rj^mode for each sample, adding epsilon to avoid division by zero
-        Rj_median = np.median(all_samples_depth, axis=1) + epsilon
 
-        # Compute Ri·^mean for each position, adding epsilon to avoid division by zero
-        Ri_means = np.mean(all_samples_depth, axis=0) + epsilon
-
-        rj_means_dict[chr_name] = {
-            "Rj_means": Ri_means.tolist(),  # 转换为列表格式
-            "n_samples": n_samples
-        }
-
-        for sample_idx, sample_depth in enumerate(all_samples_depth):
-            # Standardize depth
-            standardized_depth = (sample_depth / Rj_median[sample_idx]) / Ri_means
-            standardized_depths[sample_idx][chr_name] = np.round(standardized_depth, 2)
-
-    with open(save_filename, "w") as f:
-        json.dump(rj_means_dict, f, indent=4)
+def log_error(filename, e):
+    current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+    error_message = f"{current_time}:Error occurred while reading {filename}: {e}"
+    print(error_message)
+    # Write the error message to the log file
+    with open(shared['log_filename'], "a") as log_file:
+        log_file.write(error_message + "\n")
 
-    return standardized_depths
 
-
-def get_std_dep(df, chr_len_list, read_len, log_filename):
-    sample_depths = []
-    for i in trange(df.shape[0]):
-        mapping = f"sample_{i}"
-        filename = df.loc[df['mapping'] == mapping]['file_name'].values[0]
+def summarize_batch(samples):
+    # Map step: raw depths of one batch (cached per sample with -keep_depth) and their mergeable summary
+    summary = CohortSummary()
+    done = []
+    for filename in samples:
         print(f'process {filename} ..................')
         if os.path.isfile(filename):
             try:
-                sample_depth = calcu_bam_dep(chr_len_list, filename, read_len)
-                sample_depths.append(sample_depth)
+                sample_depth = bam_depth(filename, shared['chr_len_list'], shared['read_len'])
             except Exception as e:
-                current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-                error_message = f"{current_time}:Error occurred while reading {filename}: {e}"
-                print(error_message)
-                # Write the error message to the log file
-                with open(log_filename, "a") as log_file:
-                    log_file.write(error_message + "\n")
+                log_error(filename, e)
                 continue
-    return sample_depths
+            if shared['dep_dir'] is not None:
+                np.savez(depth_cache_file(filename), **{k: v.astype(np.float32) for k, v in sample_depth.items()})
+            summary.update(sample_depth)
+            done.append(filename)
+    return summary, done
+
+
+def standardize_batch(samples):
+    # Second pass: standardize against the cohort Rj_means, write data/nor/<sample>.json
+    # and summarize the standardized baseline samples
+    baseline = CohortSummary()
+    for filename in samples:
+        if shared['dep_dir'] is not None:
+            sample_depth = load_npz_file(depth_cache_file(filename))
+        else:
+            sample_depth = bam_depth(filename, shared['chr_len_list'], shared['read_len'])
+        standardized_depths = standardize_sample(sample_depth, shared['rj_means'], shared['chr_len_list'])
+        filename_part = os.path.basename(filename).replace('.bam', '.json')
+        save2json(standardized_depths, os.path.join(shared['json_dir'], filename_part))
+        if filename in shared['baseline_samples']:
+            baseline.update(standardized_depths)
+    return baseline
 
 
 def save2json(standardized_depths, filename):
@@ -117,77 +120,72 @@ def main():
     log_filename = "log/data_processing_log.txt"
     os.makedirs(os.path.dirname(log_filename), exist_ok=True)
 
-    # Standardization
-    all_sample_depths = get_std_dep(all_data, chr_len_list, read_len, log_filename)
-    all_standardized_depths_list = standardize_depth(all_sample_depths, chr_len_list)
-
-    # Save
-    print('save to file ...')
-
-    # Create output directory if it doesn't exist
+    # Batches are never held together: the standardization pass reads each sample's raw depth
+    # again, from the data/dep/ cache with -keep_depth, otherwise from its BAM
+    dep_dir = 'data/dep/' if args.keep_depth else None
+    if dep_dir is not None:
+        os.makedirs(dep_dir, exist_ok=True)
     json_dir = 'data/nor/'
+    os.makedirs(json_dir, exist_ok=True)
 
-    if not os.path.exists(json_dir):
-        os.makedirs(json_dir)
+    samples = list(dict.fromkeys(all_data['file_name']))
+    batches = [samples[i:i + args.batch] for i in range(0, len(samples), args.batch)]
+    common = dict(chr_len_list=chr_len_list, dep_dir=dep_dir, log_filename=log_filename, read_len=read_len)
 
-    for i in trange(all_data.shape[0]):
-        # Mapping
-        mapping = f"sample_{i}"
-        sample = all_data.loc[all_data['mapping'] == mapping]['file_name'].values[0]
+    # Map: each batch is summarized independently; reduce: summaries merge associatively
+    results = list(run_batches(summarize_batch, batches, args.jobs, **common))
+    summary = merge_all(result[0] for result in results)
+    done = [filename for result in results for filename in result[1]]
 
-        filename_part = os.path.basename(sample).replace('.bam', '.json')
-
-        new_filename = os.path.join(json_dir, filename_part)
+    rj_means = cohort_means(summary, chr_len_list)
+    rj_means_dict = {}
+    for chr_name, chr_len in chr_len_list:
+        rj_means_dict[chr_name] = {
+            "Rj_means": rj_means[chr_name].tolist(),  # 转换为列表格式
+            "n_samples": summary.count(chr_name)
+        }
+        print(f"{chr_name}: {summary.count(chr_name)} samples, median depth ~{summary.median(chr_name):.2f}")
+    with open("rj_means_and_n.json", "w") as f:
+        json.dump(rj_means_dict, f, indent=4)
+    summary.save("rj_stats.npz")
 
-        standardized_depths = all_standardized_depths_list[i]
-        save2json(standardized_depths, new_filename)
+    # Standardization
+    print('save to file ...')
+    baseline_samples = set(bl_df['file_name'])
+    done_batches = [done[i:i + args.batch] for i in range(0, len(done), args.batch)]
+    baseline = merge_all(run_batches(standardize_batch, done_batches, args.jobs, rj_means=rj_means,
+                                     json_dir=json_dir, baseline_samples=baseline_samples, **common))
+
+    # Normalization version 0: every sample is standardized against these means
+    versions = new_versions()
+    version = add_version(json_dir, versions, rj_means)
+    for filename in done:
+        set_sample_version(versions, filename, version)
+    save_versions(json_dir, versions)
 
     # Set a baseline for comparison
     # Baseline save path
     baseline_save_path = paths['baseline_save_path']
 
-    if not os.path.exists(baseline_save_path):
-        os.makedirs(baseline_save_path)
-
-    os.makedirs(os.path.dirname(log_filename), exist_ok=True)
-
     # Warning
     if bl_df.shape[0] < 50:
         print('WARNING: Please input at least 50 samples as a baseline.')
 
-    cb_data = {}
-    for chr_name, chr_len in chr_len_list:
-        cb_data[chr_name] = np.zeros(chr_len)
-    for i in trange(bl_df.shape[0]):
-        mapping = f"sample_{i}"
-        sample = bl_df.loc[bl_df['mapping'] == mapping]['file_name'].values[0]
-        filename_part_ = os.path.basename(sample).replace('.bam', '.json')
-        filename = os.path.join(json_dir, filename_part_)
-        print(f'Process {filename} ..................')
-        if os.path.isfile(filename):
-            try:
-                sample_depth = load_from_json(filename)
-                for chr_name, chr_len in chr_len_list:
-                    cb_data[chr_name] = cb_data[chr_name] + sample_depth[chr_name]
-            except Exception as e:
-                current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-                error_message = f"{current_time}:Error occurred while reading {filename}: {e}"
-                print(error_message)
-                # Write the error message to the log file
-                with open(log_filename, "a") as log_file:
-                    log_file.write(error_message + "\n")
-                continue
-
-    # Save to file
-    for chr_name in cb_data:
-        cb_data[chr_name] /= bl_df.shape[0]
-        np.savez(f'{baseline_save_path}/baseline_file_{chr_name}', **cb_data)
+    # Mean standardized depth of the baseline samples that were processed (a missing or unreadable
+    # BAM no longer counts as zeros); the summary is kept to update the baseline later
+    missing = set(bl_df['file_name']) - set(done)
+    if missing:
+        print(f"WARNING: {len(missing)} of {bl_df.shape[0]} baseline samples could not be processed, "
+              f"the baseline is the mean of the other {bl_df.shape[0] - len(missing)}.")
+    cb_data = baseline_depth(baseline, chr_len_list)
+    save_baseline(cb_data, baseline_save_path)
+    baseline.save(os.path.join(baseline_save_path, 'baseline_stats.npz'))
 
     if bl_df.shape[0] < 50:
         print('WARNING: Please input at least 50 samples as a baseline.')
 
-
 if __name__ == '__main__':
+    args = parser.parse_args()
     st = time.time()
     main()
     et = time.time()
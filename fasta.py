@@ -0,0 +1,197 @@
+import os
+import numpy as np
+from twobit import TwoBitFile, is_twobit
+
+# samtools-compatible index next to the FASTA file (<file>.fai), one line per record:
+# name, length, offset of the first base, bases per line, bytes per line
+FAI_SUFFIX = '.fai'
+READ_BLOCK = 1 << 24
+
+
+def fai_path(filename):
+    return filename + FAI_SUFFIX
+
+
+def end_line(filename, record, line_len, line_cr, newline=True):
+    # A finished sequence line; every line of a record but the last must have the same length.
+    # The file's last line may lack its newline (newline=False).
+    bases = line_len - line_cr
+    if bases == 0:
+        record['short'] = True
+        return
+    width = line_len + 1 if newline else bases + record['linewidth'] - record['linebases']
+    if record['short'] or (record['linebases'] and (bases > record['linebases']
+                                                    or width - bases != record['linewidth'] - record['linebases'])):
+        raise ValueError(f"{filename}: lines of '{record['name']}' have different lengths, it cannot be indexed")
+    if record['linebases'] == 0:
+        record['linebases'] = bases
+        record['linewidth'] = line_len + 1 if newline else bases + 1
+    elif bases < record['linebases']:
+        record['short'] = True
+    record['length'] += bases
+
+
+def scan_index(filename):
+    # One pass over the file in blocks; lines are never held whole, so single-line records
+    # of any length (as in the .fas consensus files) need no more than a block of memory
+    index = {}
+    record = None
+    header = None
+    line_len, line_cr = 0, False
+    at_line_start = True
+    position = 0
+    with open(filename, 'rb') as file:
+        while True:
+            data = file.read(READ_BLOCK)
+            if not data:
+                break
+            i = 0
+            while i < len(data):
+                if at_line_start and header is None and data[i] == ord('>'):
+                    if record is not None:
+                        index[record['name']] = record
+                    record, header = None, []
+                    i += 1
+                j = data.find(b'\n', i)
+                piece = data[i:len(data) if j < 0 else j]
+                if header is not None:
+                    header.append(piece)
+                elif piece:
+                    if record is None:
+                        raise ValueError(f"{filename}: sequence before the first header")
+                    line_len += len(piece)
+                    line_cr = piece.endswith(b'\r')
+                if j < 0:
+                    at_line_start = False
+                    break
+                if header is not None:
+                    record = new_record(filename, header, position + j + 1)
+                    header = None
+                elif record is not None:
+                    end_line(filename, record, line_len, line_cr)
+                line_len, line_cr = 0, False
+                at_line_start = True
+                i = j + 1
+            position += len(data)
+    if header is not None:
+        record = new_record(filename, header, position)
+    elif line_len:
+        end_line(filename, record, line_len, line_cr, newline=False)
+    if record is not None:
+        index[record['name']] = record
+    return {name: (r['length'], r['offset'], r['linebases'], r['linewidth']) for name, r in index.items()}
+
+
+def new_record(filename, header, offset):
+    # Named after the first word of the header, as samtools does
+    words = b''.join(header).decode().split()
+    if not words:
+        raise ValueError(f"{filename}: empty FASTA header")
+    return {'name': words[0], 'length': 0, 'offset': offset, 'linebases': 0, 'linewidth': 0, 'short': False}
+
+
+def read_fai(path):
+    index = {}
+    with open(path, 'r') as file:
+        for line in file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 5:
+                index[fields[0]] = tuple(int(v) for v in fields[1:5])
+    return index
+
+
+def write_fai(path, index):
+    with open(path + '.tmp', 'w') as file:
+        for name, (length, offset, linebases, linewidth) in index.items():
+            file.write(f'{name}\t{length}\t{offset}\t{linebases}\t{linewidth}\n')
+    os.replace(path + '.tmp', path)
+
+
+def load_index(filename):
+    # The .fai next to the file if it is not older than the file, else built and saved
+    path = fai_path(filename)
+    if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(filename):
+        return read_fai(path)
+    index = scan_index(filename)
+    try:
+        write_fai(path, index)
+    except OSError:
+        # Read-only location: the index is kept in memory only
+        pass
+    return index
+
+
+class IndexedFasta:
+    # Records and regions as uint8 arrays mapped from disk. Bases on a single line (every
+    # record of a .fas consensus file, any region within one line) come back as views,
+    # without a copy; regions spanning lines are gathered into one new array.
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = load_index(filename)
+        if os.path.getsize(filename):
+            self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+        else:
+            self.data = np.empty(0, dtype=np.uint8)
+
+    @property
+    def names(self):
+        return list(self.index)
+
+    def length(self, name):
+        return self.index[name][0]
+
+    def region(self, name, start=0, end=None):
+        length, offset, linebases, linewidth = self.index[name]
+        end = length if end is None else min(end, length)
+        start = max(0, min(start, end))
+        if start == end:
+            return self.data[offset:offset]
+        first, last = start // linebases, (end - 1) // linebases
+        if first == last:
+            begin = offset + first * linewidth + start - first * linebases
+            return self.data[begin:begin + end - start]
+        # Whole lines first..last-1 as a (lines x bases) view that skips the newlines, then the last line
+        rows = last - first
+        lines = self.data[offset + first * linewidth:offset + last * linewidth].reshape(rows, linewidth)
+        tail = self.data[offset + last * linewidth:offset + last * linewidth + end - last * linebases]
+        out = np.empty(rows * linebases + len(tail), dtype=np.uint8)
+        out[:rows * linebases].reshape(rows, linebases)[:] = lines[:, :linebases]
+        out[rows * linebases:] = tail
+        return out[start - first * linebases:]
+
+    def record(self, name):
+        return self.region(name)
+
+    def records(self):
+        for name in self.index:
+            yield name, self.record(name)
+
+
+def read_records(filename):
+    # Fallback for files that cannot be indexed: (header, bytes) per record, the lines
+    # of a record collected in a list and joined once
+    name, lines = None, []
+    with open(filename, 'rb') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith(b'>'):
+                if name is not None:
+                    yield name, b''.join(lines)
+                name, lines = line[1:].decode(), []
+            elif line:
+                lines.append(line)
+    if name is not None:
+        yield name, b''.join(lines)
+
+
+def open_records(filename):
+    # (name, uint8 array) per record, indexed when possible; .2bit files are read as such
+    if is_twobit(filename):
+        return TwoBitFile(filename).records()
+    try:
+        fasta = IndexedFasta(filename)
+    except ValueError as e:
+        print(f"Warning: {e}; reading it without an index")
+        return ((header.split()[0], np.frombuffer(seq, dtype=np.uint8))
+                for header, seq in read_records(filename) if header.split())
+    return fasta.records()
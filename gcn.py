@@ -0,0 +1,626 @@
+import os
+import json
+import copy
+import zipfile
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from graph_io import load_graph_file, graph_adjacency, induced_csr, csr_tensor
+
+
+class GraphConvolution(nn.Module):
+    def __init__(self, in_features, out_features):
+        super(GraphConvolution, self).__init__()
+        self.linear = nn.Linear(in_features, out_features)
+
+    def forward(self, x, adj):
+        x = torch.sparse.mm(adj, x)
+        x = self.linear(x)
+        return x
+
+
+class GCN(nn.Module):
+    def __init__(self, input_dim, hidden_dim, output_dim, num_layers=2):
+        super(GCN, self).__init__()
+        self.gc1 = GraphConvolution(input_dim, hidden_dim)
+        self.gc2 = GraphConvolution(hidden_dim, hidden_dim)
+        # Layers beyond the second; empty for the default depth, so older state_dicts still load
+        self.hidden = nn.ModuleList([GraphConvolution(hidden_dim, hidden_dim) for _ in range(num_layers - 2)])
+        self.fc = nn.Linear(hidden_dim, output_dim)
+
+    def forward(self, x, adj):
+        x = F.relu(self.gc1(x, adj))
+        x = F.relu(self.gc2(x, adj))
+        for layer in self.hidden:
+            x = F.relu(layer(x, adj))
+        x = self.fc(x)
+        return x
+
+
+class SGCHead(nn.Module):
+    # Dense head on precomputed [A·X, A²·X] features: the same depth as GCN, no sparse ops
+    def __init__(self, input_dim, hidden_dim, output_dim, num_layers=2):
+        super(SGCHead, self).__init__()
+        self.fc1 = nn.Linear(input_dim, hidden_dim)
+        self.fc2 = nn.Linear(hidden_dim, hidden_dim)
+        self.hidden = nn.ModuleList([nn.Linear(hidden_dim, hidden_dim) for _ in range(num_layers - 2)])
+        self.fc = nn.Linear(hidden_dim, output_dim)
+
+    def forward(self, x):
+        x = F.relu(self.fc1(x))
+        x = F.relu(self.fc2(x))
+        for layer in self.hidden:
+            x = F.relu(layer(x))
+        x = self.fc(x)
+        return x
+
+
+def sparse_tensor_from_coo(coo):
+    values = coo.data
+    indices = np.vstack((coo.row, coo.col))
+    i = torch.tensor(indices, dtype=torch.long)
+    v = torch.tensor(values, dtype=torch.float32)
+    shape = coo.shape
+    return torch.sparse_coo_tensor(i, v, torch.Size(shape))
+
+
+def sample_hop(indptr, indices, frontier, fanout, rng):
+    # Up to `fanout` neighbours per frontier node. Nodes with more neighbours are sampled
+    # with replacement and their edges weighted deg / fanout, so the sum over sampled
+    # neighbours is an unbiased estimate of the full sum that GraphConvolution computes.
+    begin = indptr[frontier]
+    deg = indptr[frontier + 1] - begin
+    take = np.minimum(deg, fanout)
+    rep = np.repeat(np.arange(len(frontier)), take)
+    pos = np.arange(take.sum()) - np.repeat(np.cumsum(take) - take, take)
+    sampled = deg[rep] > fanout
+    pos[sampled] = (rng.random(sampled.sum()) * deg[rep][sampled]).astype(np.int64)
+    neighbours = np.asarray(indices[begin[rep] + pos], dtype=np.int64)
+    weights = (deg[rep] / take[rep]).astype(np.float32)
+    return frontier[rep], neighbours, weights
+
+
+def sample_subgraph(indptr, indices, seeds, fanouts, rng):
+    # Two-hop (len(fanouts)-hop) sampled neighbourhood of `seeds`, GraphSAGE style.
+    # Returns the global node ids (seeds first) and the sampled adjacency on them.
+    seeds = np.asarray(seeds, dtype=np.int64)
+    nodes = [seeds]
+    seen = seeds
+    frontier = seeds
+    rows, cols, vals = [], [], []
+    for fanout in fanouts:
+        if len(frontier) == 0:
+            break
+        r, c, w = sample_hop(indptr, indices, frontier, fanout, rng)
+        rows.append(r)
+        cols.append(c)
+        vals.append(w)
+        frontier = np.setdiff1d(np.unique(c), seen, assume_unique=True)
+        nodes.append(frontier)
+        seen = np.union1d(seen, frontier)
+
+    nodes = np.concatenate(nodes)
+    order = np.argsort(nodes)
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+    vals = np.concatenate(vals) if vals else np.empty(0, dtype=np.float32)
+    local_rows = order[np.searchsorted(nodes, rows, sorter=order)]
+    local_cols = order[np.searchsorted(nodes, cols, sorter=order)]
+    adj = torch.sparse_coo_tensor(torch.from_numpy(np.vstack((local_rows, local_cols))),
+                                  torch.from_numpy(vals), (len(nodes), len(nodes))).coalesce()
+    return nodes, adj
+
+
+def minibatch_epoch(model, X, y, indptr, indices, train_nodes, optimizer, loss_fn, batch_size, fanouts, rng):
+    # Memory per step is bounded by batch_size * prod(fanouts) nodes, whatever the graph size
+    model.train()
+    total_loss = 0.0
+    perm = rng.permutation(train_nodes)
+    for begin in range(0, len(perm), batch_size):
+        seeds = perm[begin:begin + batch_size]
+        nodes, adj = sample_subgraph(indptr, indices, seeds, fanouts, rng)
+        optimizer.zero_grad()
+        output = model(X[nodes], adj)[:len(seeds)]
+        loss = loss_fn(output.squeeze(-1), y[seeds])
+        loss.backward()
+        optimizer.step()
+        total_loss += loss.item() * len(seeds)
+    return total_loss / max(len(perm), 1)
+
+
+def predict_minibatch(model, X, indptr, indices, nodes_to_score, batch_size=4096, fanouts=(10, 10), seed=42):
+    rng = np.random.default_rng(seed)
+    indptr = np.asarray(indptr, dtype=np.int64)
+    nodes_to_score = np.asarray(nodes_to_score, dtype=np.int64)
+    predictions = []
+    model.eval()
+    with torch.no_grad():
+        for begin in range(0, len(nodes_to_score), batch_size):
+            seeds = nodes_to_score[begin:begin + batch_size]
+            nodes, adj = sample_subgraph(indptr, indices, seeds, fanouts, rng)
+            output = model(X[nodes], adj)[:len(seeds)]
+            predictions.append(torch.sigmoid(output).squeeze(-1).numpy())
+    return np.concatenate(predictions) if predictions else np.empty(0, dtype=np.float32)
+
+
+def normalize_adjacency(adj):
+    # D^-1/2 (A + I) D^-1/2
+    adj = sp.csr_matrix(adj, dtype=np.float32) + sp.identity(adj.shape[0], dtype=np.float32, format='csr')
+    deg = np.asarray(adj.sum(axis=1)).ravel()
+    d_inv_sqrt = sp.diags(1.0 / np.sqrt(deg)).astype(np.float32)
+    return (d_inv_sqrt @ adj @ d_inv_sqrt).tocsr()
+
+
+def propagate_features(adj, X, hops=2):
+    # [A·X, A²·X, ...] with the normalized adjacency
+    features = []
+    x = np.asarray(X, dtype=np.float32)
+    for _ in range(hops):
+        x = adj @ x
+        features.append(x)
+    return np.hstack(features).astype(np.float32)
+
+
+def graph_digest(*arrays):
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def sgc_cache_path(graph_path):
+    # Stored next to the graph: inside a .pgx directory, or beside a legacy .gpickle
+    if os.path.isdir(graph_path):
+        return os.path.join(graph_path, 'sgc_features.npy')
+    return graph_path + '.sgc_features.npy'
+
+
+def sgc_features(adj, X, train_idx, test_idx, cache_file=None, hops=2):
+    # Training and unknown nodes only see their own side, as in the GCN mode
+    # (adj[train_idx][:, train_idx] / adj[test_idx][:, test_idx]): cross edges are dropped
+    # and the whole block-diagonal graph is propagated once.
+    adj = sp.csr_matrix(adj)
+    side = np.zeros(adj.shape[0], dtype=np.int8)
+    side[test_idx] = 1
+    key = graph_digest(adj.indptr, adj.indices, side, np.asarray(X)) + f':{hops}'
+    if cache_file is not None and os.path.isfile(cache_file):
+        key_file = cache_file + '.key'
+        if os.path.isfile(key_file):
+            with open(key_file, 'r') as f:
+                cached_key = f.read()
+            if cached_key == key:
+                print(f"Load propagated features from '{cache_file}'")
+                return np.load(cache_file, mmap_mode='c')
+
+    coo = adj.tocoo()
+    keep = side[coo.row] == side[coo.col]
+    adj = sp.csr_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])), shape=adj.shape)
+    features = propagate_features(normalize_adjacency(adj), X, hops)
+
+    if cache_file is not None:
+        # The key is dropped first and written last, so it only ever matches complete features
+        key_file = cache_file + '.key'
+        if os.path.isfile(key_file):
+            os.remove(key_file)
+        with open(cache_file + '.tmp', 'wb') as f:
+            np.save(f, features)
+        os.replace(cache_file + '.tmp', cache_file)
+        with open(key_file + '.tmp', 'w') as f:
+            f.write(key)
+        os.replace(key_file + '.tmp', key_file)
+        print(f"Propagated features saved to '{cache_file}'")
+    return features
+
+
+def feature_stats(X):
+    # Column mean / std of the training features; constant columns keep std 1
+    X = torch.as_tensor(X, dtype=torch.float32)
+    mean = X.mean(dim=0)
+    std = X.std(dim=0, unbiased=False)
+    std[std == 0] = 1.0
+    return {'mean': mean.tolist(), 'std': std.tolist()}
+
+
+def standardize_features(X, feature_norm):
+    if feature_norm is None:
+        return X
+    mean = torch.tensor(feature_norm['mean'], dtype=torch.float32)
+    std = torch.tensor(feature_norm['std'], dtype=torch.float32)
+    return (X - mean) / std
+
+
+def model_config(inputs, arch='gcn', hidden=64, layers=2, batch_size=0, fanout=(10, 10)):
+    # What build_model reads; saved with the model. A mini-batch GCN samples one hop per
+    # layer: extra fanouts are dropped and the last one repeats for deeper models.
+    fanouts = [int(f) for f in fanout]
+    if not fanouts:
+        raise ValueError("At least one fanout is needed")
+    if arch == 'gcn':
+        fanouts = fanouts[:layers] + fanouts[-1:] * (layers - len(fanouts))
+    return {
+        'arch': arch,
+        'input_dim': inputs['X'].shape[1],
+        'hidden_dim': hidden,
+        'num_layers': layers,
+        'output_dim': 1,
+        'hops': 2,
+        'batch_size': batch_size if arch == 'gcn' else 0,
+        'fanouts': fanouts,
+    }
+
+
+def build_model(config):
+    num_layers = config.get('num_layers', 2)
+    if num_layers < 2:
+        raise ValueError(f"num_layers must be at least 2, got {num_layers}")
+    if config['arch'] == 'sgc':
+        return SGCHead(config['input_dim'] * config.get('hops', 2), config['hidden_dim'], config['output_dim'], num_layers)
+    return GCN(config['input_dim'], config['hidden_dim'], config['output_dim'], num_layers)
+
+
+def save_model(path, model, config, feature_norm):
+    torch.save({'state_dict': model.state_dict(), 'config': config, 'feature_norm': feature_norm}, path)
+
+
+def load_model(path):
+    checkpoint = torch.load(path, map_location='cpu', weights_only=True)
+    if 'config' not in checkpoint:
+        # Plain state_dict from older pgcnv runs: GCN(3, 64, 1) on raw features
+        config = {'arch': 'gcn', 'input_dim': 3, 'hidden_dim': 64, 'output_dim': 1, 'batch_size': 0}
+        checkpoint = {'state_dict': checkpoint, 'config': config, 'feature_norm': None}
+    model = build_model(checkpoint['config'])
+    model.load_state_dict(checkpoint['state_dict'])
+    model.eval()
+    return model, checkpoint['config'], checkpoint['feature_norm']
+
+
+def predict_unknown(model, config, inputs, adj=None, cache_file=None):
+    # Probabilities for the test (unknown) nodes, on the same graph view used in training.
+    # `inputs` comes from graph_prep.prepare_inputs; the full adjacency is only needed for SGC.
+    model.eval()
+    X, train_idx, test_idx = inputs['X'], inputs['train_idx'], inputs['test_idx']
+    if config['arch'] == 'sgc':
+        X_prop = sgc_features(adj, X.numpy(), train_idx, test_idx, cache_file, config.get('hops', 2))
+        with torch.no_grad():
+            output = model(torch.from_numpy(np.asarray(X_prop[test_idx])))
+        return torch.sigmoid(output).squeeze(-1).numpy()
+
+    if config.get('batch_size', 0) > 0:
+        indptr, indices = inputs['test_csr']
+        return predict_minibatch(model, X[test_idx], indptr, indices,
+                                 np.arange(len(test_idx)), fanouts=config['fanouts'])
+    with torch.no_grad():
+        output = model(X[test_idx], inputs['adj_test'])
+    return torch.sigmoid(output).squeeze(-1).numpy()
+
+
+def binary_metrics(probs, targets):
+    probs = np.clip(np.asarray(probs, dtype=np.float64), 1e-7, 1 - 1e-7)
+    targets = np.asarray(targets, dtype=np.float64)
+    predicted = probs >= 0.5
+    tp = np.sum(predicted & (targets == 1))
+    fp = np.sum(predicted & (targets == 0))
+    fn = np.sum(~predicted & (targets == 1))
+    return {
+        'loss': float(-np.mean(targets * np.log(probs) + (1 - targets) * np.log(1 - probs))),
+        'acc': float(np.mean(predicted == targets)),
+        'f1': float(2 * tp / max(2 * tp + fp + fn, 1)),
+    }
+
+
+def load_checkpoint(path):
+    if path is None or not os.path.isfile(path):
+        raise FileNotFoundError(f"No checkpoint to resume from at '{path}'")
+    return torch.load(path, map_location='cpu', weights_only=True)
+
+
+def fit(model, optimizer, train_step, evaluate, num_epochs, patience=20, log_file=None,
+        checkpoint_file=None, checkpoint_extra=None, resume_state=None, rng=None, verbose=True):
+    # train_step() runs one epoch and returns the training loss; evaluate() returns the
+    # validation metrics (or None without a validation split, then the training loss is
+    # monitored). The best model is kept, training stops after `patience` epochs without
+    # improvement, and a resumable checkpoint is written after every epoch. `rng` (the
+    # mini-batch sampler's generator) is checkpointed too, so a resumed run samples the
+    # same batches as an uninterrupted one.
+    start_epoch = 0
+    best_loss = float('inf')
+    best_state = None
+    bad_epochs = 0
+    if resume_state is not None:
+        model.load_state_dict(resume_state['model'])
+        optimizer.load_state_dict(resume_state['optimizer'])
+        start_epoch = resume_state['epoch']
+        best_loss = resume_state['best_loss']
+        best_state = resume_state['best_state']
+        bad_epochs = resume_state['bad_epochs']
+        if rng is not None and 'rng_state' in resume_state:
+            rng.bit_generator.state = resume_state['rng_state']
+        if verbose:
+            print(f"Resume training at epoch {start_epoch + 1}")
+
+    if log_file is not None:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        if not os.path.isfile(log_file):
+            with open(log_file, 'w') as f:
+                f.write('epoch\ttrain_loss\tval_loss\tval_acc\tval_f1\tepoch_sec\telapsed_sec\n')
+
+    st = time.time()
+    for epoch in range(start_epoch, num_epochs):
+        et = time.time()
+        train_loss = train_step()
+        metrics = evaluate()
+        monitored = train_loss if metrics is None else metrics['loss']
+        if monitored < best_loss:
+            best_loss = monitored
+            best_state = copy.deepcopy(model.state_dict())
+            bad_epochs = 0
+        else:
+            bad_epochs += 1
+
+        epoch_sec = time.time() - et
+        if metrics is None:
+            metrics = {'loss': float('nan'), 'acc': float('nan'), 'f1': float('nan')}
+        if log_file is not None:
+            with open(log_file, 'a') as f:
+                f.write(f"{epoch + 1}\t{train_loss:.6f}\t{metrics['loss']:.6f}\t{metrics['acc']:.4f}\t"
+                        f"{metrics['f1']:.4f}\t{epoch_sec:.3f}\t{time.time() - st:.3f}\n")
+        if verbose and (epoch + 1) % 10 == 0:
+            print(f"======================Epoch [{epoch + 1}/{num_epochs}] loss: {train_loss:.4f} "
+                  f"val_loss: {metrics['loss']:.4f} val_acc: {metrics['acc']:.4f}======================")
+
+        if checkpoint_file is not None:
+            state = {'model': model.state_dict(), 'optimizer': optimizer.state_dict(), 'epoch': epoch + 1,
+                     'best_loss': best_loss, 'best_state': best_state, 'bad_epochs': bad_epochs}
+            if rng is not None:
+                state['rng_state'] = rng.bit_generator.state
+            state.update(checkpoint_extra or {})
+            torch.save(state, checkpoint_file + '.tmp')
+            os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+        if patience > 0 and bad_epochs >= patience:
+            if verbose:
+                print(f"Early stopping at epoch {epoch + 1}: no improvement for {patience} epochs")
+            break
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    return model
+
+
+def split_validation(num_labeled, val_frac, seed=42):
+    # Positions (within the labeled nodes) held out for validation. They stay in the
+    # graph, only their labels are not used for training.
+    n_val = int(round(num_labeled * val_frac))
+    return np.sort(np.random.default_rng(seed).permutation(num_labeled)[:n_val])
+
+
+def training_view(inputs, config, adj=None, cache_file=None):
+    # What the training loop reads: labeled-node features (propagated for SGC), labels
+    # and the labeled-node CSR. Plain tensors, so they can be shared between processes.
+    train_idx = inputs['train_idx']
+    if config['arch'] == 'sgc':
+        # Propagation is precomputed: dense matmuls only
+        X_prop = sgc_features(adj, inputs['X'].numpy(), train_idx, inputs['test_idx'], cache_file,
+                              config.get('hops', 2))
+        X_train = torch.from_numpy(np.asarray(X_prop[train_idx]))
+    else:
+        X_train = inputs['X'][train_idx]
+    indptr, indices = inputs['train_csr']
+    return {'X': X_train, 'y': inputs['y'][train_idx],
+            'indptr': torch.from_numpy(indptr), 'indices': torch.from_numpy(indices)}
+
+
+def train_model(view, config, val_pos, lr=0.001, num_epochs=200, patience=20, log_file=None,
+                checkpoint_file=None, checkpoint_extra=None, resume_state=None, verbose=True):
+    # Returns the best model and its validation metrics (None without a validation split)
+    model = build_model(config)
+    optimizer = torch.optim.Adam(model.parameters(), lr=float(lr))
+    loss_fn = nn.BCEWithLogitsLoss()  # Binary Cross Entropy Loss
+
+    X_train, y_train = view['X'], view['y']
+    indptr, indices = view['indptr'].numpy(), view['indices'].numpy()
+    rng = None
+    fit_pos = np.setdiff1d(np.arange(len(y_train)), val_pos)
+    y_val = y_train[val_pos].numpy()
+    if verbose:
+        print(f"Labeled nodes: {len(fit_pos)} for training, {len(val_pos)} for validation")
+
+    if config['arch'] == 'sgc':
+        def train_step():
+            model.train()
+            optimizer.zero_grad()
+            output = model(X_train[fit_pos])
+            loss = loss_fn(output.squeeze(-1), y_train[fit_pos])
+            loss.backward()
+            optimizer.step()
+            return loss.item()
+
+        def predict_val():
+            model.eval()
+            with torch.no_grad():
+                return torch.sigmoid(model(X_train[val_pos])).squeeze(-1).numpy()
+    elif config.get('batch_size', 0) > 0:
+        # Mini-batch training on sampled neighbourhoods (one hop per layer) of the labeled nodes
+        rng = np.random.default_rng(42)
+
+        def train_step():
+            return minibatch_epoch(model, X_train, y_train, indptr, indices,
+                                   fit_pos, optimizer, loss_fn, config['batch_size'], config['fanouts'], rng)
+
+        def predict_val():
+            return predict_minibatch(model, X_train, indptr, indices, val_pos, fanouts=config['fanouts'])
+    else:
+        adj_train = csr_tensor(indptr, indices, len(y_train))
+
+        def train_step():
+            model.train()
+            optimizer.zero_grad()
+            output = model(X_train, adj_train)
+            loss = loss_fn(output.squeeze(-1)[fit_pos], y_train[fit_pos])
+            loss.backward()
+            optimizer.step()
+            return loss.item()
+
+        def predict_val():
+            model.eval()
+            with torch.no_grad():
+                return torch.sigmoid(model(X_train, adj_train)).squeeze(-1).numpy()[val_pos]
+
+    def evaluate():
+        if len(val_pos) == 0:
+            return None
+        return binary_metrics(predict_val(), y_val)
+
+    fit(model, optimizer, train_step, evaluate, num_epochs, patience=patience, log_file=log_file,
+        checkpoint_file=checkpoint_file, checkpoint_extra=checkpoint_extra, resume_state=resume_state, rng=rng,
+        verbose=verbose)
+    return model, evaluate()
+
+
+def neighbours_of(indptr, indices, nodes):
+    begin = indptr[nodes]
+    deg = indptr[nodes + 1] - begin
+    rep = np.repeat(np.arange(len(nodes)), deg)
+    pos = np.arange(deg.sum()) - np.repeat(np.cumsum(deg) - deg, deg)
+    return nodes[rep], np.asarray(indices[begin[rep] + pos], dtype=np.int64)
+
+
+def khop_subgraph(indptr, indices, seeds, k=2):
+    # Nodes within k hops of `seeds` (seeds first) and the induced adjacency on them.
+    # Only the rows of these nodes are read, so the cost does not depend on the graph size.
+    indptr = np.asarray(indptr)
+    seeds = np.asarray(seeds, dtype=np.int64)
+    nodes = [seeds]
+    seen = np.unique(seeds)
+    frontier = seen
+    for _ in range(k):
+        if len(frontier) == 0:
+            break
+        _, cols = neighbours_of(indptr, indices, frontier)
+        frontier = np.setdiff1d(np.unique(cols), seen, assume_unique=True)
+        nodes.append(frontier)
+        seen = np.union1d(seen, frontier)
+    nodes = np.concatenate(nodes)
+
+    rows, cols = neighbours_of(indptr, indices, nodes)
+    order = np.argsort(nodes)
+    pos = np.minimum(np.searchsorted(nodes, cols, sorter=order), len(nodes) - 1)
+    inside = nodes[order[pos]] == cols
+    local_rows = order[np.searchsorted(nodes, rows[inside], sorter=order)]
+    local_cols = order[pos[inside]]
+    data = np.ones(len(local_rows), dtype=np.float32)
+    adj = sp.csr_matrix((data, (local_rows, local_cols)), shape=(len(nodes), len(nodes)))
+    return nodes, adj
+
+
+def receptive_field(config):
+    # Hops a node's score depends on: one per GCN layer, or the SGC propagation depth
+    return config.get('hops', 2) if config['arch'] == 'sgc' else config.get('num_layers', 2)
+
+
+def score_nodes(model, config, feature_norm, graph, node_ids, k=None, batch_size=4096):
+    # Inductive scoring: each batch of nodes is scored on its k-hop neighbourhood in the
+    # stored graph, labeled neighbours included. Returns probabilities in node_ids order.
+    # k defaults to the model's receptive field; fewer hops would change the scores.
+    needed = receptive_field(config)
+    k = needed if k is None else k
+    if k < needed:
+        raise ValueError(f"Scoring on {k} hops, but the {config['arch']} model reads {needed} hops of neighbours")
+    indptr = np.asarray(graph['indptr'])
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    predictions = []
+    model.eval()
+    for begin in range(0, len(node_ids), batch_size):
+        seeds = node_ids[begin:begin + batch_size]
+        nodes, adj = khop_subgraph(indptr, graph['indices'], seeds, k)
+        X = standardize_features(torch.from_numpy(np.asarray(graph['features'][nodes], dtype=np.float32)),
+                                 feature_norm)
+        with torch.no_grad():
+            if config['arch'] == 'sgc':
+                # Normalize with the degrees in the full graph, so seed features match full propagation
+                deg = (indptr[nodes + 1] - indptr[nodes] + 1).astype(np.float32)
+                d_inv_sqrt = sp.diags(1.0 / np.sqrt(deg))
+                norm_adj = (d_inv_sqrt @ (adj + sp.identity(len(nodes), dtype=np.float32, format='csr')) @ d_inv_sqrt).tocsr()
+                X_prop = propagate_features(norm_adj, X.numpy(), config.get('hops', 2))
+                output = model(torch.from_numpy(X_prop[:len(seeds)]))
+            else:
+                output = model(X, sparse_tensor_from_coo(adj.tocoo()))[:len(seeds)]
+        predictions.append(torch.sigmoid(output).squeeze(-1).numpy())
+    return np.concatenate(predictions) if predictions else np.empty(0, dtype=np.float32)
+
+
+def results_table(graph, test_idx, predictions):
+    predicted_labels = np.round(predictions).astype(int)
+
+    results = {
+        'SampleID': graph['name'][test_idx],
+        'Chromosome': graph['chr_name'][test_idx],
+        'Start': graph['start'][test_idx],
+        'End': graph['start'][test_idx] + graph['length'][test_idx],
+        'LogR_Ratio': graph['logr'][test_idx],
+        'Predicted_Label': predicted_labels
+    }
+    return pd.DataFrame(results)
+
+
+def write_results(graph, test_idx, predictions, output_file):
+    results_df = results_table(graph, test_idx, predictions)
+    results_df.to_csv(output_file, sep='\t', index=False)
+    print(f"Results have saved to the '{output_file}' file")
+
+
+def prepare_unknown_inputs(path, config, feature_norm):
+    # Inputs of the unknown nodes, on the same graph view as pgcnv -mode predict
+    graph = load_graph_file(path)
+    labels = np.asarray(graph['label'])
+    train_idx = np.where(labels != -1)[0]
+    test_idx = np.where(labels == -1)[0]
+    X = standardize_features(torch.from_numpy(np.asarray(graph['features'], dtype=np.float32)), feature_norm)
+    if config['arch'] == 'sgc':
+        X_prop = sgc_features(graph_adjacency(graph), X.numpy(), train_idx, test_idx, sgc_cache_path(path),
+                              config.get('hops', 2))
+        return graph, test_idx, torch.from_numpy(np.asarray(X_prop[test_idx])), None
+    indptr, indices = induced_csr(graph['indptr'], graph['indices'], test_idx)
+    adj = sp.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(len(test_idx), len(test_idx)))
+    return graph, test_idx, X[test_idx], adj
+
+
+def export_model(model, config, feature_norm, path, quantize=False):
+    # TorchScript artifact for CPU serving: frozen, optionally with int8 dynamic
+    # quantization of the nn.Linear layers. Config and feature norm travel as extra files.
+    model.eval()
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    scripted = torch.jit.freeze(torch.jit.script(model))
+    extra_files = {
+        'config.json': json.dumps(dict(config, quantized=bool(quantize))),
+        'feature_norm.json': json.dumps(feature_norm),
+    }
+    torch.jit.save(scripted, path, _extra_files=extra_files)
+    return scripted
+
+
+def load_exported(path):
+    extra_files = {'config.json': '', 'feature_norm.json': ''}
+    module = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    module.eval()
+    return module, json.loads(extra_files['config.json']), json.loads(extra_files['feature_norm.json'])
+
+
+def is_exported(path):
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any(name.endswith('extra/config.json') for name in archive.namelist())
+
+
+def load_inference_model(path):
+    # A TorchScript artifact from gcn_export.py, or a model file from pgcnv.py
+    if is_exported(path):
+        return load_exported(path)
+    return load_model(path)
@@ -0,0 +1,79 @@
+import torch
+import time
+import json
+import argparse
+from utils import *
+from gcn import load_model, export_model, load_exported, prepare_unknown_inputs, sparse_tensor_from_coo
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-model', type=str, help="Path to the model file written by pgcnv.py", required=True)
+parser.add_argument('-o', type=str, help="Path to the exported artifact, example: model_cpu.pt", required=True)
+parser.add_argument('-quantize', action='store_true', default=False,
+                    help="Dynamic int8 quantization of the nn.Linear layers")
+parser.add_argument('-k', type=str, default=None, help="Graph used to benchmark the artifact against eager mode")
+parser.add_argument('-runs', type=int, default=20, help="Timed runs per model in the benchmark")
+parser.add_argument('-bench_out', type=str, default=None, help="Save the benchmark results to this .json file")
+
+
+def forward_fn(model, config, X, adj):
+    if config['arch'] == 'sgc':
+        return lambda: torch.sigmoid(model(X)).squeeze(-1)
+    return lambda: torch.sigmoid(model(X, adj)).squeeze(-1)
+
+
+def time_runs(fn, runs):
+    with torch.no_grad():
+        fn()  # warm-up
+        times = []
+        for _ in range(runs):
+            st = time.perf_counter()
+            output = fn()
+            times.append(time.perf_counter() - st)
+    return output.numpy(), float(np.median(times)), float(np.min(times))
+
+
+def benchmark(eager, artifact, config, feature_norm, graph_path, runs):
+    graph, test_idx, X, adj = prepare_unknown_inputs(graph_path, config, feature_norm)
+    adj = None if adj is None else sparse_tensor_from_coo(adj.tocoo())
+    eager_probs, eager_median, eager_min = time_runs(forward_fn(eager, config, X, adj), runs)
+    artifact_probs, artifact_median, artifact_min = time_runs(forward_fn(artifact, config, X, adj), runs)
+    results = {
+        'graph': graph_path,
+        'nodes': int(len(test_idx)),
+        'runs': runs,
+        'quantized': bool(args.quantize),
+        'eager_median_ms': eager_median * 1000,
+        'eager_min_ms': eager_min * 1000,
+        'artifact_median_ms': artifact_median * 1000,
+        'artifact_min_ms': artifact_min * 1000,
+        'speedup': eager_median / max(artifact_median, 1e-12),
+        'label_agreement': float(np.mean(np.round(eager_probs) == np.round(artifact_probs))),
+        'max_abs_prob_diff': float(np.max(np.abs(eager_probs - artifact_probs))) if len(test_idx) else 0.0,
+    }
+    for key, value in results.items():
+        print(f"{key}: {value}")
+    return results
+
+
+def main():
+    model, config, feature_norm = load_model(args.model)
+    print(f"Loaded {config['arch']} model from '{args.model}'")
+    export_model(model, config, feature_norm, args.o, quantize=args.quantize)
+    print(f"Artifact saved as '{args.o}'" + (" (int8 dynamic quantization)" if args.quantize else ""))
+
+    if args.k is not None:
+        artifact, _, _ = load_exported(args.o)
+        results = benchmark(model, artifact, config, feature_norm, args.k, args.runs)
+        if args.bench_out is not None:
+            with open(args.bench_out, 'w') as f:
+                json.dump(results, f, indent=4)
+            print(f"Benchmark saved to '{args.bench_out}'")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    st = time.time()
+    main()
+    et = time.time()
+    rt = et - st
+    print(f"Finish! runtime: {rt}sec")
@@ -0,0 +1,263 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import networkx as nx
+from bubble_join import join_bubbles
+from utils import sample_key
+from graph_io import sample_index, graph_edge_index
+
+label_mapping = {'0': 0, '1': 1, 'unknown': -1}
+
+
+def sample_keys(names):
+    # sample_key() once per distinct name
+    codes, uniques = pd.factorize(pd.Series(names, dtype=str))
+    return np.array([sample_key(name) for name in uniques], dtype=str)[codes]
+
+
+def encode_labels(labels):
+    numeric = pd.to_numeric(pd.Series(labels), errors='coerce').to_numpy()
+    return np.where(np.isnan(numeric), -1, numeric).astype(np.int8)
+
+
+def bubble_node_table(bub_results):
+    filenames = bub_results['filename'].astype(str)
+    counter = filenames.groupby(filenames, sort=False).cumcount()
+    return {
+        'name': (filenames + '_' + counter.astype(str)).to_numpy(dtype=str),
+        'sample': sample_keys(filenames),
+        'group': filenames.to_numpy(dtype=str),
+        'chr_name': bub_results['chr_name'].to_numpy(dtype=str),
+        'start': pd.to_numeric(bub_results['start']).to_numpy(dtype=np.int64),
+        'length': pd.to_numeric(bub_results['length']).to_numpy(dtype=np.int64),
+        'logr': pd.to_numeric(bub_results['logr'], errors='coerce').to_numpy(dtype=np.float64),
+        'label': encode_labels(bub_results['label']),
+    }
+
+
+def cnv_node_table(cnv_data):
+    sample_ids = cnv_data['SampleID'].astype(str)
+    start = pd.to_numeric(cnv_data['Start']).to_numpy(dtype=np.int64)
+    end = pd.to_numeric(cnv_data['End']).to_numpy(dtype=np.int64)
+    index = pd.Series(cnv_data.index.astype(str), index=cnv_data.index)
+    return {
+        'name': (sample_ids + '_' + index + '_unknown').to_numpy(dtype=str),
+        'sample': sample_keys(sample_ids),
+        # ZIP-Caller calls are never chained to each other
+        'group': np.full(len(cnv_data), '', dtype=str),
+        'chr_name': cnv_data['Chromosome'].to_numpy(dtype=str),
+        'start': start,
+        'length': np.abs(start - end),
+        'logr': pd.to_numeric(cnv_data['LogR_Ratio'], errors='coerce').to_numpy(dtype=np.float64),
+        'label': np.full(len(cnv_data), -1, dtype=np.int8),
+    }
+
+
+def concat_tables(*tables):
+    return {key: np.concatenate([t[key] for t in tables]) for key in tables[0]}
+
+
+def linked_sample_pairs(df_edge):
+    # Unordered (a, b) sample keys with df_edge == 1
+    linked = np.asarray(df_edge.values == 1, dtype=bool)
+    rows, cols = np.nonzero(linked | linked.T)
+    keep = rows < cols
+    index = [sample_key(a) for a in df_edge.index]
+    columns = [sample_key(b) for b in df_edge.columns]
+    return [(index[r], columns[c]) for r, c in zip(rows[keep], cols[keep])]
+
+
+def chain_edges(group):
+    # Consecutive nodes of the same bubble file, in their original order
+    codes, uniques = pd.factorize(group)
+    valid = group != ''
+    order = np.argsort(codes, kind='stable')
+    order = order[valid[order]]
+    same = codes[order[:-1]] == codes[order[1:]]
+    return np.vstack((order[:-1][same], order[1:][same]))
+
+
+def sample_edges(nodes, samples, sample_indptr, sample_nodes, pairs, window=10000, match_chr=True):
+    sample_pos = {s: i for i, s in enumerate(samples)}
+
+    src = []
+    dst = []
+    for a, b in pairs:
+        if a not in sample_pos or b not in sample_pos:
+            continue
+        a_idx = sample_nodes[sample_indptr[sample_pos[a]]:sample_indptr[sample_pos[a] + 1]]
+        b_idx = sample_nodes[sample_indptr[sample_pos[b]]:sample_indptr[sample_pos[b] + 1]]
+        if len(a_idx) == 0 or len(b_idx) == 0:
+            continue
+        ia, ib = join_bubbles(nodes['chr_name'][a_idx], nodes['start'][a_idx], nodes['logr'][a_idx],
+                              nodes['chr_name'][b_idx], nodes['start'][b_idx], nodes['logr'][b_idx],
+                              window=window, match_chr=match_chr)
+        src.append(a_idx[ia])
+        dst.append(b_idx[ib])
+    if not src:
+        return np.empty((2, 0), dtype=np.int64)
+    return np.vstack((np.concatenate(src), np.concatenate(dst)))
+
+
+def unique_edges(edge_index):
+    # Undirected, no self loops, each edge once as (low, high)
+    edge_index = np.sort(np.asarray(edge_index, dtype=np.int64), axis=0)
+    edge_index = edge_index[:, edge_index[0] != edge_index[1]]
+    if edge_index.shape[1] == 0:
+        return edge_index
+    n = edge_index.max() + 1
+    keys = np.unique(edge_index[0] * n + edge_index[1])
+    return np.vstack((keys // n, keys % n))
+
+
+def build_graph_arrays(bub_results, cnv_data, df_edge, window=10000, match_chr=True):
+    nodes = concat_tables(bubble_node_table(bub_results), cnv_node_table(cnv_data))
+    samples, sample_ids = np.unique(nodes['sample'], return_inverse=True)
+    sample_indptr, sample_nodes = sample_index(sample_ids, len(samples))
+
+    pairs = linked_sample_pairs(df_edge)
+    edge_index = np.hstack((sample_edges(nodes, samples, sample_indptr, sample_nodes, pairs, window, match_chr),
+                            chain_edges(nodes['group']).astype(np.int64)))
+
+    graph = {
+        'name': nodes['name'],
+        'chr_name': nodes['chr_name'],
+        'start': nodes['start'],
+        'length': nodes['length'],
+        'logr': nodes['logr'],
+        'label': nodes['label'],
+        'sample_id': sample_ids.astype(np.int32),
+        'samples': samples,
+        'sample_indptr': sample_indptr,
+        'sample_nodes': sample_nodes,
+        'edge_index': unique_edges(edge_index),
+    }
+    print(f"Graph: {len(graph['name'])} nodes, {graph['edge_index'].shape[1]} edges, "
+          f"{len(samples)} samples, {len(pairs)} linked sample pairs")
+    return graph
+
+
+NODE_COLUMNS = ['name', 'chr_name', 'start', 'length', 'logr', 'label']
+
+
+def drop_bubble_nodes(graph, samples):
+    # The graph without the bubble nodes (label 0/1) of `samples` and their edges; their
+    # ZIP-Caller nodes stay. Returns the graph and the number of dropped nodes.
+    sample_pos = {str(s): i for i, s in enumerate(graph['samples'])}
+    sample_id = np.asarray(graph['sample_id'], dtype=np.int32)
+    keep = ~(np.isin(sample_id, [sample_pos[s] for s in samples]) & (np.asarray(graph['label']) != -1))
+    new_id = np.cumsum(keep) - 1
+    edge_index = graph_edge_index(graph)
+    edge_index = edge_index[:, keep[edge_index[0]] & keep[edge_index[1]]]
+
+    kept = {c: np.asarray(graph[c])[keep] for c in NODE_COLUMNS}
+    kept['sample_id'] = sample_id[keep]
+    kept['samples'] = np.asarray(graph['samples'], dtype=str)
+    kept['sample_indptr'], kept['sample_nodes'] = sample_index(kept['sample_id'], len(kept['samples']))
+    kept['edge_index'] = new_id[edge_index]
+    return kept, int((~keep).sum())
+
+
+def append_samples(graph, bub_results, cnv_data, df_edge, window=10000, match_chr=True, replace=()):
+    # Adds the samples of bub_results / cnv_data that are not in `graph` yet. Only edges
+    # touching the new nodes are computed; existing nodes and edges are kept as they are.
+    # Samples in `replace` (re-bubbled by Incremental_update.py -restandardize) are already in
+    # the graph: their bubble nodes are rebuilt from bub_results and their edges recomputed.
+    old_samples = [str(s) for s in graph['samples']]
+    known = np.array(old_samples, dtype=str)
+    sample_set = set(old_samples)
+    replaced = sorted({sample_key(s) for s in replace} & sample_set)
+    removed = 0
+    if replaced:
+        graph, removed = drop_bubble_nodes(graph, replaced)
+    bub_keys = sample_keys(bub_results['filename'])
+    new_bub = bub_results[~np.isin(bub_keys, known) | np.isin(bub_keys, replaced)]
+    new_cnv = cnv_data[~np.isin(sample_keys(cnv_data['SampleID']), known)]
+    nodes = concat_tables(bubble_node_table(new_bub), cnv_node_table(new_cnv))
+
+    new_samples = [str(s) for s in pd.unique(nodes['sample']) if s not in sample_set]
+    samples = np.array(old_samples + new_samples, dtype=str)
+    sample_pos = {s: i for i, s in enumerate(samples)}
+    offset = len(graph['name'])
+    num_new = len(nodes['name'])
+    new_ids = np.array([sample_pos[s] for s in nodes['sample']], dtype=np.int32)
+    sample_id = np.concatenate((np.asarray(graph['sample_id'], dtype=np.int32), new_ids))
+
+    if replaced:
+        # Replaced samples get nodes at the end too, so their index entries are rebuilt
+        sample_indptr, sample_nodes = sample_index(sample_id, len(samples))
+    else:
+        # New nodes only belong to new samples, so the sample index just grows at the end
+        new_indptr, new_order = sample_index(new_ids - len(old_samples), len(new_samples))
+        old_indptr = np.asarray(graph['sample_indptr'])
+        sample_indptr = np.concatenate((old_indptr, old_indptr[-1] + new_indptr[1:]))
+        sample_nodes = np.concatenate((np.asarray(graph['sample_nodes']), offset + new_order))
+
+    updated = {c: np.concatenate((np.asarray(graph[c]), nodes[c])) for c in NODE_COLUMNS}
+    updated['sample_id'] = sample_id
+    updated['samples'] = samples
+    updated['sample_indptr'] = sample_indptr
+    updated['sample_nodes'] = sample_nodes
+
+    added = set(new_samples) | set(replaced)
+    pairs = [(a, b) for a, b in linked_sample_pairs(df_edge) if a in added or b in added]
+    new_edges = unique_edges(np.hstack((
+        sample_edges(updated, samples, sample_indptr, sample_nodes, pairs, window, match_chr),
+        offset + chain_edges(nodes['group']).astype(np.int64))))
+    old_edges = graph_edge_index(graph)
+    edge_index = np.hstack((old_edges, new_edges))
+    # A replaced sample's kept ZIP-Caller nodes meet edges that already exist
+    updated['edge_index'] = unique_edges(edge_index) if replaced else edge_index
+
+    delta = {
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'samples': new_samples,
+        'replaced': replaced,
+        'removed_nodes': removed,
+        'node_range': [int(offset), int(offset + num_new)],
+        'new_edges': int(updated['edge_index'].shape[1] - old_edges.shape[1]),
+        'linked_sample_pairs': len(pairs),
+    }
+    print(f"Graph update: +{len(new_samples)} samples, {len(replaced)} replaced (-{removed} nodes), "
+          f"+{num_new} nodes, +{delta['new_edges']} edges")
+    return updated, delta
+
+
+def node_features(graph):
+    return np.column_stack((graph['start'], graph['length'], graph['logr'])).astype(np.float32)
+
+
+def to_networkx(graph):
+    labels = ['unknown' if label == -1 else label for label in graph['label'].tolist()]
+    G = nx.Graph()
+    G.add_nodes_from(
+        (name, {'chr_name': chr_name, 'start': start, 'length': length, 'logr': logr, 'label': label})
+        for name, chr_name, start, length, logr, label in zip(
+            graph['name'].tolist(), graph['chr_name'].tolist(), graph['start'].tolist(),
+            graph['length'].tolist(), graph['logr'].tolist(), labels)
+    )
+    names = graph['name']
+    G.add_edges_from(zip(names[graph['edge_index'][0]].tolist(), names[graph['edge_index'][1]].tolist()))
+    return G
+
+
+def from_networkx(G):
+    nodes = list(G.nodes(data=True))
+    names = np.array([str(node) for node, data in nodes], dtype=str)
+    position = {node: i for i, (node, data) in enumerate(nodes)}
+    samples, sample_ids = np.unique(sample_keys(names), return_inverse=True)
+    sample_indptr, sample_nodes = sample_index(sample_ids, len(samples))
+    edges = np.array([(position[u], position[v]) for u, v in G.edges()], dtype=np.int64).reshape(-1, 2).T
+    return {
+        'name': names,
+        'chr_name': np.array([str(data['chr_name']) for node, data in nodes], dtype=str),
+        'start': np.array([data['start'] for node, data in nodes], dtype=np.int64),
+        'length': np.array([data['length'] for node, data in nodes], dtype=np.int64),
+        'logr': pd.to_numeric(pd.Series([data['logr'] for node, data in nodes]), errors='coerce').to_numpy(dtype=np.float64),
+        'label': np.array([label_mapping[str(data['label'])] for node, data in nodes], dtype=np.int8),
+        'sample_id': sample_ids.astype(np.int32),
+        'samples': samples,
+        'sample_indptr': sample_indptr,
+        'sample_nodes': sample_nodes,
+        'edge_index': unique_edges(edges),
+    }
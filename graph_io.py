@@ -0,0 +1,190 @@
+import os
+import json
+import numpy as np
+from scipy.sparse import csr_matrix
+
+GRAPH_FORMAT = 'pangenomex-graph'
+GRAPH_VERSION = 1
+HEADER_FILE = 'header.json'
+DELTA_LOG_FILE = 'delta_log.jsonl'
+
+# Columnar node arrays, one .npy each (fixed-width strings, never pickled)
+NODE_COLUMNS = ['name', 'chr_name', 'start', 'length', 'logr', 'label', 'sample_id']
+FEATURE_COLUMNS = ['start', 'length', 'logr']
+
+
+def is_graph_dir(path):
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+def edges_to_csr(edge_index, num_nodes):
+    # Symmetric CSR (both directions stored), neighbours sorted
+    src, dst = np.asarray(edge_index, dtype=np.int64)
+    row = np.concatenate((src, dst))
+    col = np.concatenate((dst, src))
+    order = np.lexsort((col, row))
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row, minlength=num_nodes), out=indptr[1:])
+    return indptr, col[order].astype(np.int32 if num_nodes < 2 ** 31 else np.int64)
+
+
+def sample_index(sample_ids, num_samples):
+    # sample -> node ids as CSR: sample s owns sample_nodes[sample_indptr[s]:sample_indptr[s + 1]]
+    sample_ids = np.asarray(sample_ids, dtype=np.int64)
+    sample_nodes = np.argsort(sample_ids, kind='stable')
+    sample_indptr = np.zeros(num_samples + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sample_ids, minlength=num_samples), out=sample_indptr[1:])
+    return sample_indptr, sample_nodes
+
+
+def csr_to_edges(indptr, indices):
+    row = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+    col = np.asarray(indices, dtype=np.int64)
+    keep = row < col
+    return np.vstack((row[keep], col[keep]))
+
+
+def save_graph(graph, path):
+    os.makedirs(path, exist_ok=True)
+    num_nodes = len(graph['name'])
+    if 'indptr' in graph:
+        indptr, indices = graph['indptr'], graph['indices']
+    else:
+        indptr, indices = edges_to_csr(graph['edge_index'], num_nodes)
+
+    arrays = {column: np.asarray(graph[column]) for column in NODE_COLUMNS}
+    arrays['samples'] = np.asarray(graph['samples'], dtype=str)
+    arrays['features'] = np.column_stack([graph[c] for c in FEATURE_COLUMNS]).astype(np.float32)
+    arrays['indptr'] = np.asarray(indptr, dtype=np.int64)
+    arrays['indices'] = np.asarray(indices)
+    if 'sample_indptr' in graph:
+        arrays['sample_indptr'] = np.asarray(graph['sample_indptr'], dtype=np.int64)
+        arrays['sample_nodes'] = np.asarray(graph['sample_nodes'], dtype=np.int64)
+    else:
+        arrays['sample_indptr'], arrays['sample_nodes'] = sample_index(graph['sample_id'], len(arrays['samples']))
+
+    # Rewriting a graph in place (tree2graph.py -update with -o equal to -g): the arrays go to
+    # new file names and the header is swapped in with os.replace, so a reader or a crash sees
+    # either the old graph or the new one, never a mix
+    previous = read_header(path) if is_graph_dir(path) else None
+    generation = previous.get('generation', 0) + 1 if previous else 0
+    files = {}
+    for key, array in arrays.items():
+        files[key] = f'{key}.npy' if generation == 0 else f'{key}.{generation}.npy'
+        np.save(os.path.join(path, files[key]), array, allow_pickle=False)
+
+    header = {
+        'format': GRAPH_FORMAT,
+        'version': GRAPH_VERSION,
+        'generation': generation,
+        'num_nodes': int(num_nodes),
+        'num_edges': int(len(arrays['indices']) // 2),
+        'num_samples': int(len(arrays['samples'])),
+        'feature_columns': FEATURE_COLUMNS,
+        'label_mapping': {'0': 0, '1': 1, 'unknown': -1},
+        'files': files,
+    }
+    # header last, so a half-written directory is never picked up as a graph
+    with open(os.path.join(path, HEADER_FILE + '.tmp'), 'w') as f:
+        json.dump(header, f, indent=4)
+    os.replace(os.path.join(path, HEADER_FILE + '.tmp'), os.path.join(path, HEADER_FILE))
+    if previous:
+        for name in set(previous['files'].values()) - set(files.values()):
+            os.remove(os.path.join(path, name))
+    return header
+
+
+def read_header(path):
+    with open(os.path.join(path, HEADER_FILE), 'r') as f:
+        header = json.load(f)
+    if header.get('format') != GRAPH_FORMAT:
+        raise ValueError(f"{path} is not a {GRAPH_FORMAT} directory")
+    if header.get('version', 0) > GRAPH_VERSION:
+        raise ValueError(f"{path} has graph format version {header['version']}, "
+                         f"this code reads up to version {GRAPH_VERSION}")
+    return header
+
+
+def load_graph(path, mmap=True):
+    # mmap_mode='c' is copy-on-write: nothing is read until touched and the arrays stay writable
+    header = read_header(path)
+    mode = 'c' if mmap else None
+    graph = {key: np.load(os.path.join(path, name), mmap_mode=mode, allow_pickle=False)
+             for key, name in header['files'].items()}
+    if 'sample_indptr' not in graph:
+        graph['sample_indptr'], graph['sample_nodes'] = sample_index(graph['sample_id'], len(graph['samples']))
+    graph['header'] = header
+    return graph
+
+
+def induced_csr(indptr, indices, nodes):
+    # CSR of the subgraph induced by `nodes` (local ids follow their order in `nodes`).
+    # Only the rows of `nodes` are read; the kept edges are copied once.
+    indptr = np.asarray(indptr)
+    nodes = np.asarray(nodes, dtype=np.int64)
+    position = np.full(len(indptr) - 1, -1, dtype=np.int64)
+    position[nodes] = np.arange(len(nodes))
+    begin = indptr[nodes]
+    deg = indptr[nodes + 1] - begin
+    rows = np.repeat(np.arange(len(nodes)), deg)
+    cols = position[np.asarray(indices)[begin[rows] + np.arange(deg.sum()) - np.repeat(np.cumsum(deg) - deg, deg)]]
+    keep = cols >= 0
+    rows = rows[keep]
+    cols = cols[keep]
+    if np.any(np.diff(nodes) < 0):
+        order = np.lexsort((cols, rows))
+        rows = rows[order]
+        cols = cols[order]
+    sub_indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(nodes)), out=sub_indptr[1:])
+    return sub_indptr, cols
+
+
+def csr_tensor(indptr, indices, num_nodes):
+    import torch
+    indices = torch.from_numpy(np.asarray(indices, dtype=np.int64))
+    return torch.sparse_csr_tensor(torch.from_numpy(np.asarray(indptr, dtype=np.int64)), indices,
+                                   torch.ones(len(indices), dtype=torch.float32), size=(num_nodes, num_nodes))
+
+
+def append_delta_log(path, entry, source=None):
+    # One JSON line per incremental update; carried over when the update is written to a new directory
+    log_file = os.path.join(path, DELTA_LOG_FILE)
+    if source is not None and os.path.abspath(source) != os.path.abspath(path):
+        source_log = os.path.join(source, DELTA_LOG_FILE)
+        if os.path.isfile(source_log):
+            with open(source_log, 'r') as f:
+                history = f.read()
+            with open(log_file, 'w') as f:
+                f.write(history)
+    with open(log_file, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def graph_edge_index(graph):
+    if 'edge_index' in graph:
+        return graph['edge_index']
+    return csr_to_edges(graph['indptr'], graph['indices'])
+
+
+def graph_adjacency(graph):
+    n = len(graph['name'])
+    indptr = np.asarray(graph['indptr'])
+    indices = np.asarray(graph['indices'])
+    data = np.ones(len(indices), dtype=np.float32)
+    return csr_matrix((data, indices, indptr), shape=(n, n))
+
+
+def load_graph_file(path):
+    # .pgx directory (memory-mapped), or a legacy networkx .gpickle.
+    # Unpickling runs arbitrary code: only pass .gpickle files you trust.
+    if is_graph_dir(path):
+        return load_graph(path, mmap=True)
+    import pickle
+    from graph_builder import from_networkx, node_features
+    print(f"Warning: '{path}' is a legacy pickled graph, convert it with tree2graph -o <graph.pgx>")
+    with open(path, 'rb') as f:
+        graph = from_networkx(pickle.load(f))
+    graph['indptr'], graph['indices'] = edges_to_csr(graph['edge_index'], len(graph['name']))
+    graph['features'] = node_features(graph)
+    return graph
@@ -0,0 +1,79 @@
+import sys
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+import torch
+from graph_io import induced_csr, csr_tensor
+from gcn import feature_stats, standardize_features
+
+
+def max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+@contextmanager
+def memory_stage(name, report, trace=False):
+    # Time and process high-water mark of the stage, appended to `report` (nothing without one).
+    # With trace, also the peak of numpy/Python allocations (tracemalloc), which slows
+    # Python loops down several times; tracing started here is stopped on exit.
+    if report is None:
+        yield
+        return
+    started = trace and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if trace:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+    st = time.time()
+    try:
+        yield
+        stage = {'stage': name, 'sec': time.time() - st, 'max_rss_mb': max_rss_mb()}
+        if trace:
+            stage['peak_mb'] = (tracemalloc.get_traced_memory()[1] - base) / 2 ** 20
+    finally:
+        if started:
+            tracemalloc.stop()
+    report.append(stage)
+    peak = f", peak +{stage['peak_mb']:.1f} MB" if trace else ''
+    print(f"[{name}] {stage['sec']:.2f}s{peak}, max RSS {stage['max_rss_mb']:.1f} MB")
+
+
+def prepare_inputs(graph, feature_norm=None, report=None, trace=False):
+    # Tensors for pgcnv from the (memory-mapped) graph arrays:
+    # standardized features, labels, and train / unknown CSR adjacencies sliced
+    # straight from the stored CSR, never through dense or scipy COO copies.
+    # Stages are only timed when a report list is passed.
+    inputs = {}
+
+    with memory_stage('labels', report, trace):
+        labels = np.asarray(graph['label'])
+        inputs['train_idx'] = np.where(labels != -1)[0]
+        inputs['test_idx'] = np.where(labels == -1)[0]
+        inputs['y'] = torch.from_numpy(labels.astype(np.float32))
+
+    with memory_stage('features', report, trace):
+        X = torch.from_numpy(np.asarray(graph['features'], dtype=np.float32))
+        if feature_norm is None:
+            feature_norm = feature_stats(X[inputs['train_idx']])
+        inputs['X'] = standardize_features(X, feature_norm)
+        inputs['feature_norm'] = feature_norm
+
+    with memory_stage('adjacency', report, trace):
+        for split in ('train', 'test'):
+            nodes = inputs[f'{split}_idx']
+            indptr, indices = induced_csr(graph['indptr'], graph['indices'], nodes)
+            inputs[f'{split}_csr'] = (indptr, indices)
+            inputs[f'adj_{split}'] = csr_tensor(indptr, indices, len(nodes))
+    return inputs
+
+
+def print_memory_report(report):
+    print('stage\tsec\tpeak_mb\tmax_rss_mb')
+    for stage in report:
+        peak = f"{stage['peak_mb']:.1f}" if 'peak_mb' in stage else '-'
+        print(f"{stage['stage']}\t{stage['sec']:.2f}\t{peak}\t{stage['max_rss_mb']:.1f}")
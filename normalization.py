@@ -0,0 +1,84 @@
+import os
+import json
+import numpy as np
+from utils import load_npz_file, load_from_json
+
+# Registry of normalization versions, next to the standardized samples in data/nor/:
+# {"latest": k, "samples": {"<sample>.json": {"file_name": ..., "version": v}}}.
+# The Rj_means of every version still in use are kept in rj_means_v<k>.npz.
+VERSIONS_FILE = 'norm_versions.json'
+
+
+def json_name(sample):
+    return os.path.basename(sample).replace('.bam', '.json')
+
+
+def read_standardized(samples, json_dir):
+    # (sample, standardized depth) from data/nor/, one sample in memory at a time
+    for sample in samples:
+        filename = os.path.join(json_dir, json_name(sample))
+        print(f'process {filename} ..................')
+        yield sample, load_from_json(filename)
+
+
+def standardize(depth, rj_means, epsilon=1e-6):
+    # Depth over the sample's Rj^mode (median) and the cohort's per-position Ri·^mean
+    depth = np.asarray(depth, dtype=np.float64)
+    return np.round((depth / (np.median(depth) + epsilon)) / rj_means, 2)
+
+
+def rescale(standardized, old_means, new_means):
+    # The same sample against new means, without its raw depth: s * R_old / R_new
+    return np.round(np.asarray(standardized) * (np.asarray(old_means) / np.asarray(new_means)), 2)
+
+
+def drift(old, new):
+    # Largest absolute change of a sample's standardized values over all chromosomes
+    return max((float(np.max(np.abs(new[chr_name] - old[chr_name]))) for chr_name in old if len(old[chr_name])),
+               default=0.0)
+
+
+def means_file(json_dir, version):
+    return os.path.join(json_dir, f'rj_means_v{version}.npz')
+
+
+def new_versions():
+    return {'latest': -1, 'samples': {}}
+
+
+def load_versions(json_dir):
+    path = os.path.join(json_dir, VERSIONS_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_versions(json_dir, versions):
+    path = os.path.join(json_dir, VERSIONS_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(versions, f, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def add_version(json_dir, versions, rj_means):
+    version = versions['latest'] + 1
+    np.savez(means_file(json_dir, version), **rj_means)
+    versions['latest'] = version
+    return version
+
+
+def load_means(json_dir, version):
+    return load_npz_file(means_file(json_dir, version))
+
+
+def set_sample_version(versions, sample, version):
+    versions['samples'][json_name(sample)] = {'file_name': sample, 'version': version}
+
+
+def prune_versions(json_dir, versions):
+    # Means files that no sample refers to any more
+    used = {entry['version'] for entry in versions['samples'].values()} | {versions['latest']}
+    for version in range(versions['latest']):
+        if version not in used and os.path.isfile(means_file(json_dir, version)):
+            os.remove(means_file(json_dir, version))
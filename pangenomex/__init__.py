@@ -0,0 +1,11 @@
+# The pipeline stages as functions on in-memory data: per-chromosome depth arrays, CNV and
+# bubble DataFrames, graph dicts of numpy arrays. The stage scripts are thin wrappers that
+# read and write the files in between.
+#   depth      raw and standardized depths, cohort means, baseline (data_processing.py)
+#   zipcaller  ZIP-Caller CNV calls (zip_caller.py)
+#   bubbles    bubbles and labeled CNVs (gen_bubbles.py)
+#   graph      tree edges and the pangenome graph (tree2graph.py)
+#   gcn        training and scoring (pgcnv.py)
+#   workflow   run(): all of them in one process
+# Submodules are imported on use, so the stage scripts do not pull in torch.
+__all__ = ['depth', 'zipcaller', 'bubbles', 'graph', 'gcn', 'workflow']
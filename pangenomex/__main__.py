@@ -0,0 +1,47 @@
+import os
+import time
+import argparse
+from datetime import datetime
+from graph_io import save_graph
+from gcn import save_model
+from pangenomex.workflow import config_inputs, run
+
+parser = argparse.ArgumentParser(prog='python -m pangenomex')
+parser.add_argument('-config', type=str, help="Path to the '.config' file ", required=True)
+parser.add_argument('-clist', type=str, help="Path to the cnv  list (.csv file)", required=True)
+parser.add_argument('-nwk', type=str, default=None, help="Path to the .nwk file (default: nwk_file_path of the config)")
+parser.add_argument('-o', type=str, help="Path to the output directory, example: data/output", required=True)
+parser.add_argument('-n', type=int, default=3000, help="ZIP-Caller sliding window size")
+parser.add_argument('-k', type=float, default=0.3, help="ZIP-Caller reference value for the allowed degree of deviation")
+parser.add_argument('-win', type=int, default=10000, help="Max start distance between linked bubbles of neighbouring samples")
+parser.add_argument('-arch', type=str, default='gcn', choices=['gcn', 'sgc'], help="Model architecture, as in pgcnv.py")
+parser.add_argument('-epochs', type=int, default=200, help="Maximum number of training epochs")
+parser.add_argument('-graph', type=str, default=None, help="Also save the graph here (.pgx directory)")
+parser.add_argument('-model', type=str, default=None, help="Also save the model here (same format as pgcnv.py)")
+
+
+def main():
+    # Every stage in this process; only the final results (and -graph / -model) are written
+    current_datetime = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    os.makedirs(args.o, exist_ok=True)
+    inputs = config_inputs(args.config, args.clist, args.nwk)
+    result = run(**inputs, slide_win=args.n, K=args.k, window=args.win, arch=args.arch, epochs=args.epochs)
+
+    output_file = os.path.join(args.o, f'pgcnv_res_{current_datetime}.tsv')
+    result['results'].to_csv(output_file, sep='\t', index=False)
+    print(f"Results have saved to the '{output_file}' file")
+    if args.graph is not None:
+        save_graph(result['graph'], args.graph)
+        print(f"Graph have saved as '{args.graph} file")
+    if args.model is not None:
+        save_model(args.model, result['model'], result['config'], result['feature_norm'])
+        print(f"Model saved as '{args.model}'")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    st = time.time()
+    main()
+    et = time.time()
+    rt = et - st
+    print(f"Finish! runtime: {rt}sec")
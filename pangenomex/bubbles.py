@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+BUBBLE_COLUMNS = ['filename', 'chr_name', 'start', 'length', 'logr', 'label']
+
+
+def gen_bub(differ, a, b):
+    segments = []
+    start = None
+    for i in range(len(differ)):
+        if differ[i] > 0 or differ[i] < 0:
+            if start is None:
+                start = i
+        else:
+            if start is not None:
+                length = i - start
+                if length >= 5000:
+                    segments.append((start, length))
+                start = None
+    result = []
+    for start, length in segments:
+        a_segment = a[start:start + length]
+        b_segment = b[start:start + length]
+        logr = np.round(np.log2(np.mean(a_segment) / np.mean(b_segment)), 2)
+        result.append([start, length, logr])
+
+    return result
+
+
+def sample_bubbles(sample, standardized_depth, chr_len_list, baseline_data):
+    bub_results = []
+    for chr_name, chr_len in chr_len_list:
+        s = standardized_depth[chr_name]
+        b = baseline_data[chr_name]
+        dif = s - b
+        result = gen_bub(dif, s, b)
+        for start, length, logr in result:
+            bub_results.append([sample, chr_name, start, length, logr, 0])
+    return bub_results
+
+
+def cohort_bubbles(standardized, chr_len_list, baseline_data):
+    # {bam file: standardized depth}, or (bam file, standardized depth) pairs such as
+    # normalization.read_standardized yields one at a time -> unlabeled bubbles of all samples
+    bub_results = []
+    items = standardized.items() if isinstance(standardized, dict) else standardized
+    for sample, standardized_depth in items:
+        bub_results.extend(sample_bubbles(sample, standardized_depth, chr_len_list, baseline_data))
+    return pd.DataFrame(bub_results, columns=BUBBLE_COLUMNS)
+
+
+def add_known_cnvs(bub_df, cnv_sample):
+    # The labeled CNVs of the training samples (file_name, chr_name, start_pos, end_pos, logr)
+    # as label-1 bubbles; the bubbles they overlap are removed
+    cnv_results = []
+    for index, row in cnv_sample.iterrows():
+        length = abs(row['end_pos'] - row['start_pos'])
+        cnv_results.append([row['file_name'], row['chr_name'], row['start_pos'], length, row['logr'], 1])
+    cnv_df = pd.DataFrame(cnv_results, columns=BUBBLE_COLUMNS)
+
+    for index, row in cnv_df.iterrows():
+        bub_df = bub_df[~((bub_df['filename'] == row['filename']) &
+                          (bub_df['chr_name'] == row['chr_name']) &
+                          (bub_df['start'] < row['start'] + row['length']) &
+                          (bub_df['start'] + bub_df['length'] > row['start']))]
+    return pd.concat([bub_df, cnv_df], ignore_index=True)
+
+
+def save_bub_results(bub_df, npz_file, replaced=()):
+    # replaced: samples whose bubbles changed since the graph was built (Incremental_update.py)
+    np.savez(npz_file, bub_array=bub_df.to_numpy(), columns=list(bub_df.columns),
+             replaced=np.array(list(replaced), dtype=str))
+
+
+def load_bub_results(npz_file):
+    data = np.load(npz_file, allow_pickle=True)
+    bub_array = data['bub_array']
+    columns = data['columns']
+    bub_results = pd.DataFrame(bub_array, columns=columns)
+    return bub_results
+
+
+def load_replaced(npz_file):
+    # Samples recorded as re-bubbled by save_bub_results (none for files written before)
+    with np.load(npz_file, allow_pickle=True) as data:
+        return [str(sample) for sample in data['replaced']] if 'replaced' in data else []
@@ -0,0 +1,48 @@
+import os
+import numpy as np
+from utils import calcu_bam_dep, load_npz_file
+from stats import CohortSummary
+from normalization import standardize
+
+EPSILON = 1e-6
+
+
+def bam_depth(bam_file, chr_len_list, read_len):
+    # Raw per-position depth, one float array per chromosome
+    return calcu_bam_dep(chr_len_list, bam_file, read_len)
+
+
+def cohort_summary(sample_depths):
+    summary = CohortSummary()
+    for sample_depth in sample_depths:
+        summary.update(sample_depth)
+    return summary
+
+
+def cohort_means(summary, chr_len_list, epsilon=EPSILON):
+    # Ri·^mean for each position, adding epsilon to avoid division by zero
+    return {chr_name: summary.mean(chr_name) + epsilon for chr_name, chr_len in chr_len_list}
+
+
+def standardize_sample(sample_depth, rj_means, chr_len_list):
+    return {chr_name: standardize(sample_depth[chr_name], rj_means[chr_name]) for chr_name, chr_len in chr_len_list}
+
+
+def baseline_depth(baseline_summary, chr_len_list):
+    # Mean standardized depth of the baseline samples (zeros for a chromosome none of them has)
+    return {chr_name: baseline_summary.mean(chr_name) if baseline_summary.count(chr_name) else np.zeros(chr_len)
+            for chr_name, chr_len in chr_len_list}
+
+
+def save_baseline(baseline_data, baseline_save_path):
+    os.makedirs(baseline_save_path, exist_ok=True)
+    for chr_name in baseline_data:
+        np.savez(f'{baseline_save_path}/baseline_file_{chr_name}', **baseline_data)
+
+
+def load_baseline(baseline_save_path, chr_len_list):
+    baseline_data = {}
+    for chr_name, chr_len in chr_len_list:
+        loaded_data = load_npz_file(f'{baseline_save_path}/baseline_file_{chr_name}.npz')
+        baseline_data[chr_name] = loaded_data[chr_name]
+    return baseline_data
@@ -0,0 +1,29 @@
+import torch
+from graph_io import graph_adjacency
+from graph_prep import prepare_inputs
+from gcn import model_config, split_validation, training_view, train_model, predict_unknown, results_table
+
+
+def train(graph, arch='gcn', hidden=64, layers=2, lr=0.001, epochs=200, val=0.1, patience=20, batch_size=0,
+          fanout=(10, 10), log_file=None, cache_file=None, report=None, seed=42, verbose=True):
+    # pgcnv -mode train on a graph dict (from pangenomex.graph.build_graph or graph_io.load_graph).
+    # Returns the model, its config and the prepared inputs, which predict() reuses.
+    torch.manual_seed(seed)
+    inputs = prepare_inputs(graph, None, report)
+    config = model_config(inputs, arch, hidden, layers, batch_size, fanout)
+    adj = graph_adjacency(graph) if arch == 'sgc' else None
+    view = training_view(inputs, config, adj, cache_file)
+    val_pos = split_validation(len(inputs['train_idx']), val, seed)
+    model, _ = train_model(view, config, val_pos, lr=lr, num_epochs=epochs, patience=patience, log_file=log_file,
+                           verbose=verbose)
+    return model, config, inputs
+
+
+def predict(model, config, graph, inputs=None, feature_norm=None, cache_file=None):
+    # Scores of the unknown nodes as pgcnv writes them (SampleID ... Predicted_Label), plus
+    # the probabilities. Pass the inputs from train(), or the feature_norm of a saved model.
+    if inputs is None:
+        inputs = prepare_inputs(graph, feature_norm)
+    adj = graph_adjacency(graph) if config['arch'] == 'sgc' else None
+    predictions = predict_unknown(model, config, inputs, adj, cache_file)
+    return results_table(graph, inputs['test_idx'], predictions), predictions
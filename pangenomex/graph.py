@@ -0,0 +1,98 @@
+import re
+import pandas as pd
+from graph_builder import build_graph_arrays, append_samples, node_features
+from graph_io import edges_to_csr
+
+
+def parse_newick(newick_str):
+    stack = []
+    current_node = ""
+    nodes = {}
+
+    for char in newick_str:
+        if char == '(':
+            stack.append(current_node)
+            current_node = ""
+        elif char == ',':
+            if current_node:
+                nodes[current_node] = len(stack)
+                current_node = ""
+        elif char == ')':
+            if current_node:
+                nodes[current_node] = len(stack)
+                current_node = ""
+            if stack:
+                current_node = stack.pop()
+        else:
+            current_node += char
+
+    return nodes
+
+
+def cal_dis(newick_str, sample1, sample2):
+    pos1 = newick_str.find(sample1)
+    pos2 = newick_str.find(sample2)
+
+    if pos1 == -1 or pos2 == -1:
+        raise ValueError("The sample name does not exist in the Newick string.")
+
+    distance = 0
+    if pos1 < pos2:
+        for i in range(pos1, pos2):
+            if newick_str[i] == '(':
+                distance += 1
+    else:
+        for i in range(pos2, pos1):
+            if newick_str[i] == '(':
+                distance += 1
+
+    return distance
+
+
+def tree_matrices(newick_tree):
+    # Pairwise distances of the tree's samples (number of '(' between them) and the
+    # edge matrix linking samples at distance <= 1; the diagonals hold 'NA'
+    newick_cleaned = re.sub(r'\)(\d+(\.\d+)?)', ')', newick_tree)
+    nodes = parse_newick(newick_cleaned)
+    sample_names = list(nodes.keys())
+
+    df_dis = pd.DataFrame(index=sample_names, columns=sample_names)
+    for a in sample_names:
+        for b in sample_names:
+            if a == b:
+                df_dis.at[a, b] = 'NA'
+            else:
+                df_dis.at[a, b] = cal_dis(newick_cleaned, a, b)
+
+    df_edge = pd.DataFrame(index=sample_names, columns=sample_names)
+    for a in sample_names:
+        for b in sample_names:
+            if a == b:
+                df_edge.at[a, b] = 'NA'
+            else:
+                distance = df_dis.at[a, b]
+                if distance <= 1:
+                    df_edge.at[a, b] = 1
+                elif distance > 1:
+                    df_edge.at[a, b] = 0
+    return df_dis, df_edge
+
+
+def with_csr(graph):
+    # The symmetric CSR and feature matrix save_graph stores, so a graph built in memory
+    # can go straight to pgcnv (graph_prep.prepare_inputs)
+    graph['indptr'], graph['indices'] = edges_to_csr(graph['edge_index'], len(graph['name']))
+    graph['features'] = node_features(graph)
+    return graph
+
+
+def build_graph(bub_results, cnv_data, df_edge, window=10000, match_chr=True):
+    return with_csr(build_graph_arrays(bub_results, cnv_data, df_edge, window=window, match_chr=match_chr))
+
+
+def update_graph(graph, bub_results, cnv_data, df_edge, window=10000, match_chr=True, replace=()):
+    # Only the samples not in `graph` yet are added, and the bubble nodes of `replace` rebuilt;
+    # returns the graph and its delta log entry
+    graph, delta = append_samples(graph, bub_results, cnv_data, df_edge, window=window, match_chr=match_chr,
+                                  replace=replace)
+    return with_csr(graph), delta
@@ -0,0 +1,79 @@
+import os
+from contextlib import nullcontext
+import pandas as pd
+from utils import read_config, read_chr_len_file, sample_files
+from pangenomex import depth, zipcaller, bubbles, graph, gcn
+
+
+def config_inputs(config_file, cnv_list_file, nwk_file=None):
+    # run() arguments from the files the stage scripts read: .config, its sample lists, the CNV list and the tree
+    paths = read_config(config_file)
+    with open(nwk_file or paths['nwk_file_path'], 'r') as file:
+        newick_tree = file.read()
+    return {
+        'train_files': sample_files(pd.read_csv(paths['train_file_list'], index_col=0)),
+        'test_files': sample_files(pd.read_csv(paths['test_file_list'], index_col=0)),
+        'baseline_files': sample_files(pd.read_csv(paths['baseline_file_list'], index_col=0)),
+        'cnv_list': pd.read_csv(cnv_list_file, index_col=0),
+        'newick_tree': newick_tree,
+        'chr_len_list': read_chr_len_file(paths['chr_len_path']),
+        'read_len': int(paths['read_len']),
+    }
+
+
+def no_stage(name):
+    return nullcontext()
+
+
+def run(train_files, test_files, baseline_files, cnv_list, newick_tree, chr_len_list, read_len,
+        slide_win=3000, K=0.3, window=10000, match_chr=True, stage=no_stage, **train_options):
+    # data_processing -> zip_caller -> gen_bubbles -> tree2graph -> pgcnv in one process: depths,
+    # calls, bubbles and the graph are handed on in memory instead of through data/nor/*.json,
+    # the .cnv file, bub_results.npz, df_edge.csv and the graph directory.
+    # stage(name) wraps each step (depth, standardize, zipcaller, bubbles, tree2graph, gcn) in a
+    # context manager, e.g. to time it; train_options go to gcn.train (arch, hidden, layers, lr, epochs, ...).
+    with stage('depth'):
+        sample_depths = {}
+        for bam_file in dict.fromkeys(list(test_files) + list(baseline_files) + list(train_files)):
+            if os.path.isfile(bam_file):
+                print(f'process {bam_file} ..................')
+                sample_depths[bam_file] = depth.bam_depth(bam_file, chr_len_list, read_len)
+        summary = depth.cohort_summary(sample_depths.values())
+        rj_means = depth.cohort_means(summary, chr_len_list)
+
+    with stage('standardize'):
+        # Raw depths are dropped once standardized
+        standardized = {bam_file: depth.standardize_sample(sample_depths.pop(bam_file), rj_means, chr_len_list)
+                        for bam_file in list(sample_depths)}
+        baseline_summary = depth.cohort_summary(standardized[f] for f in dict.fromkeys(baseline_files)
+                                                if f in standardized)
+        baseline_data = depth.baseline_depth(baseline_summary, chr_len_list)
+
+    with stage('zipcaller'):
+        calls = zipcaller.call_cohort({f: standardized[f] for f in test_files if f in standardized},
+                                      baseline_data, chr_len_list, slide_win, K)
+
+    with stage('bubbles'):
+        bub_df = bubbles.cohort_bubbles({f: standardized[f] for f in list(train_files) + list(test_files)
+                                         if f in standardized}, chr_len_list, baseline_data)
+        bub_df = bubbles.add_known_cnvs(bub_df, cnv_list)
+
+    with stage('tree2graph'):
+        df_dis, df_edge = graph.tree_matrices(newick_tree)
+        pangenome_graph = graph.build_graph(bub_df, calls, df_edge, window=window, match_chr=match_chr)
+
+    with stage('gcn'):
+        model, config, inputs = gcn.train(pangenome_graph, **train_options)
+        results, predictions = gcn.predict(model, config, pangenome_graph, inputs)
+    return {
+        'cohort': {'summary': summary, 'rj_means': rj_means, 'standardized': standardized,
+                   'baseline_summary': baseline_summary, 'baseline': baseline_data},
+        'calls': calls,
+        'bubbles': bub_df,
+        'df_edge': df_edge,
+        'graph': pangenome_graph,
+        'model': model,
+        'config': config,
+        'feature_norm': inputs['feature_norm'],
+        'results': results,
+    }
@@ -0,0 +1,149 @@
+import os
+import math
+import numpy as np
+import pandas as pd
+
+# ZIP-Caller: CUSUM of windowed log depth ratios against the baseline.
+# Please refer to the supplementary materials for the parameters.
+CNV_COLUMNS = ['SampleID', 'Chromosome', 'Start', 'End', 'LogR_Ratio', 'CNV_Type']
+MIN_SEGMENT = 10000
+
+
+def calcu_win_depth(data, pgg, window_size):
+    win_depth = []
+    for i in range(len(data) - window_size + 1):
+        x_bar = np.mean(data[i:i + window_size])
+        p_bar = np.mean(pgg[i:i + window_size])
+        s_bar = np.log(x_bar / p_bar)
+        win_depth.append(s_bar)
+    return win_depth
+
+
+def calcu_ct(data, K):
+    ct_up = np.zeros(len(data))
+    ct_down = np.zeros(len(data))
+    for i in range(len(data)):
+        if i == 0:
+            ct_up[i] = 0
+            ct_down[i] = 0
+        else:
+            ct_up[i] = np.max([0, data[i] - K + ct_up[i - 1]])
+            ct_down[i] = np.min([0, data[i] + K + ct_down[i - 1]])
+    return ct_up, ct_down
+
+
+def find_continuous_up_segments(ct, H_pos, min_length):
+    up_segments = []
+    current_segment = []
+
+    for i, num in enumerate(ct):
+        if num >= H_pos:
+            current_segment.append((i, num))
+        else:
+            if len(current_segment) >= min_length:
+                up_segments.append(current_segment)
+            current_segment = []
+
+    if len(current_segment) >= min_length:
+        up_segments.append(current_segment)
+
+    return up_segments
+
+
+def find_continuous_down_segments(ct, H_neg, min_length):
+    down_segments = []
+    current_segment = []
+
+    for i, num in enumerate(ct):
+        if num <= H_neg:
+            current_segment.append((i, num))
+        else:
+            if len(current_segment) >= min_length:
+                down_segments.append(current_segment)
+            current_segment = []
+
+    if len(current_segment) >= min_length:
+        down_segments.append(current_segment)
+
+    return down_segments
+
+
+def find_cand_dup_regs(result):
+    cand_cnv_regs = []
+    if result:
+        for res in result:
+            start = res[0][0]
+            end = max(res, key=lambda item: item[1])[0]
+            if end - start >= 1000:
+                cand_cnv_regs.append([start, end])
+        return cand_cnv_regs
+    else:
+        return []
+
+
+def find_cand_del_regs(result):
+    cand_cnv_regs = []
+    if result:
+        for res in result:
+            start = res[0][0]
+            end = min(res, key=lambda item: item[1])[0]
+            if end - start >= 1000:
+                cand_cnv_regs.append([start, end])
+        return cand_cnv_regs
+    else:
+        return []
+
+
+def calcu_logr(cand_cnv_regs, sample_depth, pgg_depth, chr_name, sample):
+    det_results = []
+    if cand_cnv_regs:
+        for cand_cnv_reg in cand_cnv_regs:
+            pgg_interval_depth = np.mean(pgg_depth[chr_name][cand_cnv_reg[0]: cand_cnv_reg[1]])
+            sample_interval_depth = np.mean(sample_depth[chr_name][cand_cnv_reg[0]: cand_cnv_reg[1]])
+            if sample_interval_depth != 0:
+                logR = round(math.log(sample_interval_depth / pgg_interval_depth, 2), 5)
+                if logR >= 0.3 or logR <= -0.3:
+                    if logR > 0.3:
+                        cnv_type = 'dup'
+                    else:
+                        cnv_type = 'del'
+                    det_results.append([sample, chr_name, cand_cnv_reg[0], cand_cnv_reg[1], logR, cnv_type])
+            else:
+                logR = 'NA'
+                cnv_type = 'del'
+                det_results.append([sample, chr_name, cand_cnv_reg[0], cand_cnv_reg[1], logR, cnv_type])
+    return det_results
+
+
+def call_sample(sample, standardized_depth, baseline_data, chr_len_list, slide_win=3000, K=0.3):
+    # CNV rows (as CNV_COLUMNS) of one standardized sample
+    H_pos = np.log2(1.5) * slide_win
+    H_neg = np.log2(0.5) * slide_win
+    det_results = []
+    for chr_name, chr_len in chr_len_list:
+        s = standardized_depth[chr_name]
+        b = baseline_data[chr_name]
+
+        cusum_statistic = calcu_win_depth(s, b, slide_win)
+        ct_up, ct_down = calcu_ct(cusum_statistic, K)
+        result_up = find_continuous_up_segments(ct_up, H_pos=H_pos, min_length=MIN_SEGMENT)
+        result_down = find_continuous_down_segments(ct_down, H_neg=H_neg, min_length=MIN_SEGMENT)
+
+        cand_dup_reg = find_cand_dup_regs(result_up)
+        cand_down_reg = find_cand_del_regs(result_down)
+
+        if cand_dup_reg:
+            det_results.extend(calcu_logr(cand_dup_reg, standardized_depth, baseline_data, chr_name, sample))
+        if cand_down_reg:
+            det_results.extend(calcu_logr(cand_down_reg, standardized_depth, baseline_data, chr_name, sample))
+    return det_results
+
+
+def call_cohort(standardized, baseline_data, chr_len_list, slide_win=3000, K=0.3):
+    # {bam file: standardized depth} -> the calls of all samples, as zip_caller.py writes them
+    det_results = []
+    for file_name, standardized_depth in standardized.items():
+        print(f'process {file_name} ..................')
+        det_results.extend(call_sample(os.path.basename(file_name), standardized_depth, baseline_data,
+                                       chr_len_list, slide_win, K))
+    return pd.DataFrame(det_results, columns=CNV_COLUMNS)
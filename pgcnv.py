@@ -1,58 +1,85 @@
-import networkx as nx
 import torch
-import torch.nn as nn
-import torch.nn.functional as F
 import time
 from datetime import datetime
-from scipy.sparse import coo_matrix
-import pandas as pd
-import pickle
 import os
 import argparse
 from utils import *
+from graph_io import load_graph_file, graph_adjacency
+from gcn import sgc_cache_path, save_model, load_inference_model, predict_unknown, load_checkpoint, score_nodes, write_results, \
+    split_validation, training_view, train_model, model_config
+from graph_prep import prepare_inputs, memory_stage, print_memory_report
 torch.manual_seed(42)
 np.random.seed(42)
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-config', type=str, help="Path to the '.config' file ", required=True)
-parser.add_argument('-k', type=str, help="Path to the '.gpickle' file ", required=True)
+parser.add_argument('-k', type=str, help="Path to the graph (.pgx directory, or a legacy '.gpickle' file)", required=True)
 parser.add_argument('-o', type=str, help="Path to the output file, example: data/output", required=True)
-
-args = parser.parse_args()
-
-
-class GraphConvolution(nn.Module):
-    def __init__(self, in_features, out_features):
-        super(GraphConvolution, self).__init__()
-        self.linear = nn.Linear(in_features, out_features)
-
-    def forward(self, x, adj):
-        x = torch.sparse.mm(adj, x)
-        x = self.linear(x)
-        return x
-
-
-class GCN(nn.Module):
-    def __init__(self, input_dim, hidden_dim, output_dim):
-        super(GCN, self).__init__()
-        self.gc1 = GraphConvolution(input_dim, hidden_dim)
-        self.gc2 = GraphConvolution(hidden_dim, hidden_dim)
-        self.fc = nn.Linear(hidden_dim, output_dim)
-
-    def forward(self, x, adj):
-        x = F.relu(self.gc1(x, adj))
-        x = F.relu(self.gc2(x, adj))
-        x = self.fc(x)
-        return x
-
-
-def sparse_tensor_from_coo(coo):
-    values = coo.data
-    indices = np.vstack((coo.row, coo.col))
-    i = torch.tensor(indices, dtype=torch.long)
-    v = torch.tensor(values, dtype=torch.float32)
-    shape = coo.shape
-    return torch.sparse_coo_tensor(i, v, torch.Size(shape))
+parser.add_argument('-mode', type=str, default='train', choices=['train', 'predict', 'score'],
+                    help="train: train and score the unknown nodes; predict: score them with a saved -model; "
+                         "score: inductive scoring of unknown nodes on their k-hop neighbourhood with a saved -model")
+parser.add_argument('-samples', type=str, default=None,
+                    help="score mode: comma-separated samples whose unknown nodes are scored (default: all)")
+parser.add_argument('-hops', type=int, default=None,
+                    help="score mode: neighbourhood radius (default: the model's, its number of GCN layers)")
+parser.add_argument('-model', type=str, default='model.pth', help="Model file written by train mode; predict and score mode also read gcn_export.py artifacts")
+parser.add_argument('-epochs', type=int, default=200, help="Maximum number of training epochs")
+parser.add_argument('-hidden', type=int, default=64, help="Hidden units per layer")
+parser.add_argument('-layers', type=int, default=2, help="Number of graph convolution (SGC: dense hidden) layers, at least 2")
+parser.add_argument('-lr', type=float, default=0.001, help="Adam learning rate")
+parser.add_argument('-val', type=float, default=0.1, help="Fraction of labeled nodes held out for validation")
+parser.add_argument('-patience', type=int, default=20,
+                    help="Stop after this many epochs without a better validation loss (0: never stop early)")
+parser.add_argument('-checkpoint', type=str, default='pgcnv_checkpoint.pth',
+                    help="Checkpoint written after every epoch, used by -resume")
+parser.add_argument('-resume', action='store_true', default=False, help="Resume training from -checkpoint")
+parser.add_argument('-batch_size', type=int, default=0,
+                    help="Labeled nodes per mini-batch with sampled neighbourhoods, one hop per layer (0: full-batch training)")
+parser.add_argument('-arch', type=str, default='gcn', choices=['gcn', 'sgc'],
+                    help="gcn: sparse GCN; sgc: train a dense head on A·X and A²·X, propagated once and cached next to the graph")
+parser.add_argument('-fanout', type=str, default='10,10',
+                    help="Neighbours sampled per node at each hop, one per layer (the last one repeats for deeper models)")
+parser.add_argument('-trace', action='store_true', default=False,
+                    help="Also report the peak of Python/numpy allocations per stage (tracemalloc); slows the stages down")
+
+
+def select_unknown_nodes(graph, samples=None):
+    if samples is None:
+        return np.where(np.asarray(graph['label']) == -1)[0]
+    sample_pos = {str(s): i for i, s in enumerate(graph['samples'])}
+    node_ids = []
+    for sample in samples.split(','):
+        sample = sample_key(sample)
+        if sample not in sample_pos:
+            print(f"Warning: sample {sample} is not in the graph.")
+            continue
+        i = sample_pos[sample]
+        node_ids.append(np.asarray(graph['sample_nodes'][graph['sample_indptr'][i]:graph['sample_indptr'][i + 1]]))
+    node_ids = np.sort(np.concatenate(node_ids)) if node_ids else np.empty(0, dtype=np.int64)
+    return node_ids[np.asarray(graph['label'])[node_ids] == -1]
+
+
+def train(inputs, adj, cache_file, log_file, resume_state=None):
+    config = model_config(inputs, args.arch, args.hidden, args.layers, args.batch_size, args.fanout.split(','))
+    if resume_state is not None:
+        # The interrupted run's model, split and log; its weights only fit its own config
+        changed = [key for key in config if config[key] != resume_state['config'].get(key)]
+        if changed:
+            print(f"Resuming with the checkpoint's model config, ignoring {', '.join(changed)} from the command line")
+        config = resume_state['config']
+        val_pos = resume_state['val_pos'].numpy()
+        log_file = resume_state.get('log_file', log_file)
+    else:
+        val_pos = split_validation(len(inputs['train_idx']), args.val)
+
+    view = training_view(inputs, config, adj, cache_file)
+    checkpoint_extra = {'config': config, 'feature_norm': inputs['feature_norm'], 'val_pos': torch.from_numpy(val_pos),
+                        'log_file': log_file}
+    model, _ = train_model(view, config, val_pos, lr=args.lr, num_epochs=args.epochs, patience=args.patience,
+                           log_file=log_file, checkpoint_file=args.checkpoint, checkpoint_extra=checkpoint_extra,
+                           resume_state=resume_state)
+    print(f"Training log saved to '{log_file}'")
+    return model, config
 
 
 def main():
@@ -61,94 +88,45 @@ def main():
     os.makedirs(output_path, exist_ok=True)
     output_file = os.path.join(output_path, f'pgcnv_res_{current_datetime}.tsv')
 
-    with open(args.k, 'rb') as f:
-        G = pickle.load(f)
-
-    node_features = []
-    labels = []
-    nodes = list(G.nodes(data=True))
-
-    for node, data in nodes:
-        try:
-            feature = [data['start'], data['length'], data['logr']]
-            label = data['label']
-            node_features.append(feature)
-            labels.append(label)
-        except KeyError as e:
-            print(f"Missing key {e} in node {node}")
-
-    node_features = np.array(node_features, dtype=np.float32)
-    label_mapping = {'0': 0, '1': 1, 'unknown': -1}
-    labels = np.array([label_mapping[str(label)] for label in labels], dtype=np.float32)
-
-    X = torch.tensor(node_features, dtype=torch.float32)
-    y = torch.tensor(labels, dtype=torch.float32)
-
-    adj = nx.adjacency_matrix(G)
-
-    train_idx = np.where(labels != -1)[0]
-    test_idx = np.where(labels == -1)[0]
-
-    X_train = X[train_idx]
-    y_train = y[train_idx]
-
-    X_test = X[test_idx]
-
-    adj_train = adj[train_idx, :][:, train_idx]
-    adj_test = adj[test_idx, :][:, test_idx]
-
-    adj_train = sparse_tensor_from_coo(coo_matrix(adj_train))
-    adj_test = sparse_tensor_from_coo(coo_matrix(adj_test))
-
-    input_dim = X.shape[1]
-    hidden_dim = 64
-    output_dim = 1
-
-    model = GCN(input_dim, hidden_dim, output_dim)
-
-    optimizer = torch.optim.Adam(model.parameters(), lr=float(0.001))
-    loss_fn = nn.BCEWithLogitsLoss()  # Binary Cross Entropy Loss
-
-    num_epochs = 200
-    for epoch in range(num_epochs):
-        model.train()
-        optimizer.zero_grad()
-        output = model(X_train, adj_train)
-        loss = loss_fn(output.squeeze(), y_train)
-        loss.backward()
-        optimizer.step()
-        if (epoch + 1) % 10 == 0:
-            print(f"======================Epoch [{epoch + 1}/{num_epochs}]======================")
-
-    model.eval()
-    with torch.no_grad():
-        output = model(X_test, adj_test)
-        predictions = torch.sigmoid(output).squeeze().numpy()
-
-    torch.save(model.state_dict(), 'model.pth')
-    print("Model saved as 'model.pth'")
-
-    predicted_labels = np.round(predictions).astype(int)
-    test_nodes = np.array(nodes)[test_idx]
-
-    results = []
-    for i, (node, data) in enumerate(test_nodes):
-        result = {
-            'SampleID': node,
-            'Chromosome': data['chr_name'],
-            'Start': data['start'],
-            'End': data['start'] + data['length'],
-            'LogR_Ratio': data['logr'],
-            'Predicted_Label': predicted_labels[i]
-        }
-        results.append(result)
-
-    results_df = pd.DataFrame(results)
-    results_df.to_csv(output_file, sep='\t', index=False)
-    print(f"Results have saved to the '{output_file}' file")
+    graph = load_graph_file(args.k)
+    if args.mode == 'score':
+        # Inductive: only the k-hop neighbourhoods of the scored nodes are read
+        model, config, feature_norm = load_inference_model(args.model)
+        print(f"Loaded {config['arch']} model from '{args.model}'")
+        node_ids = select_unknown_nodes(graph, args.samples)
+        predictions = score_nodes(model, config, feature_norm, graph, node_ids, k=args.hops)
+        write_results(graph, node_ids, predictions, output_file)
+        return
+
+    cache_file = sgc_cache_path(args.k)
+    report = []
+    if args.mode == 'predict':
+        # Inference only: weights, architecture and feature normalization come from the checkpoint
+        model, config, feature_norm = load_inference_model(args.model)
+        print(f"Loaded {config['arch']} model from '{args.model}'")
+        inputs = prepare_inputs(graph, feature_norm, report, args.trace)
+        adj = graph_adjacency(graph) if config['arch'] == 'sgc' else None
+    else:
+        resume_state = load_checkpoint(args.checkpoint) if args.resume else None
+        inputs = prepare_inputs(graph, None if resume_state is None else resume_state['feature_norm'], report,
+                                args.trace)
+        arch = args.arch if resume_state is None else resume_state['config']['arch']
+        adj = graph_adjacency(graph) if arch == 'sgc' else None
+        log_file = f'log/pgcnv_train_{current_datetime}.tsv'
+        with memory_stage('train', report, args.trace):
+            model, config = train(inputs, adj, cache_file, log_file, resume_state)
+        save_model(args.model, model, config, inputs['feature_norm'])
+        print(f"Model saved as '{args.model}'")
+
+    test_idx = inputs['test_idx']
+    with memory_stage('predict', report, args.trace):
+        predictions = predict_unknown(model, config, inputs, adj, cache_file)
+    print_memory_report(report)
+    write_results(graph, test_idx, predictions, output_file)
 
 
 if __name__ == '__main__':
+    args = parser.parse_args()
     st = time.time()
     main()
     et = time.time()
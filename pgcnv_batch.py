@@ -0,0 +1,109 @@
+import torch
+import time
+import os
+import argparse
+import scipy.sparse as sp
+from utils import *
+from gcn import load_inference_model, prepare_unknown_inputs, sparse_tensor_from_coo, predict_minibatch, write_results
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-model', type=str, help="Path to the model file written by pgcnv.py, or an artifact from gcn_export.py",
+                    required=True)
+parser.add_argument('-graphs', type=str, nargs='+',
+                    help="Graphs to score (.pgx directories or .gpickle files), or one .txt file listing them",
+                    required=True)
+parser.add_argument('-o', type=str, help="Output directory, one result TSV per graph", required=True)
+parser.add_argument('-mem', type=int, default=2048, help="Memory limit per packed batch (MB)")
+parser.add_argument('-threads', type=int, default=0, help="Torch CPU threads (0: torch default)")
+
+
+def read_graph_list(paths):
+    if len(paths) == 1 and paths[0].endswith('.txt'):
+        with open(paths[0], 'r') as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return paths
+
+
+def batch_bytes(item, config):
+    # Features, two hidden activations and the sparse adjacency of one graph
+    n = len(item[1])
+    nnz = 0 if item[3] is None else item[3].nnz
+    return n * (item[2].shape[1] + 2 * config['hidden_dim'] + 1) * 4 + nnz * 16
+
+
+def score_batch(model, config, items):
+    # Graphs of one batch are packed into a block-diagonal adjacency and scored in one pass.
+    # Mini-batch models are scored as pgcnv -mode predict scores them: on sampled neighbourhoods,
+    # graph by graph, each with a freshly seeded sampler, so the labels match it exactly.
+    if config['arch'] != 'sgc' and config.get('batch_size', 0) > 0:
+        return [predict_minibatch(model, item[2], item[3].indptr, item[3].indices, np.arange(len(item[1])),
+                                  fanouts=config['fanouts']) for item in items]
+    X = torch.cat([item[2] for item in items])
+    with torch.no_grad():
+        if config['arch'] == 'sgc':
+            output = model(X)
+        else:
+            adj = sp.block_diag([item[3] for item in items], format='coo', dtype=np.float32)
+            output = model(X, sparse_tensor_from_coo(adj))
+    predictions = torch.sigmoid(output).squeeze(-1).numpy()
+    offsets = np.cumsum([0] + [len(item[1]) for item in items])
+    return [predictions[offsets[i]:offsets[i + 1]] for i in range(len(items))]
+
+
+def flush(model, config, batch, output_path, stats):
+    if not batch:
+        return
+    st = time.time()
+    predictions = score_batch(model, config, [item for path, item in batch])
+    stats['score_sec'] += time.time() - st
+    for (path, item), prediction in zip(batch, predictions):
+        name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        # graph.pgx and graph.gpickle must not overwrite each other
+        stats['names'][name] = stats['names'].get(name, 0) + 1
+        if stats['names'][name] > 1:
+            name = f"{name}_{stats['names'][name]}"
+        write_results(item[0], item[1], prediction, os.path.join(output_path, f'{name}_pgcnv_res.tsv'))
+        stats['nodes'] += len(item[1])
+        stats['graphs'] += 1
+    print(f"Batch of {len(batch)} graphs scored, {stats['nodes']} nodes so far")
+
+
+def main():
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    output_path = args.o
+    os.makedirs(output_path, exist_ok=True)
+
+    model, config, feature_norm = load_inference_model(args.model)
+    print(f"Loaded {config['arch']} model from '{args.model}'")
+
+    limit = args.mem * 1024 * 1024
+    stats = {'graphs': 0, 'nodes': 0, 'score_sec': 0.0, 'names': {}}
+    st = time.time()
+    batch = []
+    used = 0
+    for path in read_graph_list(args.graphs):
+        print(f'process {path} ..................')
+        item = prepare_unknown_inputs(path, config, feature_norm)
+        size = batch_bytes(item, config)
+        if batch and used + size > limit:
+            flush(model, config, batch, output_path, stats)
+            batch = []
+            used = 0
+        batch.append((path, item))
+        used += size
+    flush(model, config, batch, output_path, stats)
+
+    total_sec = time.time() - st
+    print(f"Scored {stats['nodes']} nodes in {stats['graphs']} graphs: "
+          f"{stats['nodes'] / max(total_sec, 1e-9):.1f} nodes/sec overall, "
+          f"{stats['nodes'] / max(stats['score_sec'], 1e-9):.1f} nodes/sec in the model")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    st = time.time()
+    main()
+    et = time.time()
+    rt = et - st
+    print(f"Finish! runtime: {rt}sec")
@@ -0,0 +1,138 @@
+import torch
+import torch.multiprocessing as mp
+import time
+import os
+import itertools
+import argparse
+from datetime import datetime
+import pandas as pd
+from utils import *
+from graph_io import load_graph_file, graph_adjacency
+from gcn import build_model, sgc_cache_path, save_model, split_validation, training_view, train_model, model_config
+from graph_prep import prepare_inputs
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-k', type=str, help="Path to the graph (.pgx directory, or a legacy '.gpickle' file)", required=True)
+parser.add_argument('-o', type=str, help="Output directory for the leaderboard and the per-trial training logs",
+                    required=True)
+parser.add_argument('-search', type=str, default='grid', choices=['grid', 'random'],
+                    help="grid: every combination of the values below; random: -trials random combinations")
+parser.add_argument('-trials', type=int, default=10, help="random search: number of trials")
+parser.add_argument('-hidden', type=str, default='32,64,128', help="Hidden units per layer to try")
+parser.add_argument('-lr', type=str, default='0.01,0.001', help="Learning rates to try")
+parser.add_argument('-layers', type=str, default='2,3', help="Depths to try (at least 2)")
+parser.add_argument('-epochs', type=str, default='200', help="Maximum epochs to try")
+parser.add_argument('-arch', type=str, default='gcn', choices=['gcn', 'sgc'], help="Model family, as in pgcnv.py")
+parser.add_argument('-batch_size', type=int, default=0, help="gcn: labeled nodes per mini-batch (0: full-batch training)")
+parser.add_argument('-fanout', type=str, default='10,10',
+                    help="Neighbours sampled per node at each hop, one per layer (the last one repeats for deeper models)")
+parser.add_argument('-val', type=float, default=0.1, help="Fraction of labeled nodes held out for validation")
+parser.add_argument('-patience', type=int, default=20,
+                    help="Stop a trial after this many epochs without a better validation loss (0: never stop early)")
+parser.add_argument('-workers', type=int, default=2, help="Trials run in parallel (1: run them in this process)")
+parser.add_argument('-threads', type=int, default=1, help="Torch CPU threads per trial")
+parser.add_argument('-seed', type=int, default=42, help="Seed of the random search and of the model initialization")
+parser.add_argument('-model', type=str, default=None, help="Save the best trial's model here (same format as pgcnv.py)")
+
+# Set in every worker by init_worker: the preprocessed training tensors, shared, not copied
+shared = {}
+
+
+def parse_values(text, cast):
+    return [cast(v) for v in text.split(',') if v.strip()]
+
+
+def search_space():
+    grid = list(itertools.product(parse_values(args.hidden, int), parse_values(args.lr, float),
+                                  parse_values(args.layers, int), parse_values(args.epochs, int)))
+    if args.search == 'random':
+        rng = np.random.default_rng(args.seed)
+        grid = [grid[i] for i in rng.choice(len(grid), size=args.trials, replace=len(grid) < args.trials)]
+    return [{'trial': i, 'hidden_dim': h, 'lr': lr, 'num_layers': layers, 'epochs': epochs}
+            for i, (h, lr, layers, epochs) in enumerate(grid)]
+
+
+def init_worker(view, val_pos, log_dir, threads, seed, patience):
+    # Spawned workers do not parse the command line: everything they need comes through here
+    torch.set_num_threads(threads)
+    shared.update(view=view, val_pos=val_pos, log_dir=log_dir, seed=seed, patience=patience)
+
+
+def run_trial(item):
+    # The trial's model config is built by model_config in the main process, as in pgcnv.py
+    trial, config = item
+    torch.manual_seed(shared['seed'])
+    log_file = os.path.join(shared['log_dir'], f"trial_{trial['trial']}.tsv")
+    if os.path.isfile(log_file):
+        os.remove(log_file)
+    st = time.time()
+    model, metrics = train_model(shared['view'], config, shared['val_pos'], lr=trial['lr'], num_epochs=trial['epochs'],
+                                 patience=shared['patience'], log_file=log_file, verbose=False)
+    result = dict(trial, epochs_run=len(pd.read_csv(log_file, sep='\t')), train_sec=time.time() - st)
+    for name in ('loss', 'acc', 'f1'):
+        result[f'val_{name}'] = float('nan') if metrics is None else metrics[name]
+    return result, config, model.state_dict()
+
+
+def main():
+    current_datetime = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    output_path = args.o
+    log_dir = os.path.join(output_path, f'pgcnv_search_{current_datetime}')
+    os.makedirs(log_dir, exist_ok=True)
+
+    # The graph is loaded and preprocessed once; every trial trains on the same tensors
+    graph = load_graph_file(args.k)
+    inputs = prepare_inputs(graph)
+    adj = graph_adjacency(graph) if args.arch == 'sgc' else None
+    # The training view only depends on the architecture, not on the trial
+    view = training_view(inputs, model_config(inputs, args.arch), adj, sgc_cache_path(args.k))
+    val_pos = split_validation(len(inputs['train_idx']), args.val)
+    if len(val_pos) == 0:
+        print("Warning: no validation nodes (-val 0), trials are ranked by nothing.")
+
+    trials = [(trial, model_config(inputs, args.arch, trial['hidden_dim'], trial['num_layers'], args.batch_size,
+                                   parse_values(args.fanout, int)))
+              for trial in search_space()]
+    print(f"{len(trials)} trials, {args.workers} workers x {args.threads} threads")
+    init_args = (view, val_pos, log_dir, args.threads, args.seed, args.patience)
+    results = []
+    best = None
+    if args.workers > 1:
+        for tensor in view.values():
+            tensor.share_memory_()
+        pool = mp.get_context('spawn').Pool(args.workers, initializer=init_worker, initargs=init_args)
+        outcomes = pool.imap_unordered(run_trial, trials)
+    else:
+        pool = None
+        init_worker(*init_args)
+        outcomes = map(run_trial, trials)
+    for result, config, state_dict in outcomes:
+        print(f"trial {result['trial']}: val_loss {result['val_loss']:.4f}, {result['train_sec']:.1f}s")
+        results.append(result)
+        if best is None or result['val_loss'] < best[0]['val_loss']:
+            best = (result, config, state_dict)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    leaderboard = pd.DataFrame(results).sort_values(['val_loss', 'train_sec']).reset_index(drop=True)
+    leaderboard_file = os.path.join(output_path, f'pgcnv_search_{current_datetime}.tsv')
+    leaderboard.to_csv(leaderboard_file, sep='\t', index=False)
+    print(leaderboard.to_string(index=False))
+    print(f"Leaderboard saved to '{leaderboard_file}', per-trial logs in '{log_dir}'")
+
+    if args.model is not None and best is not None:
+        result, config, state_dict = best
+        model = build_model(config)
+        model.load_state_dict(state_dict)
+        save_model(args.model, model, config, inputs['feature_norm'])
+        print(f"Best model (trial {result['trial']}) saved as '{args.model}'")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    st = time.time()
+    main()
+    et = time.time()
+    rt = et - st
+    print(f"Finish! runtime: {rt}sec")
@@ -0,0 +1,334 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import shlex
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+from utils import read_config
+from consensus import consensus_file
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-config', type=str, help="Path to the '.config' file ", required=True)
+parser.add_argument('-clist', type=str, default='input_csv/cnv_list.csv', help="CNV list for gen_bubbles.py")
+parser.add_argument('-nwk', type=str, default=None, help="Tree for tree2graph.py (default: nwk_file_path of the config)")
+parser.add_argument('-new', type=str, default=None,
+                    help="New samples (csv list): adds seq_ext of the new samples, Incremental_update.py and the graph update")
+parser.add_argument('-run', type=str, default='runs/default',
+                    help="Run directory: every stage runs in it and writes its artifacts there")
+parser.add_argument('-stages', type=str, default=None,
+                    help="Comma-separated stages to bring up to date, with the stages they depend on (default: all)")
+parser.add_argument('-force', type=str, default='', help="Comma-separated stages to re-run even if up to date")
+parser.add_argument('-extra', type=str, action='append', default=[],
+                    help="Extra arguments of a stage, e.g. -extra \"pgcnv=-epochs 100 -arch sgc\" (repeatable)")
+parser.add_argument('-workers', type=int, default=2, help="Stages run at the same time")
+parser.add_argument('-jobs', type=int, default=1, help="-jobs of the stages that have it")
+parser.add_argument('-dry_run', action='store_true', default=False, help="Only print which stages would run")
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = '.pipeline'
+# Files up to this size are hashed by content, larger ones (BAMs) by size and modification time
+HASH_LIMIT = 16 << 20
+# Config entries that name input files; they are made absolute in the run's config
+INPUT_KEYS = ['test_file_list', 'train_file_list', 'baseline_file_list', 'chr_len_path', 'ref_file', 'nwk_file_path']
+LIST_KEYS = ['test_file_list', 'train_file_list', 'baseline_file_list']
+BASELINE_DIR = 'data/baseline_save_path/'
+ZIPCALL_DIR = 'data/zipcall-output'
+# seq_ext.py -o: the sequence files (and their .fai) stay in the run directory
+SEQ_DIR = 'data/seq'
+
+
+def file_signature(path):
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                digest.update(f'{os.path.relpath(full, path)}:{file_signature(full)}\n'.encode())
+        return digest.hexdigest()
+    if not os.path.exists(path):
+        return 'missing'
+    stat = os.stat(path)
+    if stat.st_size > HASH_LIMIT:
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def local_modules(script, seen=None):
+    # The script and the repository modules it imports, recursively
+    seen = set() if seen is None else seen
+    if script in seen:
+        return seen
+    seen.add(script)
+    with open(os.path.join(REPO, script), 'r', encoding='utf-8') as f:
+        for name in re.findall(r'^\s*(?:from|import)\s+([\w.]+)', f.read(), flags=re.M):
+            # A module of the repository, or of the pangenomex package
+            path = name.replace('.', '/')
+            for module in (path + '.py', path + '/__init__.py'):
+                if os.path.isfile(os.path.join(REPO, module)):
+                    local_modules(module, seen)
+    return seen
+
+
+def sample_list(csv_file, run_dir, name):
+    # The csv list with absolute file names, so that the stages can run in the run directory
+    df = pd.read_csv(csv_file, index_col=0)
+    df['file_name'] = [os.path.abspath(f) for f in df['file_name']]
+    path = os.path.join(run_dir, 'inputs', name)
+    df.to_csv(path)
+    return path
+
+
+def write_run_config(paths, run_dir, name, lists):
+    # The user's config with absolute input paths; the baseline is an artifact of the run
+    run_paths = dict(paths)
+    for key in INPUT_KEYS:
+        if key in run_paths and run_paths[key] != '0':
+            run_paths[key] = os.path.abspath(run_paths[key])
+    run_paths.update(lists)
+    run_paths['baseline_save_path'] = BASELINE_DIR
+    path = os.path.join(run_dir, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        for key, value in run_paths.items():
+            f.write(f"{key} = '{value}'\n")
+    return path
+
+
+def samples(csv_file):
+    return list(pd.read_csv(csv_file, index_col=0)['file_name'])
+
+
+def standardized_file(bam_file):
+    return os.path.join('data/nor', os.path.basename(bam_file).replace('.bam', '.json'))
+
+
+def newest_cnv(run_dir):
+    # zip_caller.py names its output after the time it ran
+    found = glob.glob(os.path.join(run_dir, ZIPCALL_DIR, 'zipcaller_res_*.cnv'))
+    return os.path.relpath(max(found, key=os.path.getmtime), run_dir) if found else 'missing.cnv'
+
+
+def build_stages(run_dir):
+    # Each stage: script, arguments, stages it runs after, input and output paths (relative
+    # paths are in the run directory). Arguments may name '{cnv}', resolved when the stage starts.
+    paths = read_config(args.config)
+    os.makedirs(os.path.join(run_dir, 'inputs'), exist_ok=True)
+    lists = {key: sample_list(paths[key], run_dir, key + '.csv') for key in LIST_KEYS
+             if key in paths and paths[key] != '0' and os.path.isfile(paths[key])}
+    config = write_run_config(paths, run_dir, 'pipeline.config', lists)
+    run_paths = read_config(config)
+    clist = os.path.abspath(args.clist)
+    nwk = os.path.abspath(args.nwk or paths['nwk_file_path'])
+    lists = list(lists.values())
+    bams = [f for csv_file in lists for f in samples(csv_file)]
+    sequence_bams = [f for key in ('train_file_list', 'test_file_list') if key in run_paths
+                     for f in samples(run_paths[key])]
+    # Standardized depths of the samples a stage reads; not all of data/nor, which
+    # Incremental_update.py extends with the new samples
+    test_json = [standardized_file(f) for f in samples(run_paths['test_file_list'])]
+    train_json = [standardized_file(f) for f in samples(run_paths['train_file_list'])] \
+        if 'train_file_list' in lists_of(run_paths) and run_paths['train_file_list'] != '0' else []
+
+    stages = {
+        'data_processing': {'script': 'data_processing.py', 'after': [],
+                            'args': ['-config', config, '-jobs', args.jobs],
+                            'inputs': [config, run_paths['chr_len_path']] + lists + bams,
+                            'outputs': ['data/nor', 'rj_means_and_n.json', 'rj_stats.npz', BASELINE_DIR]},
+        'zip_caller': {'script': 'zip_caller.py', 'after': ['data_processing'],
+                       'args': ['-config', config, '-o', ZIPCALL_DIR],
+                       'inputs': [config, BASELINE_DIR] + test_json,
+                       'outputs': [ZIPCALL_DIR]},
+        'seq_ext': {'script': 'seq_ext.py', 'after': [],
+                    'args': ['-config', config, '-o', SEQ_DIR, '-jobs', args.jobs],
+                    'inputs': [config, run_paths['ref_file']] + lists + bams,
+                    'outputs': []},
+        'gen_bubbles': {'script': 'gen_bubbles.py', 'after': ['data_processing'],
+                        'args': ['-config', config, '-clist', clist, '-o', 'bub_results.npz'],
+                        'inputs': [config, clist, BASELINE_DIR] + train_json + test_json,
+                        'outputs': ['bub_results.npz']},
+        'tree2graph': {'script': 'tree2graph.py', 'after': ['gen_bubbles', 'zip_caller'],
+                       'args': ['-nwk', nwk, '-npz', 'bub_results.npz', '-cnv', '{cnv}', '-o', 'graph.pgx'],
+                       'inputs': [nwk, 'bub_results.npz', ZIPCALL_DIR],
+                       'outputs': ['graph.pgx', 'df_edge.csv']},
+        'pgcnv': {'script': 'pgcnv.py', 'after': ['tree2graph'],
+                  'args': ['-config', config, '-k', 'graph.pgx', '-o', 'data/output', '-model', 'model.pth',
+                           '-checkpoint', 'pgcnv_checkpoint.pth'],
+                  'inputs': [config, 'graph.pgx'],
+                  'outputs': ['data/output', 'model.pth']},
+    }
+    if args.new is not None:
+        # The new samples' sequences are extracted with a config that lists only them
+        new_list = sample_list(args.new, run_dir, 'new_file_list.csv')
+        empty_list = os.path.join(run_dir, 'inputs', 'empty.csv')
+        pd.DataFrame(columns=['file_name', 'mapping']).to_csv(empty_list)
+        new_config = write_run_config(paths, run_dir, 'pipeline_new.config',
+                                      dict(lists_of(run_paths), train_file_list=new_list, test_file_list=empty_list))
+        new_bams = samples(new_list)
+        stages.update({
+            'seq_ext_new': {'script': 'seq_ext.py', 'after': [],
+                            'args': ['-config', new_config, '-o', SEQ_DIR, '-jobs', args.jobs],
+                            'inputs': [new_config, run_paths['ref_file'], new_list] + new_bams,
+                            'outputs': []},
+            'Incremental_update': {'script': 'Incremental_update.py',
+                                   'after': ['tree2graph', 'seq_ext', 'seq_ext_new'],
+                                   'args': ['-config', config, '-i', new_list, '-rj', 'rj_means_and_n.json',
+                                            '-bub', 'bub_results.npz', '-edge', 'df_edge.csv', '-seq_dir', SEQ_DIR,
+                                            '-jobs', args.jobs],
+                                   'inputs': [config, new_list, 'rj_means_and_n.json', 'rj_stats.npz',
+                                              'bub_results.npz', 'df_edge.csv'] + new_bams,
+                                   'outputs': ['new_bub_results.npz', 'new_df_edge.csv']},
+            'graph_update': {'script': 'tree2graph.py', 'after': ['Incremental_update'],
+                             'args': ['-nwk', nwk, '-npz', 'bub_results.npz', '-cnv', '{cnv}', '-update',
+                                      '-g', 'graph.pgx', '-o', 'graph_updated.pgx'],
+                             'inputs': ['new_bub_results.npz', 'new_df_edge.csv', 'graph.pgx', ZIPCALL_DIR],
+                             'outputs': ['graph_updated.pgx']},
+        })
+    for item in args.extra:
+        name, _, extra = item.partition('=')
+        if name not in stages:
+            raise ValueError(f"-extra: unknown stage '{name}' (stages: {', '.join(stages)})")
+        stages[name]['args'] = stages[name]['args'] + shlex.split(extra)
+    # The sequence files' extension follows seq_ext's -format, which -extra may set
+    stages['seq_ext']['outputs'] = sequence_files(stages['seq_ext'], sequence_bams)
+    if args.new is not None:
+        stages['seq_ext_new']['outputs'] = sequence_files(stages['seq_ext_new'], new_bams)
+        stages['Incremental_update']['inputs'] += stages['seq_ext']['outputs'] + stages['seq_ext_new']['outputs']
+    return stages
+
+
+def sequence_files(stage, bam_files):
+    # The last -format in the stage's arguments wins, as with argparse
+    args = [str(arg) for arg in stage['args']]
+    formats = [value for flag, value in zip(args, args[1:]) if flag == '-format']
+    fmt = formats[-1] if formats else 'fas'
+    return [consensus_file(f, fmt, SEQ_DIR) for f in bam_files]
+
+
+def lists_of(run_paths):
+    return {key: run_paths[key] for key in LIST_KEYS if key in run_paths}
+
+
+def selected_stages(stages):
+    # The requested stages and, transitively, the stages they run after
+    if args.stages is None:
+        return list(stages)
+    wanted = set()
+    todo = [name.strip() for name in args.stages.split(',') if name.strip()]
+    while todo:
+        name = todo.pop()
+        if name not in stages:
+            raise ValueError(f"Unknown stage '{name}' (stages: {', '.join(stages)})")
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(stages[name]['after'])
+    return [name for name in stages if name in wanted]
+
+
+def resolve_args(stage, run_dir):
+    return [newest_cnv(run_dir) if arg == '{cnv}' else str(arg) for arg in stage['args']]
+
+
+def stage_key(name, stage, run_dir):
+    # Hash of the code, the arguments and the inputs; it is computed when the stage is about to
+    # start, so the outputs of the stages it runs after are part of it
+    digest = hashlib.sha256(name.encode())
+    for module in sorted(local_modules(stage['script'])):
+        digest.update(f'{module}:{file_signature(os.path.join(REPO, module))}\n'.encode())
+    digest.update(json.dumps(resolve_args(stage, run_dir)).encode())
+    for path in stage['inputs']:
+        digest.update(f'{path}:{file_signature(os.path.join(run_dir, path))}\n'.encode())
+    return digest.hexdigest()
+
+
+def state_file(run_dir, name):
+    return os.path.join(run_dir, STATE_DIR, name + '.json')
+
+
+def up_to_date(name, stage, run_dir, key):
+    path = state_file(run_dir, name)
+    if name in args.force.split(',') or not os.path.isfile(path):
+        return False
+    with open(path, 'r') as f:
+        state = json.load(f)
+    return state.get('key') == key and all(os.path.exists(os.path.join(run_dir, p)) for p in stage['outputs'])
+
+
+def run_stage(name, stage, run_dir, key):
+    command = [sys.executable, os.path.join(REPO, stage['script'])] + resolve_args(stage, run_dir)
+    log_file = os.path.join(run_dir, 'logs', name + '.log')
+    st = time.time()
+    with open(log_file, 'w') as log:
+        log.write(' '.join(shlex.quote(c) for c in command) + '\n')
+        log.flush()
+        code = subprocess.run(command, cwd=run_dir, stdout=log, stderr=subprocess.STDOUT).returncode
+    runtime = time.time() - st
+    if code == 0:
+        with open(state_file(run_dir, name), 'w') as f:
+            json.dump({'key': key, 'runtime': runtime, 'finished': time.strftime('%Y-%m-%d %H:%M:%S')}, f, indent=4)
+    return code, runtime
+
+
+def main():
+    run_dir = os.path.abspath(args.run)
+    for sub in (STATE_DIR, 'logs', 'inputs'):
+        os.makedirs(os.path.join(run_dir, sub), exist_ok=True)
+    stages = build_stages(run_dir)
+    pending = selected_stages(stages)
+    status = {}
+    running = {}
+    with ThreadPoolExecutor(max(args.workers, 1)) as executor:
+        while pending or running:
+            for name in list(pending):
+                stage = stages[name]
+                after = [n for n in stage['after'] if n in pending or n in running or n in status]
+                if any(status.get(n, ('',))[0] in ('failed', 'not run') for n in after):
+                    status[name] = ('not run', 0.0)
+                    pending.remove(name)
+                    continue
+                if any(n in pending or n in running for n in after) or len(running) >= max(args.workers, 1):
+                    continue
+                pending.remove(name)
+                key = stage_key(name, stage, run_dir)
+                # A dry run does not produce the outputs of the stages it would run, so their
+                # dependents count as out of date
+                upstream_stale = args.dry_run and any(status[n][0] == 'would run' for n in after)
+                if not upstream_stale and up_to_date(name, stage, run_dir, key):
+                    print(f"{name}: up to date")
+                    status[name] = ('cached', 0.0)
+                elif args.dry_run:
+                    print(f"{name}: would run")
+                    status[name] = ('would run', 0.0)
+                else:
+                    print(f"{name}: running ......")
+                    running[name] = executor.submit(run_stage, name, stage, run_dir, key)
+            if not running:
+                continue
+            done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name in [n for n, future in running.items() if future in done]:
+                code, runtime = running.pop(name).result()
+                status[name] = ('ran' if code == 0 else 'failed', runtime)
+                print(f"{name}: {'done' if code == 0 else f'failed (exit code {code})'} in {runtime:.1f}s, "
+                      f"log: {os.path.join(run_dir, 'logs', name + '.log')}")
+
+    print(f"\n{'stage':<20}{'status':<12}runtime")
+    for name in stages:
+        if name in status:
+            print(f"{name:<20}{status[name][0]:<12}{status[name][1]:.1f}s")
+    if any(s == 'failed' for s, _ in status.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    st = time.time()
+    main()
+    et = time.time()
+    rt = et - st
+    print(f"Finish! runtime: {rt}sec")
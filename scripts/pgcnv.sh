@@ -7,7 +7,7 @@
 #SBATCH --error=%j.err
 
 #  Python ű
-python3 pgcnv.py -config my.config -k graph.gpickle -o data/pgcnv_output
+python3 pgcnv.py -config my.config -k graph.pgx -o data/pgcnv_output
 
 
 
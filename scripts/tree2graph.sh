@@ -7,7 +7,7 @@
 #SBATCH --error=%j.err               # Standard error will go to jobID.err
 
 #  Python ű
-python3 tree2graph.py -nwk mynwk.nwk -npz data/bub_results.npz -cnv data/zipcall-output/zipcaller_res_2025-04-01_16-25-47.cnv -o graph.gpickle
+python3 tree2graph.py -nwk mynwk.nwk -npz data/bub_results.npz -cnv data/zipcall-output/zipcaller_res_2025-04-01_16-25-47.cnv -o graph.pgx
 
 
 
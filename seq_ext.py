@@ -1,64 +1,86 @@
 import os
 import time
 import warnings
-from tqdm import trange
+from multiprocessing.shared_memory import SharedMemory
+from tqdm import tqdm
 import pandas as pd
+import pysam
 import argparse
 from utils import *
+from consensus import BufferPool, fill_from_bam, stream_consensus, backfill_reference, write_consensus, consensus_file
+from twobit import write_twobit
+from fasta import open_records
 warnings.filterwarnings('ignore')
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-config', type=str, help="Path to the '.config' file ", required=True)
-args = parser.parse_args()
-
-
-def init_dict(seq):
-    initialized_dict = {}
-    for key, value in seq.items():
-        initialized_dict[key] = 'R' * len(value)
-    return initialized_dict
-
-
-def fill_seq_from_bam(sequence, bam_file):
-    alignments = read_bam_file(bam_file)
-
-    for alignment in alignments:
-        rname = alignment['RNAME']
-        pos = alignment['POS']
-        seq = alignment['SEQ']
-
-        if rname in sequence:
-            start_idx = pos - 1
-            end_idx = start_idx + len(seq)
-
-            if not isinstance(sequence[rname], np.ndarray):
-                sequence[rname] = np.array(list(sequence[rname]))
-
-            sequence[rname][start_idx:end_idx] = list(seq)
-
-    for rname in sequence:
-        sequence[rname] = ''.join(sequence[rname])
-
-    return sequence
-
-
-def replace_with_ref(sequence, filled_sequence):
-    replaced_sequence = filled_sequence.copy()
-    for key, value in filled_sequence.items():
-        original_value = sequence[key]
-        replaced_value = ''
-        for i in range(len(value)):
-            if value[i] == 'R':
-                replaced_value += original_value[i]
-            else:
-                replaced_value += value[i]
-        replaced_sequence[key] = replaced_value
-    return replaced_sequence
-
-
-def write_seq_to_file(sequence, filename):
-    with open(filename, 'w') as file:
-        file.write(f'>{file}\n{sequence}\n')
+parser.add_argument('-jobs', type=int, default=1, help="Samples processed in parallel")
+parser.add_argument('-format', type=str, default='fas', choices=['fas', '2bit'],
+                    help="fas: one FASTA line per sample; 2bit: UCSC .2bit, 2 bits per base (about 4x smaller)")
+parser.add_argument('-o', type=str, default=None,
+                    help="Directory of the sequence files (default: next to each BAM)")
+
+
+def attach_reference():
+    # Views of the chromosomes in the shared reference block, once per worker
+    if 'reference' not in shared:
+        shared['shm'] = SharedMemory(name=shared['shm_name'])
+        shared['reference'] = {name: np.ndarray(length, dtype=np.uint8, buffer=shared['shm'].buf, offset=offset)
+                               for name, (offset, length) in shared['layout'].items()}
+    return shared['reference']
+
+
+def detach_reference():
+    # The views go first: the block cannot be closed while they exist
+    shared.pop('reference', None)
+    if 'shm' in shared:
+        shared.pop('shm').close()
+
+
+def bam_index(bam_file):
+    # (indexed, index file) for the streaming path: the BAM's own index, or one built next to
+    # the sequence files. (False, None) if the BAM cannot be indexed (not coordinate-sorted).
+    with pysam.AlignmentFile(bam_file, "r") as bam:
+        if bam.has_index():
+            return True, None
+    index_file = os.path.join(shared['out_dir'] or os.path.dirname(bam_file), os.path.basename(bam_file) + '.bai')
+    if os.path.isfile(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(bam_file):
+        return True, index_file
+    try:
+        pysam.index(bam_file, index_file)
+    except pysam.SamtoolsError:
+        return False, None
+    return True, index_file
+
+
+def extract_sample(bam_file):
+    # output: seq.fas (or seq.2bit), named after the sample
+    reference = attach_reference()
+    file_name = consensus_file(bam_file, shared['format'], shared['out_dir'])
+    write = write_twobit if shared['format'] == '2bit' else write_consensus
+    sample = os.path.basename(os.path.splitext(bam_file)[0])
+    indexed, index_file = bam_index(bam_file)
+    if indexed:
+        # One chromosome at a time: a worker holds one buffer of the longest chromosome
+        if 'buffer' not in shared:
+            shared['buffer'] = np.empty(max(length for _, length in shared['layout'].values()), dtype=np.uint8)
+        write(file_name, sample, stream_consensus(bam_file, reference, shared['buffer'], index_file))
+        return bam_file
+    if shared['parallel']:
+        raise ValueError(f"{bam_file} is not coordinate-sorted, so it cannot be indexed and every worker would need "
+                         f"genome-sized buffers: sort it (samtools sort) or run with -jobs 1")
+    # A BAM that cannot be indexed: the reads are streamed once, into genome-sized buffers
+    if 'pool' not in shared:
+        shared['pool'] = BufferPool({name: length for name, (_, length) in shared['layout'].items()})
+    buffers = shared['pool'].acquire()
+    try:
+        fill_from_bam(buffers, bam_file)
+        for key, buffer in buffers.items():
+            backfill_reference(buffer, reference[key])
+        write(file_name, sample, buffers.values())
+    finally:
+        shared['pool'].release(buffers)
+    return bam_file
 
 
 def main():
@@ -76,37 +98,35 @@ def main():
 
     ref_file = paths['ref_file']
 
-    sequence = read_fasta_file(ref_file)
-    initialized_sequence = init_dict(sequence)
-
-    for i in trange(train_df.shape[0]):
-        time.sleep(0.01)
-        mapping = f"sample_{i}"
-        train_filename = train_df.loc[train_df['mapping'] == mapping]['file_name'].values[0]
-        print(f'process {train_filename} ..................')
-
-        # output: seq.fas
-        file_name = os.path.splitext(train_filename)[0] + '.fas'
-        filled_sequence = fill_seq_from_bam(initialized_sequence, train_filename)
-        replaced_sequence = replace_with_ref(sequence, filled_sequence)
-        concatenated_sequence = ''.join(replaced_sequence.values())
-        write_seq_to_file(concatenated_sequence, file_name)
-
-    for i in trange(test_df.shape[0]):
-        time.sleep(0.01)
-        mapping = f"sample_{i}"
-        test_filename = test_df.loc[test_df['mapping'] == mapping]['file_name'].values[0]
-        print(f'process {test_filename} ..................')
-
-        # output: seq.fas
-        file_name = os.path.splitext(test_filename)[0] + '.fas'
-        filled_sequence = fill_seq_from_bam(initialized_sequence, test_filename)
-        replaced_sequence = replace_with_ref(sequence, filled_sequence)
-        concatenated_sequence = ''.join(replaced_sequence.values())
-        write_seq_to_file(concatenated_sequence, file_name)
+    # The reference is loaded once, as uint8, into one shared memory block that every
+    # worker maps: chromosome `name` occupies layout[name] = (offset, length)
+    records = dict(open_records(ref_file))
+    layout = {}
+    offset = 0
+    for name, seq in records.items():
+        layout[name] = (offset, len(seq))
+        offset += len(seq)
+    shm = SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for name, seq in records.items():
+            np.ndarray(len(seq), dtype=np.uint8, buffer=shm.buf, offset=layout[name][0])[:] = seq
+        del records
+
+        bam_files = sample_files(train_df) + sample_files(test_df)
+        if args.o:
+            os.makedirs(args.o, exist_ok=True)
+        batches = run_batches(extract_sample, bam_files, args.jobs, shm_name=shm.name, layout=layout,
+                              format=args.format, out_dir=args.o, parallel=args.jobs > 1)
+        for bam_file in tqdm(batches, total=len(bam_files)):
+            print(f'process {bam_file} ..................')
+    finally:
+        detach_reference()
+        shm.close()
+        shm.unlink()
 
 
 if __name__ == '__main__':
+    args = parser.parse_args()
     st = time.time()
     main()
     et = time.time()
@@ -0,0 +1,169 @@
+import os
+import numpy as np
+from fasta import open_records
+
+KMER_SIZE = 21
+SKETCH_SIZE = 2048
+SKETCH_SEED = 42
+CHUNK_SIZE = 1 << 22
+# Padding for sketches of sequences with fewer than SKETCH_SIZE distinct k-mers
+EMPTY_HASH = np.iinfo(np.uint64).max
+
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate('ACGT'):
+    BASE_CODES[ord(base)] = i
+    BASE_CODES[ord(base.lower())] = i
+
+
+def encode_sequence(seq):
+    # A/C/G/T -> 0..3, anything else (N, gaps) -> 4
+    if isinstance(seq, str):
+        seq = seq.encode('ascii')
+    if not isinstance(seq, np.ndarray):
+        seq = np.frombuffer(seq, dtype=np.uint8)
+    return BASE_CODES[seq]
+
+
+def mix64(x, seed=SKETCH_SEED):
+    # splitmix64 finalizer; uint64 arithmetic wraps around
+    with np.errstate(over='ignore'):
+        z = x + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def kmer_hashes(codes, k=KMER_SIZE, seed=SKETCH_SEED):
+    # Hashes of all k-mers without an ambiguous base, 2 bits per base (k <= 32)
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    bad = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid = bad[k:] - bad[:n] == 0
+    # Words of 1, 2, 4, ... bases are built by doubling and combined into k-mers,
+    # O(log k) passes over the chunk instead of k
+    kmers = None
+    width = 0
+    word = (codes & 3).astype(np.uint64)
+    word_len = 1
+    while True:
+        if k & word_len:
+            if kmers is None:
+                kmers = word[:n].copy()
+            else:
+                kmers = (kmers << np.uint64(2 * word_len)) | word[width:width + n]
+            width += word_len
+        if word_len * 2 > k:
+            break
+        word = (word[:-word_len] << np.uint64(2 * word_len)) | word[word_len:]
+        word_len *= 2
+    return mix64(kmers[valid], seed)
+
+
+def merge_sketch(sketch, hashes, size=SKETCH_SIZE):
+    # Bottom-k: the `size` smallest distinct hashes seen so far
+    if len(sketch) == size:
+        hashes = hashes[hashes < sketch[-1]]
+    if len(hashes) > 4 * size:
+        # Cheap pre-selection; it holds `size` distinct hashes unless the chunk is very repetitive
+        threshold = np.partition(hashes, 4 * size)[4 * size]
+        selected = np.unique(hashes[hashes <= threshold])
+        if len(selected) >= size:
+            hashes = selected
+    return np.unique(np.concatenate((sketch, hashes)))[:size]
+
+
+def sketch_sequence(seq, k=KMER_SIZE, size=SKETCH_SIZE, sketch=None):
+    # Chunked so memory stays bounded at chromosome scale; chunks overlap by k - 1 bases.
+    # `seq` may be a str, bytes or a uint8 array (e.g. a view mapped from the FASTA file).
+    sketch = np.empty(0, dtype=np.uint64) if sketch is None else sketch
+    for begin in range(0, max(len(seq) - k + 1, 0), CHUNK_SIZE):
+        chunk = encode_sequence(seq[begin:begin + CHUNK_SIZE + k - 1])
+        sketch = merge_sketch(sketch, kmer_hashes(chunk, k), size)
+    return sketch
+
+
+def sketch_fasta(filename, k=KMER_SIZE, size=SKETCH_SIZE):
+    sketch = np.empty(0, dtype=np.uint64)
+    for _, seq in open_records(filename):
+        sketch = sketch_sequence(seq, k, size, sketch)
+    return sketch
+
+
+def padded(sketch, size=SKETCH_SIZE):
+    row = np.full(size, EMPTY_HASH, dtype=np.uint64)
+    row[:len(sketch)] = sketch
+    return row
+
+
+def new_index(k=KMER_SIZE, size=SKETCH_SIZE):
+    return {'k': k, 'size': size, 'names': np.empty(0, dtype=str), 'hashes': np.empty((0, size), dtype=np.uint64),
+            'file_size': np.empty(0, dtype=np.int64), 'mtime': np.empty(0, dtype=np.float64)}
+
+
+def load_index(path):
+    data = np.load(path, allow_pickle=False)
+    index = {key: data[key] for key in ('names', 'hashes', 'file_size', 'mtime')}
+    index['k'] = int(data['k'])
+    index['size'] = int(data['size'])
+    return index
+
+
+def save_index(index, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **index)
+    os.replace(tmp, path)
+
+
+def update_index(index, filenames, names=None):
+    # Sketch the sequence files (FASTA or .2bit) that are new or changed since they were indexed;
+    # entries are keyed by `names`, by default the file basenames. Returns the number of files sketched.
+    position = {str(name): i for i, name in enumerate(index['names'])}
+    names = [os.path.basename(filename) for filename in filenames] if names is None else names
+    sketched = 0
+    for filename, name in zip(filenames, names):
+        stat = os.stat(filename)
+        i = position.get(name)
+        if i is not None and index['file_size'][i] == stat.st_size and index['mtime'][i] == stat.st_mtime:
+            continue
+        print(f'sketch {filename} ..................')
+        row = padded(sketch_fasta(filename, index['k'], index['size']), index['size'])
+        if i is None:
+            position[name] = len(index['names'])
+            index['names'] = np.append(index['names'], name)
+            index['hashes'] = np.vstack((index['hashes'], row))
+            index['file_size'] = np.append(index['file_size'], stat.st_size)
+            index['mtime'] = np.append(index['mtime'], stat.st_mtime)
+        else:
+            index['hashes'][i] = row
+            index['file_size'][i] = stat.st_size
+            index['mtime'][i] = stat.st_mtime
+        sketched += 1
+    return sketched
+
+
+def jaccard(hashes, sketch):
+    # Bottom-k Jaccard estimate of `sketch` against every row of `hashes`, all at once.
+    # Only hashes up to the smaller of the two sketch maxima are comparable.
+    sketch = sketch[sketch != EMPTY_HASH]
+    if len(sketch) == 0 or len(hashes) == 0:
+        return np.zeros(len(hashes))
+    # Rows are sorted and padded at the end, so a row's maximum sits before its padding
+    counts = (hashes != EMPTY_HASH).sum(axis=1)
+    row_max = np.where(counts > 0, hashes[np.arange(len(hashes)), np.maximum(counts - 1, 0)], 0)
+    threshold = np.minimum(row_max, sketch[-1])
+    below = (hashes <= threshold[:, None]).sum(axis=1)
+    pos = np.minimum(np.searchsorted(sketch, hashes), len(sketch) - 1)
+    shared = ((sketch[pos] == hashes) & (hashes <= threshold[:, None])).sum(axis=1)
+    union = below + np.searchsorted(sketch, threshold, side='right') - shared
+    return shared / np.maximum(union, 1)
+
+
+def query_index(index, sketch, candidates=None, top=1):
+    # The `top` most similar indexed samples as (name, jaccard), optionally among `candidates` only
+    similarity = jaccard(index['hashes'], sketch)
+    if candidates is not None:
+        similarity = np.where(np.isin(index['names'], list(candidates)), similarity, -1.0)
+    order = np.argsort(-similarity, kind='stable')[:top]
+    return [(str(index['names'][i]), float(similarity[i])) for i in order if similarity[i] >= 0]
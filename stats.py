@@ -0,0 +1,246 @@
+import math
+import numpy as np
+
+
+class MomentStats:
+    # Per-position count, sum and sum of squares over samples. Summaries of disjoint
+    # sample batches merge by addition, so the order of merging does not matter.
+    def __init__(self, length=0):
+        self.count = 0
+        self.total = np.zeros(length)
+        self.total_sq = np.zeros(length)
+
+    def update(self, values):
+        # values: one sample (positions) or a batch (samples x positions)
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[None, :]
+        if self.count == 0 and len(self.total) != values.shape[1]:
+            self.total = np.zeros(values.shape[1])
+            self.total_sq = np.zeros(values.shape[1])
+        self.count += values.shape[0]
+        self.total += values.sum(axis=0)
+        self.total_sq += np.square(values).sum(axis=0)
+        return self
+
+    def merge(self, other):
+        if self.count == 0:
+            return other.copy()
+        if other.count == 0:
+            return self.copy()
+        if len(self.total) != len(other.total):
+            raise ValueError(f"Cannot merge statistics of length {len(self.total)} and {len(other.total)}")
+        merged = MomentStats()
+        merged.count = self.count + other.count
+        merged.total = self.total + other.total
+        merged.total_sq = self.total_sq + other.total_sq
+        return merged
+
+    def subtract(self, other):
+        # Inverse of merge: drops the samples summarized in `other`, which must be among these
+        if other.count == 0:
+            return self.copy()
+        if other.count > self.count or len(self.total) != len(other.total):
+            raise ValueError(f"Cannot subtract statistics of {other.count} samples from {self.count}")
+        remaining = MomentStats()
+        remaining.count = self.count - other.count
+        remaining.total = self.total - other.total
+        remaining.total_sq = self.total_sq - other.total_sq
+        return remaining
+
+    def copy(self):
+        stats = MomentStats()
+        stats.count = self.count
+        stats.total = self.total.copy()
+        stats.total_sq = self.total_sq.copy()
+        return stats
+
+    def mean(self):
+        return self.total / max(self.count, 1)
+
+    def var(self):
+        # Population variance; clipped at 0 against rounding
+        return np.maximum(self.total_sq / max(self.count, 1) - np.square(self.mean()), 0)
+
+    def std(self):
+        return np.sqrt(self.var())
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}count': np.asarray(self.count), f'{prefix}sum': self.total, f'{prefix}sumsq': self.total_sq}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        stats = cls()
+        stats.count = int(arrays[f'{prefix}count'])
+        stats.total = np.asarray(arrays[f'{prefix}sum'], dtype=np.float64)
+        stats.total_sq = np.asarray(arrays[f'{prefix}sumsq'], dtype=np.float64)
+        return stats
+
+    @classmethod
+    def from_mean(cls, mean, count):
+        # From a stored mean only (e.g. an older rj_means_and_n.json): the sum of squares is unknown
+        stats = cls()
+        stats.count = int(count)
+        stats.total = np.asarray(mean, dtype=np.float64) * count
+        stats.total_sq = np.full(len(stats.total), np.nan)
+        return stats
+
+
+class QuantileSketch:
+    # Approximate quantiles of non-negative values: logarithmic buckets with relative
+    # accuracy `alpha` (as in DDSketch) plus a counter for zeros. Bucket counts of two
+    # sketches with the same alpha merge by addition.
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.zeros = 0
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if np.any(values < 0):
+            raise ValueError("QuantileSketch only accepts non-negative values")
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        if len(positive):
+            keys = np.ceil(np.log(positive) / math.log(self.gamma)).astype(np.int64)
+            low = int(keys.min())
+            self._add(low, np.bincount(keys - low))
+        return self
+
+    def _add(self, offset, counts):
+        if len(self.counts) == 0:
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+        low = min(self.offset, offset)
+        high = max(self.offset + len(self.counts), offset + len(counts))
+        merged = np.zeros(high - low, dtype=np.int64)
+        merged[self.offset - low:self.offset - low + len(self.counts)] += self.counts
+        merged[offset - low:offset - low + len(counts)] += counts
+        self.offset, self.counts = low, merged
+
+    def merge(self, other):
+        if self.alpha != other.alpha:
+            raise ValueError(f"Cannot merge sketches with alpha {self.alpha} and {other.alpha}")
+        merged = QuantileSketch(self.alpha)
+        merged.zeros = self.zeros + other.zeros
+        merged._add(self.offset, self.counts)
+        merged._add(other.offset, other.counts)
+        return merged
+
+    def subtract(self, other):
+        # Inverse of merge; values land in the same buckets, so the counts are exact
+        if self.alpha != other.alpha:
+            raise ValueError(f"Cannot subtract a sketch with alpha {other.alpha} from {self.alpha}")
+        remaining = QuantileSketch(self.alpha)
+        remaining.zeros = self.zeros - other.zeros
+        remaining._add(self.offset, self.counts)
+        remaining._add(other.offset, -other.counts)
+        if remaining.zeros < 0 or np.any(remaining.counts < 0):
+            raise ValueError("Cannot subtract values the sketch does not contain")
+        return remaining
+
+    @property
+    def count(self):
+        return self.zeros + int(self.counts.sum())
+
+    def quantile(self, q):
+        if self.count == 0:
+            return float('nan')
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.counts), rank - self.zeros, side='right'))
+        # Bucket midpoint: within alpha of every value in the bucket
+        return 2 * self.gamma ** (self.offset + i) / (self.gamma + 1)
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}alpha': np.asarray(self.alpha), f'{prefix}zeros': np.asarray(self.zeros),
+                f'{prefix}offset': np.asarray(self.offset), f'{prefix}counts': self.counts}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        sketch = cls(float(arrays[f'{prefix}alpha']))
+        sketch.zeros = int(arrays[f'{prefix}zeros'])
+        sketch.offset = int(arrays[f'{prefix}offset'])
+        sketch.counts = np.asarray(arrays[f'{prefix}counts'], dtype=np.int64)
+        return sketch
+
+
+class CohortSummary:
+    # Per-chromosome MomentStats of sample depths and a QuantileSketch of all their values.
+    # Built per sample batch (in any process) and combined with merge().
+    def __init__(self):
+        self.moments = {}
+        self.sketches = {}
+
+    def update(self, sample_depth):
+        for chr_name, depth in sample_depth.items():
+            self.moments.setdefault(chr_name, MomentStats()).update(depth)
+            self.sketches.setdefault(chr_name, QuantileSketch()).update(depth)
+        return self
+
+    def merge(self, other):
+        merged = CohortSummary()
+        for chr_name in set(self.moments) | set(other.moments):
+            merged.moments[chr_name] = self.moments.get(chr_name, MomentStats()).merge(
+                other.moments.get(chr_name, MomentStats()))
+        for chr_name in set(self.sketches) | set(other.sketches):
+            if chr_name in self.sketches and chr_name in other.sketches:
+                merged.sketches[chr_name] = self.sketches[chr_name].merge(other.sketches[chr_name])
+            else:
+                merged.sketches[chr_name] = self.sketches.get(chr_name, other.sketches.get(chr_name))
+        return merged
+
+    def subtract(self, other):
+        # The summary without the samples of `other` (e.g. old values of re-standardized samples)
+        remaining = CohortSummary()
+        for chr_name, moments in self.moments.items():
+            remaining.moments[chr_name] = moments.subtract(other.moments.get(chr_name, MomentStats()))
+        for chr_name, sketch in self.sketches.items():
+            remaining.sketches[chr_name] = (sketch.subtract(other.sketches[chr_name]) if chr_name in other.sketches
+                                            else sketch)
+        return remaining
+
+    def count(self, chr_name):
+        return self.moments[chr_name].count if chr_name in self.moments else 0
+
+    def mean(self, chr_name):
+        return self.moments[chr_name].mean()
+
+    def median(self, chr_name):
+        return self.sketches[chr_name].median() if chr_name in self.sketches else float('nan')
+
+    def save(self, path):
+        arrays = {'chr_names': np.array(sorted(self.moments), dtype=str)}
+        for chr_name in self.moments:
+            arrays.update(self.moments[chr_name].to_arrays(f'{chr_name}:'))
+            if chr_name in self.sketches:
+                arrays.update(self.sketches[chr_name].to_arrays(f'{chr_name}:sketch_'))
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        summary = cls()
+        with np.load(path, allow_pickle=False) as arrays:
+            for chr_name in arrays['chr_names']:
+                chr_name = str(chr_name)
+                summary.moments[chr_name] = MomentStats.from_arrays(arrays, f'{chr_name}:')
+                if f'{chr_name}:sketch_counts' in arrays:
+                    summary.sketches[chr_name] = QuantileSketch.from_arrays(arrays, f'{chr_name}:sketch_')
+        return summary
+
+
+def merge_all(summaries):
+    # Pairwise tree reduction; any grouping gives the same result
+    summaries = list(summaries)
+    if not summaries:
+        return CohortSummary()
+    while len(summaries) > 1:
+        summaries = [summaries[i].merge(summaries[i + 1]) if i + 1 < len(summaries) else summaries[i]
+                     for i in range(0, len(summaries), 2)]
+    return summaries[0]
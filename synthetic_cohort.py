@@ -0,0 +1,195 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import pysam
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-o', type=str, help="Output directory of the cohort", required=True)
+parser.add_argument('-samples', type=int, default=12, help="Samples, split into baseline, train and test thirds")
+parser.add_argument('-length', type=int, default=200000, help="Genome length, split evenly over the chromosomes")
+parser.add_argument('-chroms', type=int, default=2, help="Number of chromosomes")
+parser.add_argument('-depth', type=float, default=20,
+                    help="Mean read depth; at low depth the integer median depth of a sample offsets its standardized values")
+parser.add_argument('-read_len', type=int, default=100, help="Read length")
+parser.add_argument('-cnvs', type=int, default=1, help="CNVs planted per train / test sample")
+parser.add_argument('-cnv_len', type=int, default=30000, help="Length of a planted CNV")
+parser.add_argument('-seed', type=int, default=42)
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+# Copy ratios of planted CNVs (of a diploid region: one copy lost, two and four copies gained),
+# strong enough for ZIP-Caller's default thresholds
+CNV_RATIOS = (0.5, 2.0, 3.0)
+
+
+def group_sizes(samples):
+    # Thirds, at least two samples each
+    base = max(samples // 3, 2)
+    return {'baseline': base, 'train': base, 'test': max(samples - 2 * base, 2)}
+
+
+def chromosome_lengths(length, chroms):
+    size = length // chroms
+    return [[f'chr{i + 1}', size] for i in range(chroms)]
+
+
+def random_reference(chr_len_list, rng):
+    return {chr_name: BASES[rng.integers(0, 4, size=chr_len)] for chr_name, chr_len in chr_len_list}
+
+
+def write_reference(filename, reference, width=60):
+    with open(filename, 'wb') as file:
+        for chr_name, seq in reference.items():
+            file.write(b'>' + chr_name.encode() + b'\n')
+            for begin in range(0, len(seq), width):
+                file.write(seq[begin:begin + width].tobytes() + b'\n')
+
+
+def plant_cnvs(chr_len_list, count, cnv_len, read_len, rng):
+    # (chr_name, start, end, ratio), at most one per chromosome and away from the chromosome ends
+    cnvs = []
+    for i in rng.permutation(len(chr_len_list))[:count]:
+        chr_name, chr_len = chr_len_list[i]
+        margin = read_len + 1000
+        if chr_len - 2 * margin <= cnv_len:
+            continue
+        start = int(rng.integers(margin, chr_len - margin - cnv_len))
+        cnvs.append((chr_name, start, start + cnv_len, float(rng.choice(CNV_RATIOS))))
+    return cnvs
+
+
+def read_starts(chr_len, read_len, depth, cnvs, rng):
+    # Sorted read starts; a CNV scales the chance of a read starting in it by its copy ratio
+    weights = np.ones(chr_len - read_len + 1)
+    for start, end, ratio in cnvs:
+        weights[start:end] *= ratio
+    count = int(round(depth * weights.sum() / read_len))
+    return np.sort(rng.choice(len(weights), size=count, p=weights / weights.sum()))
+
+
+def write_bam(filename, reference, starts, read_len):
+    # Coordinate-sorted and indexed; every read is an exact copy of the reference
+    chr_names = list(reference)
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'SN': chr_name, 'LN': len(reference[chr_name])} for chr_name in chr_names]}
+    qualities = pysam.qualitystring_to_array('I' * read_len)
+    count = 0
+    with pysam.AlignmentFile(filename, 'wb', header=header) as bam:
+        for ref_id, chr_name in enumerate(chr_names):
+            seq = reference[chr_name].tobytes().decode('ascii')
+            for start in starts[chr_name].tolist():
+                read = pysam.AlignedSegment()
+                read.query_name = f'r{count}'
+                read.reference_id = ref_id
+                read.reference_start = start
+                read.mapping_quality = 60
+                read.cigartuples = [(0, read_len)]
+                read.query_sequence = seq[start:start + read_len]
+                read.query_qualities = qualities
+                bam.write(read)
+                count += 1
+    pysam.index(filename)
+    return count
+
+
+def clade(leaves, rng):
+    # Balanced binary tree with random support values, as in the example .nwk files
+    if len(leaves) == 1:
+        return leaves[0]
+    half = len(leaves) // 2
+    return f'({clade(leaves[:half], rng)},{clade(leaves[half:], rng)}){rng.uniform(0.5, 1.0):.2f}'
+
+
+def newick_tree(leaves, rng):
+    leaves = [leaves[i] for i in rng.permutation(len(leaves))]
+    return clade(leaves, rng).rsplit(')', 1)[0] + ');\n'
+
+
+def sample_list(bam_files, filename):
+    pd.DataFrame({'file_name': bam_files, 'mapping': [f'sample_{i}' for i in range(len(bam_files))]}).to_csv(filename)
+
+
+def generate_cohort(out_dir, samples=12, length=200000, chroms=2, depth=20, read_len=100, cnvs=1, cnv_len=30000,
+                    seed=42):
+    # A cohort the stage scripts (and pipeline.py) run on as is: reference, chr_len.bed, indexed BAMs,
+    # baseline / train / test lists, the train CNV list, a tree over the train and test samples and
+    # my.config. truth.csv lists every planted CNV.
+    out_dir = os.path.abspath(out_dir)
+    os.makedirs(os.path.join(out_dir, 'bams'), exist_ok=True)
+    rng = np.random.default_rng(seed)
+    chr_len_list = chromosome_lengths(length, chroms)
+    reference = random_reference(chr_len_list, rng)
+    write_reference(os.path.join(out_dir, 'ref.fasta'), reference)
+    with open(os.path.join(out_dir, 'chr_len.bed'), 'w') as file:
+        file.write(''.join(f'{chr_name}\t{chr_len}\n' for chr_name, chr_len in chr_len_list))
+
+    # Samples draw their CNVs from one site per chromosome, so related samples share CNVs and
+    # their bubbles are joined into graph edges, as in a real cohort
+    sites = plant_cnvs(chr_len_list, chroms, cnv_len, read_len, rng)
+    truth = []
+    lists = {}
+    reads = 0
+    for group, size in group_sizes(samples).items():
+        lists[group] = []
+        for i in range(size):
+            bam_file = os.path.join(out_dir, 'bams', f'{group}{i}.bam')
+            planted = [] if group == 'baseline' else [sites[j] for j in sorted(rng.permutation(len(sites))[:cnvs])]
+            starts = {chr_name: read_starts(chr_len, read_len, depth,
+                                            [(s, e, r) for c, s, e, r in planted if c == chr_name], rng)
+                      for chr_name, chr_len in chr_len_list}
+            reads += write_bam(bam_file, reference, starts, read_len)
+            truth.extend([bam_file, group, c, s, e, np.round(np.log2(r), 2)] for c, s, e, r in planted)
+            lists[group].append(bam_file)
+        sample_list(lists[group], os.path.join(out_dir, f'{group}.csv'))
+
+    truth_df = pd.DataFrame(truth, columns=['file_name', 'group', 'chr_name', 'start_pos', 'end_pos', 'logr'])
+    truth_df.to_csv(os.path.join(out_dir, 'truth.csv'))
+    # Labels for gen_bubbles.py: the CNVs of the training samples
+    truth_df[truth_df['group'] == 'train'].drop(columns='group').reset_index(drop=True).to_csv(
+        os.path.join(out_dir, 'clist.csv'))
+
+    # Leaves named like the seq_ext outputs (<sample>.fas), as df_edge.csv expects
+    leaves = [os.path.basename(f).replace('.bam', '.fas') for f in lists['train'] + lists['test']]
+    with open(os.path.join(out_dir, 'tree.nwk'), 'w') as file:
+        file.write(newick_tree(leaves, rng))
+
+    config = {
+        'test_file_list': os.path.join(out_dir, 'test.csv'),
+        'baseline_file_list': os.path.join(out_dir, 'baseline.csv'),
+        'train_file_list': os.path.join(out_dir, 'train.csv'),
+        'baseline_save_path': os.path.join(out_dir, 'data', 'baseline_save_path') + '/',
+        'chr_len_path': os.path.join(out_dir, 'chr_len.bed'),
+        'read_len': read_len,
+        'ref_file': os.path.join(out_dir, 'ref.fasta'),
+        'nwk_file_path': os.path.join(out_dir, 'tree.nwk'),
+    }
+    with open(os.path.join(out_dir, 'my.config'), 'w') as file:
+        file.write(''.join(f"{key} = '{value}'\n" if isinstance(value, str) else f"{key} = {value}\n"
+                           for key, value in config.items()))
+    return {
+        'dir': out_dir,
+        'config': os.path.join(out_dir, 'my.config'),
+        'clist': os.path.join(out_dir, 'clist.csv'),
+        'nwk': os.path.join(out_dir, 'tree.nwk'),
+        'groups': {group: len(files) for group, files in lists.items()},
+        'reads': reads,
+        'cnvs': len(truth_df),
+    }
+
+
+def main():
+    cohort = generate_cohort(args.o, args.samples, args.length, args.chroms, args.depth, args.read_len, args.cnvs,
+                             args.cnv_len, args.seed)
+    print(f"{sum(cohort['groups'].values())} samples ({', '.join(f'{n} {g}' for g, n in cohort['groups'].items())}), "
+          f"{cohort['reads']} reads, {cohort['cnvs']} planted CNVs in '{cohort['dir']}'")
+    print(f"python3 pipeline.py -config {cohort['config']} -clist {cohort['clist']} -nwk {cohort['nwk']}")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    st = time.time()
+    main()
+    et = time.time()
+    rt = et - st
+    print(f"Finish! runtime: {rt}sec")
@@ -0,0 +1,193 @@
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+# UCSC .2bit (as read by twoBitToFa): 2 bits per base, T C A G -> 0..3, first base in the
+# high bits; runs of N and of lowercase bases are stored as blocks. IUPAC codes other than
+# N are stored as N.
+SIGNATURE = 0x1A412743
+PACK_BLOCK = 1 << 22
+
+# Per ASCII byte, in one lookup: 2-bit code | 4 if not a base (stored as N) | 8 if lowercase
+BASE_CLASS = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate(b'TCAG'):
+    BASE_CLASS[base] = BASE_CLASS[base + 32] = i
+BASE_CLASS[ord('a'):ord('z') + 1] |= 8
+NOT_BASE, LOWER = np.uint8(4), np.uint8(8)
+# Packed byte -> its four ASCII bases, as a little-endian uint32
+UNPACK = np.array([int.from_bytes(bytes(b'TCAG'[(v >> shift) & 3] for shift in (6, 4, 2, 0)), 'little')
+                   for v in range(256)], dtype='<u4')
+# Four codes in the bytes of a little-endian uint32, times this, have their packed byte in the top 8 bits
+PACK_MULTIPLIER = np.uint32((1 << 30) + (1 << 20) + (1 << 10) + 1)
+
+
+def is_twobit(filename):
+    with open(filename, 'rb') as file:
+        head = file.read(4)
+    return len(head) == 4 and SIGNATURE in struct.unpack('<I', head) + struct.unpack('>I', head)
+
+
+def runs(mask, offset=0):
+    # Runs of True as (starts, ends), ends exclusive
+    if not mask.any():
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1) + offset, np.flatnonzero(edges == -1) + offset
+
+
+def merge_runs(pieces):
+    # Runs from consecutive blocks; those touching at a block boundary become one
+    starts = np.concatenate([s for s, _ in pieces] + [np.empty(0, dtype=np.int64)])
+    ends = np.concatenate([e for _, e in pieces] + [np.empty(0, dtype=np.int64)])
+    if len(starts) < 2:
+        return starts, ends
+    keep = np.concatenate(([True], starts[1:] != ends[:-1]))
+    return starts[keep], np.concatenate((ends[:-1][keep[1:]], ends[-1:]))
+
+
+def pack(codes):
+    # Four 2-bit codes per byte, the first in the high bits; len(codes) is a multiple of 4
+    return ((np.ascontiguousarray(codes).view('<u4') * PACK_MULTIPLIER) >> np.uint32(24)).astype(np.uint8)
+
+
+def blocks_bytes(starts, ends):
+    return (struct.pack('<I', len(starts)) + starts.astype('<u4').tobytes()
+            + (ends - starts).astype('<u4').tobytes())
+
+
+def write_twobit(filename, name, chunks):
+    # One record, from its bases in chunks (bytes-like, e.g. uint8 arrays), as write_consensus.
+    # The N and mask blocks precede the packed bases in the file but are only known at the
+    # end, so the packed bases are spooled to a temporary file next to the output.
+    name = name.encode()
+    if len(name) > 255:
+        raise ValueError(f"Sequence name longer than 255 bytes: {name[:40]}...")
+    n_runs, mask_runs = [], []
+    size = 0
+    carry = np.empty(0, dtype=np.uint8)
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(filename))) as packed:
+        for chunk in chunks:
+            if not isinstance(chunk, np.ndarray):
+                chunk = np.frombuffer(chunk, dtype=np.uint8)
+            for begin in range(0, len(chunk), PACK_BLOCK):
+                block = BASE_CLASS[chunk[begin:begin + PACK_BLOCK]]
+                n_runs.append(runs((block & NOT_BASE) != 0, size))
+                mask_runs.append(runs((block & LOWER) != 0, size))
+                size += len(block)
+                codes = np.concatenate((carry, block & np.uint8(3)))
+                whole = len(codes) - len(codes) % 4
+                packed.write(pack(codes[:whole]).tobytes())
+                carry = codes[whole:]
+        if len(carry):
+            packed.write(pack(np.concatenate((carry, np.zeros(4 - len(carry), dtype=np.uint8)))).tobytes())
+        if size >= 1 << 32:
+            raise ValueError(f"{filename}: {size} bases do not fit a .2bit record")
+
+        header = struct.pack('<4I', SIGNATURE, 0, 1, 0)
+        offset = len(header) + 1 + len(name) + 4
+        record = (struct.pack('<I', size) + blocks_bytes(*merge_runs(n_runs))
+                  + blocks_bytes(*merge_runs(mask_runs)) + struct.pack('<I', 0))
+        packed.seek(0)
+        with open(filename + '.tmp', 'wb') as file:
+            file.write(header + bytes([len(name)]) + name + struct.pack('<I', offset) + record)
+            shutil.copyfileobj(packed, file, PACK_BLOCK)
+    os.replace(filename + '.tmp', filename)
+
+
+class TwoBitFile:
+    # Records and regions of a .2bit file as uint8 ASCII arrays, like fasta.IndexedFasta.
+    # The file is mapped from disk and only the bytes of the requested region are unpacked.
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+        head = self.data[:16].tobytes()
+        self.endian = '<' if struct.unpack('<I', head[:4])[0] == SIGNATURE else '>'
+        signature, version, count, _ = struct.unpack(self.endian + '4I', head)
+        if signature != SIGNATURE:
+            raise ValueError(f"{filename} is not a .2bit file")
+        offset_format = self.endian + ('Q' if version == 1 else 'I')
+        width = struct.calcsize(offset_format)
+        position = 16
+        self.offsets = {}
+        for _ in range(count):
+            length = int(self.data[position])
+            name = self.data[position + 1:position + 1 + length].tobytes().decode()
+            position += 1 + length
+            self.offsets[name] = struct.unpack(offset_format, self.data[position:position + width].tobytes())[0]
+            position += width
+        self.headers = {}
+
+    def read_ints(self, position, count):
+        return np.frombuffer(self.data[position:position + 4 * count], dtype=self.endian + 'u4').astype(np.int64)
+
+    def record_header(self, name):
+        # (size, N blocks, mask blocks, offset of the packed bases); blocks as (starts, ends)
+        if name not in self.headers:
+            position = self.offsets[name]
+            size, n_count = self.read_ints(position, 2)
+            n_starts = self.read_ints(position + 8, n_count)
+            n_sizes = self.read_ints(position + 8 + 4 * n_count, n_count)
+            position += 8 + 8 * n_count
+            mask_count = self.read_ints(position, 1)[0]
+            mask_starts = self.read_ints(position + 4, mask_count)
+            mask_sizes = self.read_ints(position + 4 + 4 * mask_count, mask_count)
+            position += 4 + 8 * mask_count + 4
+            self.headers[name] = (int(size), (n_starts, n_starts + n_sizes),
+                                  (mask_starts, mask_starts + mask_sizes), position)
+        return self.headers[name]
+
+    @property
+    def names(self):
+        return list(self.offsets)
+
+    def length(self, name):
+        return self.record_header(name)[0]
+
+    def region(self, name, start=0, end=None):
+        size, n_blocks, mask_blocks, dna = self.record_header(name)
+        end = size if end is None else min(end, size)
+        start = max(0, min(start, end))
+        first = start // 4
+        packed = self.data[dna + first:dna + (end + 3) // 4]
+        seq = UNPACK[packed].view(np.uint8)[start - 4 * first:end - 4 * first]
+        for s, e in zip(*clipped(n_blocks, start, end)):
+            seq[s:e] = ord('N')
+        for s, e in zip(*clipped(mask_blocks, start, end)):
+            seq[s:e] += 32
+        return seq
+
+    def record(self, name):
+        return self.region(name)
+
+    def records(self):
+        # Lazy sequences: slicing one unpacks just that slice
+        for name in self.offsets:
+            yield name, TwoBitSequence(self, name)
+
+
+def clipped(blocks, start, end):
+    # The blocks overlapping [start, end), clipped to it and relative to `start`
+    starts, ends = blocks
+    inside = (starts < end) & (ends > start)
+    return np.maximum(starts[inside], start) - start, np.minimum(ends[inside], end) - start
+
+
+class TwoBitSequence:
+    def __init__(self, twobit, name):
+        self.twobit = twobit
+        self.name = name
+
+    def __len__(self):
+        return self.twobit.length(self.name)
+
+    def __getitem__(self, key):
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("TwoBitSequence slices must be contiguous")
+        return self.twobit.region(self.name, start, stop)
+
+    def __array__(self, dtype=None, copy=None):
+        seq = self.twobit.region(self.name)
+        return seq if dtype is None else seq.astype(dtype)
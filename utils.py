@@ -1,43 +1,22 @@
 import numpy as np
 import json
+import os
 import pysam
+from multiprocessing import Pool
+from fasta import read_records
 
-def read_fasta_file(filename):
-    sequences = {}
-    current_sequence = ""
-
-    with open(filename, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if line.startswith('>'):
-                if current_sequence:
-                    sequences[sequence_name] = current_sequence
-                    current_sequence = ""
-                sequence_name = line[1:]
-            else:
-                current_sequence += line
+# Read-only inputs of run_batches workers, set once per worker process
+shared = {}
 
-        if current_sequence:
-            sequences[sequence_name] = current_sequence
-
-    return sequences
+def read_fasta_file(filename):
+    return dict(read_fasta_file2(filename))
 
 
 def read_fasta_file2(filename):
-    with open(filename, 'r') as file:
-        sequence_name = ""
-        current_sequence = ""
-        for line in file:
-            line = line.strip()
-            if line.startswith('>'):
-                if current_sequence:
-                    yield sequence_name, current_sequence
-                    current_sequence = ""
-                sequence_name = line[1:]
-            else:
-                current_sequence += line
-        if current_sequence:
-            yield sequence_name, current_sequence
+    # Whole records as str; fasta.IndexedFasta gives views of records and regions instead
+    for sequence_name, sequence in read_records(filename):
+        if sequence:
+            yield sequence_name, sequence.decode('ascii')
 
 
 def read_sam_file(filename):
@@ -120,6 +99,16 @@ def calcu_bam_dep(chr_len_list, filename, read_len):
     return sample_depth
 
 
+def sample_key(name):
+    # 's_928_adjusted.fas', '/path/to/s_928_adjusted.bam' -> 's_928_adjusted'
+    return os.path.basename(str(name)).split('.')[0]
+
+
+def sample_files(df):
+    # The samples of a file list in their mapping order (sample_0, sample_1, ...), as the stage scripts read them
+    return [df.loc[df['mapping'] == f"sample_{i}"]['file_name'].values[0] for i in range(df.shape[0])]
+
+
 def read_config(file_path):
     paths = {}
     with open(file_path, 'r', encoding='utf-8') as file:
@@ -152,3 +141,18 @@ def load_from_json(input_file):
 
     return standardized_depths
 
+
+def set_shared(values):
+    shared.update(values)
+
+
+def run_batches(func, batches, jobs, **values):
+    # Map `func` over sample batches, in `jobs` worker processes when jobs > 1. `values`
+    # reach the workers once, as `shared`; results are yielded batch by batch, in order.
+    if jobs <= 1:
+        set_shared(values)
+        for batch in batches:
+            yield func(batch)
+        return
+    with Pool(jobs, initializer=set_shared, initargs=(values,)) as pool:
+        yield from pool.imap(func, batches)